@@ -1,20 +1,178 @@
 from pathlib import Path
-import argparse, sys
+import argparse, sys, os
+import glob
 import logging
 import datetime
-import subprocess
 import threading
-from queue import Queue
+from queue import PriorityQueue, Empty
+import itertools
+import heapq
+import shutil
+import socket
 import tempfile
+import time
 
 from .config import read_config
+from .index import TaskIndex, digest
+from .schedule import estimate_cost, default_workers
+from .preview import extract_preview
+from .journal import Journal
+from . import execute
 
-logging.basicConfig(level=logging.DEBUG)
+RAW = ['.RW2','.nef','.NEF','.ORF']
+# number of scanned jobs kept back to hand out the most expensive first
+LOOKAHEAD = 4096
+# the temporary directories renders go to, they carry the host and process
+# so that those of killed runs can be told apart from those in use
+TMP_PREFIX = '.archive-'
+# seconds after which a temporary directory of another host is stale
+STALE = 24*3600
 
-def generate_tasks(indir,outdir,pattern):
-    raw = ['.RW2','.nef','.NEF','.ORF']
+def _tmp_prefix():
+    return '{}{}-{}-'.format(TMP_PREFIX,socket.gethostname(),os.getpid())
+
+def _alive(pid):
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _stale(entry):
+    try:
+        host,pid = entry.name[len(TMP_PREFIX):].rsplit('-',2)[:2]
+        pid = int(pid)
+    except ValueError:
+        host,pid = None,None
+    if host == socket.gethostname():
+        return not _alive(pid)
+    try:
+        return time.time()-entry.stat().st_mtime > STALE
+    except FileNotFoundError:
+        return False
+
+def remove_stale(outdir,entries=None):
+    # remove the temporary directories left behind by killed runs
+    if entries is None:
+        try:
+            entries = list(os.scandir(outdir))
+        except FileNotFoundError:
+            return
+    for e in entries:
+        if e.name.startswith(TMP_PREFIX) and e.is_dir(follow_symlinks=False) and _stale(e):
+            logging.info('removing {}'.format(e.path))
+            shutil.rmtree(e.path,ignore_errors=True)
+
+def _stat(entries,name):
+    e = entries.get(name)
+    if e is None:
+        return None
+    return e.stat()
+
+def _scan_directory(d,od,old):
+    try:
+        entries = {e.name:e for e in os.scandir(d)}
+    except FileNotFoundError:
+        entries = {}
+    try:
+        outputs = {e.name:e for e in os.scandir(od)}
+    except FileNotFoundError:
+        outputs = {}
+    remove_stale(od,outputs.values())
+
+    records = []
+    for name in sorted(entries):
+        if os.path.splitext(name)[1] not in RAW:
+            continue
+        st = entries[name].stat()
+        xst = _stat(entries,name+'.xmp')
+        ost = _stat(outputs,os.path.splitext(name)[0]+'.jpg')
+        prev = old.get(name)
+
+        r = {'name':name,'size':st.st_size,'mtime':st.st_mtime_ns,
+             'xmp_size':None,'xmp_mtime':None,'xmp_digest':None,
+             'out_size':None,'out_mtime':None}
+        # only hash files whose size or mtime changed
+        if prev is not None and (prev['size'],prev['mtime']) == (r['size'],r['mtime']):
+            r['digest'] = prev['digest']
+        else:
+            r['digest'] = digest(entries[name].path,st.st_size)
+        if xst is not None:
+            r['xmp_size'] = xst.st_size
+            r['xmp_mtime'] = xst.st_mtime_ns
+            if prev is not None and (prev['xmp_size'],prev['xmp_mtime']) == (r['xmp_size'],r['xmp_mtime']):
+                r['xmp_digest'] = prev['xmp_digest']
+            else:
+                r['xmp_digest'] = digest(entries[name+'.xmp'].path,xst.st_size)
+        if ost is not None:
+            r['out_size'] = ost.st_size
+            r['out_mtime'] = ost.st_mtime_ns
+        signature = '{}:{}'.format(r['digest'],r['xmp_digest'])
+
+        if ost is None:
+            pending = True
+        else:
+            pending = r['mtime'] > r['out_mtime'] or \
+                (r['xmp_mtime'] is not None and r['xmp_mtime'] > r['out_mtime'])
+            # inputs were touched but their content is what was rendered
+            if pending and prev is not None and prev['rendered'] == signature and \
+               (prev['out_size'],prev['out_mtime']) == (r['out_size'],r['out_mtime']):
+                pending = False
+        if pending:
+            r['rendered'] = prev['rendered'] if prev is not None and ost is not None else None
+        else:
+            r['rendered'] = signature
+        r['pending'] = int(pending)
+        records.append(r)
+    return records
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _sidecars_changed(d,old):
+    # sidecars edited in place do not change the directory mtime, compare
+    # them with the index
+    try:
+        sidecars = dict((e.name[:-4],(e.stat().st_size,e.stat().st_mtime_ns))
+                        for e in os.scandir(d) if e.name.endswith('.xmp'))
+    except FileNotFoundError:
+        return True
+    indexed = dict((name,(r['xmp_size'],r['xmp_mtime'])) for name,r in old.items()
+                   if r['xmp_mtime'] is not None)
+    return any(sidecars.get(name) != st for name,st in indexed.items()) or \
+        any(name in old and name not in indexed for name in sidecars)
+
+def _indexed_tasks(indir,outdir,pattern,index,rescan=False):
+    for d in sorted(glob.glob(os.path.join(str(indir),str(pattern),''),recursive=True)):
+        d = Path(d)
+        od = outdir/d.relative_to(indir)
+        state = (_mtime(d),_mtime(od))
+        old = index.files(d)
+        if not rescan and index.directory(d) == state and not _sidecars_changed(d,old):
+            records = [r for name,r in sorted(old.items()) if r['pending']]
+        else:
+            logging.debug('scanning directory {}'.format(d))
+            records = _scan_directory(d,od,old)
+            index.update(d,state[0],state[1],records)
+            records = [r for r in records if r['pending']]
+        for r in records:
+            f = d/r['name']
+            xf = None
+            if r['xmp_mtime'] is not None:
+                xf = Path(str(f)+'.xmp')
+            yield f,xf,od/f.with_suffix('.jpg').name
+
+def generate_tasks(indir,outdir,pattern,index=None,rescan=False):
+    if index is not None:
+        yield from _indexed_tasks(indir,outdir,pattern,index,rescan=rescan)
+        return
     for f in indir.glob(str(pattern/'*')):
-        if f.suffix in raw:
+        if f.suffix in RAW:
             xf = Path(str(f)+'.xmp')
             of = outdir/f.relative_to(indir).with_suffix('.jpg')
             if not xf.exists():
@@ -27,58 +185,383 @@ def generate_tasks(indir,outdir,pattern):
             else:
                 yield f,xf,of
 
+DARKTABLE = '/usr/bin/darktable-cli'
+
+def make_jobs(todo,batch=1):
+    # group the (cost,task) list by output directory and sidecar into jobs of
+    # at most batch tasks, darktable-cli picks up the default sidecar itself
+    groups = {}
+    for c,t in todo:
+        infile,xmpfile,outfile = t
+        if xmpfile is not None and xmpfile == Path(str(infile)+'.xmp'):
+            xmpfile = None
+        groups.setdefault((outfile.parent,xmpfile),[]).append((c,t))
+    jobs = []
+    for group in groups.values():
+        for i in range(0,len(group),batch):
+            chunk = group[i:i+batch]
+            jobs.append((sum(c for c,t in chunk),[t for c,t in chunk]))
+    jobs.sort(key=lambda j: j[0],reverse=True)
+    return jobs
+
+class Stats:
+    # accumulate the time spent in the different stages of the pipeline
+    STAGES = ('scan','queue','render')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.times = dict((s,0.) for s in self.STAGES)
+        self.counts = dict((s,0) for s in self.STAGES)
+
+    def add(self,stage,seconds,count=1):
+        with self._lock:
+            self.times[stage] += seconds
+            self.counts[stage] += count
+
+    def report(self):
+        for s in self.STAGES:
+            if self.counts[s] > 0:
+                logging.info('{:6s}: {:8.1f}s total, {:6.2f}s per item, {} items'.format(
+                    s,self.times[s],self.times[s]/self.counts[s],self.counts[s]))
+
 class Worker(threading.Thread):
-    def __init__(self,tasks,lock):
+    def __init__(self,tasks,darktable=DARKTABLE,journal=None,retries=2,backoff=5,
+                 stats=None,stop=None,timeout=None):
         super().__init__(daemon=True)
         self.tasks = tasks
-        self.lock = lock
+        self.darktable = darktable
+        self.journal = journal
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.stats = stats if stats is not None else Stats()
+        self.stop = stop if stop is not None else threading.Event()
         self.cfgdir = tempfile.TemporaryDirectory()
-        
-    def run(self):
-        while True:
-            infile,xmpfile,outfile = self.tasks.get()
-
-            if not outfile.parent.exists():
-                with self.lock:
-                    if not outfile.parent.exists():
-                        logging.info('create directory {}'.format(outfile.parent))
-                        outfile.parent.mkdir(parents=True,exist_ok=True)
+        self.processed = 0
+        self.failed = []
 
-            cmd = ['/usr/bin/darktable-cli','--width','2048','--height','1024',str(infile)]
+    def command(self,job,outdir):
+        cmd = [str(self.darktable),'--width','2048','--height','1024']
+        if len(job) == 1:
+            infile,xmpfile,outfile = job[0]
+            cmd.append(str(infile))
             if xmpfile is not None:
                 cmd.append(str(xmpfile))
-            cmd.append(str(outfile))
-            cmd += ['--core','--configdir',self.cfgdir.name]
+            cmd.append(str(outdir/outfile.name))
+        else:
+            cmd += [str(t[0]) for t in job]
+            xmpfile = job[0][1]
+            if xmpfile is not None and xmpfile != Path(str(job[0][0])+'.xmp'):
+                cmd.append(str(xmpfile))
+            cmd += [str(outdir),'--out-ext','jpg']
+        cmd += ['--core','--configdir',self.cfgdir.name,
+                '--conf','plugins/imageio/storage/disk/overwrite=1']
+        return cmd
+
+    def render(self,job,outdir):
+        # render the job into outdir, return the error of each task
+        cmd = self.command(job,outdir)
+        logging.info('running {}'.format(' '.join(cmd)))
+        try:
+            execute.run(cmd,tool='darktable',timeout=self.timeout)
+            error = None
+        except Exception as e:
+            error = e
+        return [(t,error) for t in job]
+
+    def record(self,event,task,**extra):
+        if self.journal is not None:
+            self.journal.record(event,task,**extra)
+
+    def process(self,job):
+        # render into a temporary directory next to the outputs and move the
+        # results into place so that no truncated output is ever left behind
+        results = []
+        with tempfile.TemporaryDirectory(dir=job[0][2].parent,prefix=_tmp_prefix()) as tmpdir:
+            tmpdir = Path(tmpdir)
+            for t,error in self.render(job,tmpdir):
+                result = tmpdir/t[2].name
+                if result.exists():
+                    os.replace(result,t[2])
+                    error = None
+                elif error is None:
+                    error = RuntimeError('no output produced for {}'.format(t[0]))
+                results.append((t,error))
+        return results
+
+    def work(self,todo):
+        # render the tasks of todo with retries, finished tasks are removed
+        # from todo as they are recorded
+        attempt = 0
+        while todo:
+            for t in todo:
+                self.record('started',t,attempt=attempt)
+            failed = []
+            start = time.time()
+            results = self.process(list(todo))
+            self.stats.add('render',time.time()-start,len(todo))
+            for t,error in results:
+                if error is None:
+                    self.record('finished',t)
+                    todo.remove(t)
+                    self.processed += 1
+                else:
+                    logging.warning('{}: {}'.format(t[0],error))
+                    self.record('failed',t,attempt=attempt,error=str(error))
+                    failed.append(t)
+            todo[:] = failed
+            if failed and attempt < self.retries and not self.stop.is_set():
+                delay = self.backoff*2**attempt
+                logging.info('retrying {} failed images in {}s'.format(len(failed),delay))
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self.failed += failed
+                todo.clear()
 
-            logging.info('running {}'.format(' '.join(cmd)))
+    def run(self):
+        while True:
+            cost,seq,queued,job = self.tasks.get()
+            self.stats.add('queue',time.time()-queued,len(job))
+            todo = list(job)
             try:
-                output=subprocess.check_output(cmd)
+                self.work(todo)
             except Exception as e:
-                logging.error(e)
-            self.tasks.task_done()
+                # the tasks not finished yet fail, the thread must survive
+                # so that the queue gets joined
+                logging.exception('failed to process {}'.format(', '.join(str(t[0]) for t in todo)))
+                for t in todo:
+                    try:
+                        self.record('failed',t,error=str(e))
+                    except Exception:
+                        logging.exception('cannot record the failure of {}'.format(t[0]))
+                self.failed += todo
+            finally:
+                self.tasks.task_done()
 
+class PreviewWorker(Worker):
+    # write proofs from the preview embedded in the raw files instead of
+    # rendering them with darktable
+    def render(self,job,outdir):
+        results = []
+        for infile,xmpfile,outfile in job:
+            try:
+                extract_preview(infile,outdir/outfile.name)
+                error = None
+            except Exception as e:
+                error = e
+            results.append(((infile,xmpfile,outfile),error))
+        return results
                 
-def create_jpg(infile,outfile,lock):
-    if not outfile.parent.exists():
-        print ('create {}'.format(outfile.parent))
-
-    cmd = ['darktable-cli','--width',2048,'--height',1024,infile,outfile]
-    print (cmd)
-        
-def main():
+def render_tasks(generated,num_process=None,batch=1,darktable=DARKTABLE,journal=None,
+                 retries=2,fast_preview=False,queue_size=None,stop=None,timeout=None,
+                 lookahead=LOOKAHEAD):
+    if num_process is None:
+        num_process = default_workers()
+    if queue_size is None:
+        queue_size = 4*num_process
+    if stop is None:
+        stop = threading.Event()
+    stats = Stats()
+    # bounded so that the scan cannot race ahead of the workers, the most
+    # expensive of the queued jobs is handed out first
+    tasks = PriorityQueue(maxsize=queue_size)
+    # the scanned jobs not queued yet, across directories, so that an
+    # expensive image found late is still rendered early
+    scanned = []
+
+    # start workers
+    workers = []
+    for i in range(num_process):
+        if fast_preview:
+            w = PreviewWorker(tasks,journal=journal,retries=retries,stats=stats,stop=stop)
+        else:
+            w = Worker(tasks,darktable=darktable,journal=journal,retries=retries,
+                       stats=stats,stop=stop,timeout=timeout)
+        w.start()
+        workers.append(w)
+
+    start = time.time()
+    seq = itertools.count()
+    try:
+        # tasks arrive grouped by directory, handle one directory at a time
+        groups = itertools.groupby(generated,key=lambda t: t[2].parent)
+        while not stop.is_set():
+            t0 = time.time()
+            try:
+                outdir,group = next(groups)
+            except StopIteration:
+                break
+            group = list(group)
+            if fast_preview:
+                group = [t for t in group if not t[2].exists()]
+            if not group:
+                stats.add('scan',time.time()-t0,0)
+                continue
+            if not outdir.exists():
+                logging.info('create directory {}'.format(outdir))
+                outdir.mkdir(parents=True,exist_ok=True)
+            else:
+                remove_stale(outdir)
+            todo = [(estimate_cost(t[0],t[1]),t) for t in group]
+            stats.add('scan',time.time()-t0,len(group))
+
+            for c,job in make_jobs(todo,batch=max(batch,1)):
+                if journal is not None:
+                    for t in job:
+                        journal.record('queued',t)
+                heapq.heappush(scanned,(-c,next(seq),job))
+            # keep the workers busy, wait for them only when too far ahead
+            while scanned and not stop.is_set() and (len(scanned) > lookahead or not tasks.full()):
+                c,n,job = heapq.heappop(scanned)
+                tasks.put((c,n,time.time(),job))
+        while scanned and not stop.is_set():
+            c,n,job = heapq.heappop(scanned)
+            tasks.put((c,n,time.time(),job))
+        tasks.join()
+    except KeyboardInterrupt:
+        logging.warning('interrupted, waiting for running jobs to finish')
+        stop.set()
+        # drop the queued jobs, they stay in the journal for --resume
+        while True:
+            try:
+                tasks.get_nowait()
+            except Empty:
+                break
+            tasks.task_done()
+        tasks.join()
+
+    elapsed = time.time()-start
+    # only the images rendered successfully count towards the throughput
+    processed = sum(w.processed for w in workers)
+    failed = [t for w in workers for t in w.failed]
+    if processed > 0:
+        logging.info('processed {} images in {:.1f}s ({:.2f} images/s)'.format(
+            processed,elapsed,processed/elapsed))
+    if failed:
+        logging.warning('{} images failed'.format(len(failed)))
+    stats.report()
+    return processed,failed
+
+def enqueue(queue,generated,chunk=100):
+    # add the generated tasks to the shared work queue as they are found so
+    # that the nodes can start before the scan has finished
+    since = time.time()
+    try:
+        for todo in iter(lambda: list(itertools.islice(generated,chunk)),[]):
+            queue.add([(estimate_cost(t[0],t[1]),t) for t in todo],since=since)
+    finally:
+        queue.release('scan')
+
+def render_queue(queue,num_process=None,batch=1,darktable=DARKTABLE,timeout=None,stop=None,poll=2):
+    # render the tasks of a work queue shared with other nodes, jobs are
+    # claimed as the workers become free so that the tasks spread over the
+    # nodes, return when no task is left pending or claimed by a live node
+    if num_process is None:
+        num_process = default_workers()
+    if stop is None:
+        stop = threading.Event()
+    stats = Stats()
+    tasks = PriorityQueue(maxsize=num_process)
+
+    # failed tasks go back to the queue and may be retried by another node
+    workers = []
+    for i in range(num_process):
+        w = Worker(tasks,darktable=darktable,journal=queue,retries=0,stats=stats,stop=stop,
+                   timeout=timeout)
+        w.start()
+        workers.append(w)
+
+    start = time.time()
+    seq = itertools.count()
+    try:
+        while not stop.is_set():
+            t0 = time.time()
+            claimed = queue.claim(batch)
+            if not claimed:
+                if queue.active() == 0 and not queue.held('scan'):
+                    break
+                time.sleep(poll)
+                continue
+            stats.add('scan',time.time()-t0,len(claimed))
+            for c,job in make_jobs(claimed,batch=batch):
+                job[0][2].parent.mkdir(parents=True,exist_ok=True)
+                tasks.put((-c,next(seq),time.time(),job))
+        tasks.join()
+    except KeyboardInterrupt:
+        logging.warning('interrupted, waiting for running jobs to finish')
+        stop.set()
+        while True:
+            try:
+                tasks.get_nowait()
+            except Empty:
+                break
+            tasks.task_done()
+        tasks.join()
+    queue.unclaim()
+
+    elapsed = time.time()-start
+    # only the images rendered successfully count towards the throughput
+    processed = sum(w.processed for w in workers)
+    failed = [t for w in workers for t in w.failed]
+    if processed > 0:
+        logging.info('processed {} images in {:.1f}s ({:.2f} images/s)'.format(
+            processed,elapsed,processed/elapsed))
+    if failed:
+        logging.warning('{} images failed'.format(len(failed)))
+    stats.report()
+    return processed,failed
+
+def queue_status(queue):
+    counts = queue.counts()
+    print(', '.join('{} {}'.format(n,s) for s,n in counts.items()))
+    now = time.time()
+    for n in queue.nodes():
+        print('{:32s} {:8d} done {:6d} failed, last seen {:.0f}s ago'.format(
+            n['node'],n['processed'],n['failed'],now-n['heartbeat']))
+    for t,error in queue.failed():
+        print('failed {}: {}'.format(t[0],error))
+
+def main(argv=None):
     TODAY=datetime.datetime.now()
     
     parser = argparse.ArgumentParser()
     parser.add_argument('-c','--config',help='read configuration from file')
-    parser.add_argument('-n','--num-process',type=int,default=4,help='the number of processes to use, default 4')
+    parser.add_argument('-n','--num-process',type=int,help='the number of processes to use, default: based on number of cores and free memory')
     parser.add_argument('-y','--year',type=int,help="process photos for YEAR")
     parser.add_argument('-m','--month',type=int,help="process photos for MONTH")
     parser.add_argument('-d','--day',type=int,help="process photos for DAY")
     parser.add_argument('-p','--path',help="find all raw pictures under path")
+    parser.add_argument('-b','--batch',type=int,default=1,
+                        help="render up to BATCH images of a directory with a single darktable-cli call, default 1")
+    parser.add_argument('--fast-preview',action='store_true',default=False,
+                        help="write proofs from the JPEG previews embedded in the raw files for images that have no output yet")
+    parser.add_argument('-r','--resume',action='store_true',default=False,
+                        help="resume the tasks of an interrupted run from the journal without scanning")
+    parser.add_argument('--retries',type=int,default=2,
+                        help="number of times a failed image is retried, default 2")
+    parser.add_argument('-t','--timeout',type=float,
+                        help='the number of seconds after which darktable is killed, default no limit')
+    parser.add_argument('-q','--queue-size',type=int,
+                        help="maximum number of queued jobs, default 4 per worker")
+    parser.add_argument('--no-index',action='store_true',default=False,
+                        help="do not use the task index, stat every file")
+    parser.add_argument('--rescan',action='store_true',default=False,
+                        help="rescan all directories and refresh the task index")
+    parser.add_argument('-w','--worker',action='store_true',default=False,
+                        help="render the tasks of the work queue shared with other nodes")
+    parser.add_argument('--queue',type=Path,
+                        help="the work queue on the shared filesystem, default archive.queue next to the archive")
+    parser.add_argument('--lease',type=float,default=120,
+                        help="seconds after which the tasks of a node that stopped sending heartbeats are reclaimed, default 120")
+    parser.add_argument('--status',action='store_true',default=False,
+                        help="show the state of the work queue and its nodes")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG)
 
     cfg = read_config(args.config)
+    execute.configure_from(cfg)
 
     indir = Path(cfg['directories']['assets'])
     outdir =  Path(cfg['directories']['project'])/'archive'
@@ -109,21 +592,57 @@ def main():
 
         inpattern = Path(str(year),inpattern)
 
-    lock = threading.Lock()
-    tasks = Queue()
+    if args.worker or args.status:
+        from .workqueue import WorkQueue, Heartbeat
+        qname = args.queue if args.queue is not None else outdir.with_suffix('.queue')
+        queue = WorkQueue(qname,lease=args.lease,retries=args.retries)
+        if args.status:
+            queue_status(queue)
+            return
+        queue.renew()
+        heartbeat = Heartbeat(queue)
+        heartbeat.start()
+        # one node scans while all of them render
+        if queue.acquire('scan'):
+            index = None
+            if not args.no_index:
+                index = TaskIndex(outdir.with_suffix('.sqlite'))
+            generated = generate_tasks(indir,outdir,inpattern,index=index,rescan=args.rescan)
+            threading.Thread(target=enqueue,args=(queue,generated),daemon=True).start()
+        render_queue(queue,num_process=args.num_process,batch=args.batch,
+                     darktable=cfg.get('darktable',{}).get('cli',DARKTABLE),timeout=args.timeout)
+        heartbeat.stop()
+        failed = queue.failed()
+        if failed:
+            for t,error in failed:
+                logging.error('failed to process {}: {}'.format(t[0],error))
+            sys.exit(1)
+        return
 
-    # start workers
-    workers = []
-    for i in range(args.num_process):
-        w = Worker(tasks,lock)
-        w.start()
-        workers.append(w)
+    jname = outdir.with_suffix('.journal')
+    if args.resume and not jname.exists():
+        parser.error('no journal {} to resume from'.format(jname))
+    if args.resume:
+        generated = sorted(Journal.unfinished(jname),key=lambda t: t[2])
+        logging.info('resuming {} unfinished tasks from {}'.format(len(generated),jname))
+    else:
+        index = None
+        if not args.no_index:
+            index = TaskIndex(outdir.with_suffix('.sqlite'))
+        generated = generate_tasks(indir,outdir,inpattern,index=index,rescan=args.rescan)
+    journal = Journal(jname,resume=args.resume)
 
-    # generate tasks
-    for t in generate_tasks(indir,outdir,inpattern):
-        tasks.put(t)
+    processed,failed = render_tasks(generated,num_process=args.num_process,batch=args.batch,
+                                    darktable=cfg.get('darktable',{}).get('cli',DARKTABLE),
+                                    journal=journal,retries=args.retries,
+                                    fast_preview=args.fast_preview,queue_size=args.queue_size)
+    journal.close()
 
-    tasks.join()
+    if failed:
+        for t in failed:
+            logging.error('failed to process {}'.format(t[0]))
+        logging.error('{} images failed, rerun with --resume to retry them'.format(len(failed)))
+        sys.exit(1)
     
     
 if __name__ == '__main__':
@@ -1,34 +1,188 @@
 from pathlib import Path
-import argparse, sys
+import argparse, sys, os
 import logging
 import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from .config import read_config
 
-logging.basicConfig(level=logging.DEBUG)
-
-def copy_projects(indir,outdir,include_tif=True):
-    for p in ('panoramas','stack'):
-        for f in (indir/p).glob('**/*'):
-            if not include_tif and f.suffix=='.tif':
-                continue
-            o = outdir/f.relative_to(indir)
-            if f.is_dir():
-                if not o.exists():
-                    logging.debug('create directory {}'.format(o))
-                    o.mkdir(parents=True)
-            else:
-                if not o.exists() or f.stat().st_mtime > o.stat().st_mtime:
-                    logging.debug('copying file {} to {}'.format(f,o))
-                    shutil.copy2(f,o)
-
-def main():
+# largest number of bytes handed to the kernel in a single call
+CHUNK = 64*1024*1024
+
+def copy_data(fin,fout,size):
+    # copy the data between the two file descriptors inside the kernel if possible
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(fin,fout,min(CHUNK,size-copied))
+            if n == 0:
+                break
+            copied += n
+        return
+    except (AttributeError,OSError):
+        pass
+    try:
+        while copied < size:
+            n = os.sendfile(fout,fin,copied,min(CHUNK,size-copied))
+            if n == 0:
+                break
+            copied += n
+        return
+    except (AttributeError,OSError):
+        pass
+    os.lseek(fin,copied,os.SEEK_SET)
+    os.lseek(fout,copied,os.SEEK_SET)
+    while True:
+        buf = os.read(fin,1024*1024)
+        if not buf:
+            break
+        os.write(fout,buf)
+
+def checksum(fname):
+    h = hashlib.blake2b()
+    with open(fname,'rb') as f:
+        while True:
+            buf = f.read(1024*1024)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+def is_partial(fname):
+    return fname.startswith('.') and fname.endswith('.part')
+
+def copy_file(src,dst,verify=False):
+    # copy to a temporary file and move it into place when complete
+    tmp = dst.with_name('.'+dst.name+'.part')
+    if not dst.parent.exists():
+        dst.parent.mkdir(parents=True,exist_ok=True)
+    try:
+        with open(src,'rb') as fin, open(tmp,'wb') as fout:
+            copy_data(fin.fileno(),fout.fileno(),os.fstat(fin.fileno()).st_size)
+        shutil.copystat(src,tmp)
+        if verify and checksum(src) != checksum(tmp):
+            raise RuntimeError('checksum mismatch copying {} to {}'.format(src,dst))
+        os.replace(tmp,dst)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+def needs_copy(src,dst,src_stat=None):
+    if src_stat is None:
+        src_stat = os.stat(src)
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return True
+    return src_stat.st_size != dst_stat.st_size or src_stat.st_mtime > dst_stat.st_mtime
+
+class CopyPool:
+    def __init__(self,num_threads=4,verify=False):
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._lock = threading.Lock()
+        self._futures = []
+        self.verify = verify
+        self.errors = []
+
+    def _copy(self,src,dst,then):
+        logging.debug('copying file {} to {}'.format(src,dst))
+        try:
+            copy_file(src,dst,verify=self.verify)
+        except Exception as e:
+            logging.error('failed to copy {} to {}: {}'.format(src,dst,e))
+            with self._lock:
+                self.errors.append((src,dst,e))
+            return
+        if then is not None:
+            then(dst)
+
+    def submit(self,src,dst,then=None):
+        with self._lock:
+            self._futures.append(self._executor.submit(self._copy,src,dst,then))
+
+    def wait(self):
+        # copies may schedule further copies, wait until no new ones appear
+        while True:
+            with self._lock:
+                futures = self._futures
+                self._futures = []
+            if not futures:
+                break
+            wait(futures)
+        self._executor.shutdown()
+
+def copy_projects(indir,outdir,include_tif=True,pool=None,then=None,skip=(),projects=None):
+    # schedule the copies of all new or modified files not in skip, return
+    # their destinations, projects limits the copies to these directories
+    # below indir
+    if pool is None:
+        p = CopyPool()
+    else:
+        p = pool
+    if projects is None:
+        projects = [indir/'panoramas',indir/'stack']
+    scheduled = set()
+    for project in projects:
+        for root,dirs,files in os.walk(project):
+            root = Path(root)
+            o = outdir/root.relative_to(indir)
+            if not o.exists():
+                logging.debug('create directory {}'.format(o))
+                o.mkdir(parents=True,exist_ok=True)
+            for name in files:
+                if is_partial(name):
+                    continue
+                if not include_tif and name.endswith('.tif'):
+                    continue
+                f = root/name
+                of = o/name
+                if f in skip:
+                    continue
+                if needs_copy(f,of):
+                    scheduled.add(of)
+                    p.submit(f,of,then=then)
+    if pool is None:
+        p.wait()
+    return scheduled
+
+def backup_projects(indir,outdir,backupdir,pool,projects=None):
+    # copy the projects to outdir and from there to backupdir, the second
+    # copy of a file starts as soon as the first one has landed
+    def backup(o):
+        if o.suffix == '.tif':
+            return
+        b = backupdir/o.relative_to(outdir)
+        if needs_copy(o,b):
+            pool.submit(o,b)
+
+    first = copy_projects(indir,outdir,pool=pool,then=backup,projects=projects)
+    if projects is not None:
+        projects = [outdir/d.relative_to(indir) for d in projects]
+    copy_projects(outdir,backupdir,include_tif=False,pool=pool,skip=first,projects=projects)
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('-c','--config',help='read configuration from file')
-    args = parser.parse_args()
+    parser.add_argument('-n','--num-threads',type=int,default=4,
+                        help='the number of concurrent copies, default 4')
+    parser.add_argument('--verify',action='store_true',default=False,
+                        help='verify the checksum of every copied file')
+    parser.add_argument('--dedup',action='store_true',default=False,
+                        help='back up into a deduplicating store below the backup directory')
+    parser.add_argument('--restore',metavar='PROJECT',
+                        help='restore PROJECT, e.g. panoramas/p20200101, from the deduplicating store')
+    parser.add_argument('-o','--output-dir',metavar='DIR',type=Path,default=Path('.'),
+                        help='restore the project into DIR, default the current directory')
+    parser.add_argument('--hardlink',action='store_true',default=False,
+                        help='restore files by hardlinking them to the store where possible')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG)
 
     cfg = read_config(args.config)
-    
+
     indir = Path(cfg['directories']['tempdir'])
     outdir =  Path(cfg['directories']['project'])
     backupdir =  Path(cfg['directories']['backedup'])
@@ -38,7 +192,37 @@ def main():
             parser.error('no such directory {}'.format(d))
             sys.exit(1)
 
-    copy_projects(indir,outdir)
-    copy_projects(outdir,backupdir,include_tif=False)
+    if args.restore is not None:
+        from .store import Store
+        store = Store(backupdir/'store')
+        store.restore(args.restore,args.output_dir/args.restore,hardlink=args.hardlink)
+        return
+
+    pool = CopyPool(num_threads=args.num_threads,verify=args.verify)
+
+    if args.dedup:
+        from .store import Store
+        store = Store(backupdir/'store')
+        copy_projects(indir,outdir,pool=pool)
+        pool.wait()
+        projects = [d for p in ('panoramas','stack') if (outdir/p).is_dir()
+                    for d in (outdir/p).iterdir() if d.is_dir()]
+        with ThreadPoolExecutor(max_workers=args.num_threads) as executor:
+            futures = dict((executor.submit(store.backup,d.relative_to(outdir),d,include_tif=False),d)
+                           for d in projects)
+        for f,d in futures.items():
+            if f.exception() is not None:
+                logging.error('failed to back up {}: {}'.format(d,f.exception()))
+                pool.errors.append((d,store.root,f.exception()))
+        if pool.errors:
+            parser.exit(1,'failed to copy {} files\n'.format(len(pool.errors)))
+        return
+
+    backup_projects(indir,outdir,backupdir,pool)
+    pool.wait()
+
+    if pool.errors:
+        parser.exit(1,'failed to copy {} files\n'.format(len(pool.errors)))
+
 if __name__ == '__main__':
     main()
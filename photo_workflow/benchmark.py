@@ -0,0 +1,484 @@
+from pathlib import Path
+import argparse, sys, os
+import time
+import json
+import pickle
+import shutil
+import socket
+import datetime
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from . import corpus
+
+def scale_reference(inname, outname, long_side=1500):
+    # the original implementation of scale.scale
+    from PIL import Image
+    import numpy
+    image = Image.open(inname)
+    scale = min(long_side / max(image.size), 1)
+    new_size = numpy.array(image.size)*scale
+    new_image = image.resize(new_size.astype(int))
+    new_image.save(outname)
+
+def peak_rss():
+    # VmHWM belongs to the address space of this process while ru_maxrss
+    # is inherited from the parent across fork and exec
+    try:
+        with open('/proc/self/status') as status:
+            for l in status:
+                if l.startswith('VmHWM:'):
+                    return int(l.split()[1])*1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def io_syscalls():
+    # read and write system calls of this process so far
+    try:
+        with open('/proc/self/io') as io:
+            counts = dict(l.split(':') for l in io)
+        return int(counts['syscr'])+int(counts['syscw'])
+    except (OSError,KeyError):
+        return None
+
+def _measure(func,*args,**kwds):
+    calls = io_syscalls()
+    start = time.perf_counter()
+    func(*args,**kwds)
+    elapsed = time.perf_counter()-start
+    if calls is not None:
+        calls = io_syscalls()-calls
+    return elapsed,peak_rss(),calls
+
+def measure(func,*args,**kwds):
+    # run func in a fresh process, return the wall time, the peak RSS and
+    # the number of read and write system calls of that process
+    with ProcessPoolExecutor(max_workers=1,mp_context=multiprocessing.get_context('spawn')) as p:
+        return p.submit(_measure,func,*args,**kwds).result()
+
+def strace_total(fname):
+    # the total number of calls of a strace -c summary, the numbers are
+    # aligned to the right end of the column headers
+    with open(fname) as f:
+        lines = f.read().split('\n')
+    header = [l for l in lines if 'calls' in l and 'syscall' in l][0]
+    end = header.index('calls')+len('calls')
+    total = [l for l in lines if l.rstrip().endswith('total')][-1]
+    return int(total[:end].split()[-1])
+
+def count_syscalls(func,*args,**kwds):
+    # run func under strace -f, return all system calls of it and the
+    # tools it runs, None without strace
+    strace = shutil.which('strace')
+    if strace is None:
+        return None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        call = Path(tmpdir,'call.pickle')
+        with open(call,'wb') as f:
+            pickle.dump((func,args,kwds),f)
+        out = Path(tmpdir,'strace.txt')
+        subprocess.run([strace,'-f','-c','-o',str(out),sys.executable,'-c',
+                        'import pickle,sys; f,a,k = pickle.load(open(sys.argv[1],"rb")); f(*a,**k)',str(call)],
+                       stdout=subprocess.DEVNULL,check=True)
+        return strace_total(out)
+
+def result(bench,case,impl,elapsed,rss,scale=None,items=None,unit=None,syscalls=None):
+    return {'benchmark':bench,'case':case,'impl':impl,'scale':scale,'time':elapsed,'rss':rss,
+            'items':items,'unit':unit,'syscalls':syscalls}
+
+def stage(bench,case,impl,func,args=(),kwds={},scale=None,items=None,unit='items',
+          reset=None,strace=False):
+    # measure func after reset, with strace run it a second time to count
+    # the system calls of all processes
+    if reset is not None:
+        reset()
+    elapsed,rss,calls = measure(func,*args,**kwds)
+    r = result(bench,case,impl,elapsed,rss,scale=scale,items=items,unit=unit,syscalls=calls)
+    if strace:
+        if reset is not None:
+            reset()
+        r['syscalls'] = count_syscalls(func,*args,**kwds)
+    return r
+
+def _remove(*paths):
+    for p in paths:
+        if p.is_dir():
+            shutil.rmtree(p)
+        elif p.exists():
+            p.unlink()
+
+def synthetic_image(fname,size,**kwds):
+    # a smooth image with some structure that compresses like a photo
+    from PIL import Image
+    import numpy
+    w,h = size
+    x = numpy.arange(w,dtype=numpy.float32)
+    image = Image.new('RGB',size)
+    rows = 1024
+    for y0 in range(0,h,rows):
+        y = numpy.arange(y0,min(y0+rows,h),dtype=numpy.float32)[:,None]
+        band = numpy.stack([(128+127*numpy.sin(x/97+y/53)),
+                            (128+127*numpy.cos(x/41-y/71)),
+                            ((x+y)/7)%256],axis=-1).astype(numpy.uint8)
+        image.paste(Image.fromarray(band),(0,y0))
+    image.save(fname,**kwds)
+
+def bench_scale(workdir,size=(20000,8000),long_side=1500,**kwds):
+    from .scale import scale
+    cases = [('jpeg','image.jpg',{'quality':90}),
+             ('tiff','image.tif',{}),
+             ('tiff-lzw','image_lzw.tif',{'compression':'tiff_lzw'})]
+    results = []
+    for name,fname,kwds in cases:
+        inname = workdir/fname
+        if not inname.exists():
+            synthetic_image(inname,size,**kwds)
+        for impl,func in (('reference',scale_reference),('scale',scale)):
+            elapsed,rss,calls = measure(func,inname,workdir/('out_'+fname),long_side=long_side)
+            results.append(result('scale',name,impl,elapsed,rss,items=size[0]*size[1]/1e6,unit='MP',
+                                  syscalls=calls))
+    return results
+
+def _scale_separately(inname,outputs):
+    from .scale import scale
+    for outname,long_side in outputs:
+        scale(inname,outname,long_side=long_side)
+
+def bench_sizes(workdir,size=(20000,8000),sizes=(2560,1500,800,400,150),**kwds):
+    # one photo-scale run per size against a single cascaded run
+    from .scale import scale_sizes
+    inname = workdir/'image.jpg'
+    if not inname.exists():
+        synthetic_image(inname,size,quality=90)
+    results = []
+    for impl,func in (('separate',_scale_separately),('cascade',scale_sizes)):
+        outputs = [(workdir/'{}_{}.jpg'.format(impl,s),s) for s in sizes]
+        elapsed,rss,calls = measure(func,inname,outputs)
+        results.append(result('sizes','jpeg',impl,elapsed,rss,items=len(sizes),unit='sizes',
+                              syscalls=calls))
+    return results
+
+def _tile(inname,tiles,num_processes):
+    from .tiler import Tiler
+    Tiler(tiles,num_processes=num_processes).run(inname)
+
+def bench_tiler(workdir,size=(20000,8000),**kwds):
+    # the native tiler on a single core against all cores
+    inname = workdir/'pano.tif'
+    if not inname.exists():
+        synthetic_image(inname,size,compression='tiff_lzw')
+    results = []
+    for impl,n in (('1 process',1),('{} procs'.format(os.cpu_count()),None)):
+        elapsed,rss,calls = measure(_tile,inname,workdir/'pano.tiles',n)
+        results.append(result('tiler','tiff-lzw',impl,elapsed,rss,items=size[0]*size[1]/1e6,unit='MP',
+                              syscalls=calls))
+    return results
+
+# import time budget in seconds of the modules behind console scripts
+IMPORT_BUDGET = {'photo_workflow.cli':0.005,
+                 'photo_workflow.archive':0.1,
+                 'photo_workflow.backup':0.1,
+                 'photo_workflow.create':0.1,
+                 'photo_workflow.geotag':0.2,
+                 'photo_workflow.getgpx':0.1,
+                 'photo_workflow.gpx':0.1,
+                 'photo_workflow.krpano':0.1,
+                 'photo_workflow.panobuild':0.15,
+                 'photo_workflow.scale':0.15,
+                 'photo_workflow.stackpreview':0.1,
+                 'photo_workflow.watch':0.1}
+# wall time budget of photo --help in seconds
+STARTUP_BUDGET = 0.05
+
+def import_time(module):
+    # cumulative import time of module and peak RSS in a fresh interpreter
+    result = subprocess.run([sys.executable,'-X','importtime','-c',
+                             'import {}; from photo_workflow.benchmark import peak_rss; print(peak_rss())'.format(module)],
+                            capture_output=True,text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().split('\n')[-1])
+    for l in result.stderr.split('\n'):
+        parts = l.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])/1e6,int(result.stdout)
+    raise RuntimeError('no import time for {}'.format(module))
+
+def bench_import(workdir,repeat=3,**kwds):
+    results = []
+    for module,budget in IMPORT_BUDGET.items():
+        try:
+            elapsed,rss = min(import_time(module) for i in range(repeat))
+        except RuntimeError as e:
+            print('cannot import {}: {}'.format(module,e),file=sys.stderr)
+            continue
+        results.append(result('import',module.split('.')[-1],'ok' if elapsed <= budget else 'OVER BUDGET',
+                              elapsed,rss))
+    return results
+
+def wall_time(cmd,repeat=5):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd,stdout=subprocess.DEVNULL,check=True)
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+def bench_startup(workdir,**kwds):
+    # photo --help against a bare interpreter
+    results = [result('startup','python','baseline',wall_time([sys.executable,'-c','pass']),0)]
+    elapsed = wall_time([sys.executable,'-c','from photo_workflow.cli import main; main(["--help"])'])
+    results.append(result('startup','photo','ok' if elapsed <= STARTUP_BUDGET else 'OVER BUDGET',elapsed,0))
+    return results
+
+def prepare(path,func,*args,**kwds):
+    # generate a corpus once per work directory
+    done = path/'.complete'
+    if not done.exists():
+        _remove(path)
+        func(path,*args,**kwds)
+        done.touch()
+    return path
+
+def _size(path):
+    return sum(f.stat().st_size for f in path.glob('**/*') if f.is_file())
+
+def _tasks(indir,outdir,dbname=None):
+    from .archive import generate_tasks
+    from .index import TaskIndex
+    index = TaskIndex(dbname) if dbname is not None else None
+    return sum(1 for t in generate_tasks(indir,outdir,Path('*','*'),index=index))
+
+def bench_tasks(workdir,scales=(100,),file_size=1.,strace=False,**kwds):
+    # scanning the asset tree for raw files to render with and without the index
+    results = []
+    for n in scales:
+        indir = prepare(workdir/'assets-{}'.format(n),corpus.asset_tree,days=max(n//50,1),
+                        per_day=min(n,50),raw_size=int(file_size*1024*1024))
+        outdir = workdir/'archive-{}'.format(n)
+        dbname = workdir/'archive-{}.sqlite'.format(n)
+        for case,impl,args,reset in (('scan','stat',(indir,outdir),None),
+                                     ('scan','index cold',(indir,outdir,dbname),lambda: _remove(dbname)),
+                                     ('scan','index warm',(indir,outdir,dbname),None)):
+            results.append(stage('tasks',case,impl,_tasks,args,scale=n,items=n,unit='files',
+                                 reset=reset,strace=strace))
+    return results
+
+def _render(indir,outdir,darktable,batch):
+    from .archive import generate_tasks, render_tasks
+    render_tasks(generate_tasks(indir,outdir,Path('*','*')),darktable=darktable,batch=batch)
+
+def bench_archive(workdir,scales=(100,),file_size=1.,stubs=None,strace=False,**kwds):
+    # rendering with the darktable-cli stub, one image per call against batches
+    results = []
+    for n in scales:
+        indir = prepare(workdir/'assets-{}'.format(n),corpus.asset_tree,days=max(n//50,1),
+                        per_day=min(n,50),raw_size=int(file_size*1024*1024))
+        outdir = workdir/'archive-{}'.format(n)
+        for batch in (1,8):
+            results.append(stage('archive','render','batch {}'.format(batch),_render,
+                                 (indir,outdir,stubs['darktable-cli'],batch),scale=n,items=n,unit='images',
+                                 reset=lambda: _remove(outdir),strace=strace))
+    return results
+
+def _backup(indir,outdir):
+    from .backup import copy_projects
+    copy_projects(indir,outdir)
+
+def bench_backup(workdir,scales=(100,),file_size=1.,strace=False,**kwds):
+    # copying the project tree to an empty backup and again without changes
+    results = []
+    for n in scales:
+        indir = prepare(workdir/'projects-{}'.format(n),corpus.project_tree,projects=4,
+                        per_project=max(n//8,1),tif_size=int(file_size*1024*1024),
+                        jpg_size=int(file_size*1024*1024)//8)
+        outdir = workdir/'backup-{}'.format(n)
+        size = _size(indir)/1024/1024
+        results.append(stage('backup','copy','empty',_backup,(indir,outdir),scale=n,items=size,unit='MB',
+                             reset=lambda: _remove(outdir),strace=strace))
+        results.append(stage('backup','copy','unchanged',_backup,(indir,outdir),scale=n,items=size,
+                             unit='MB',strace=strace))
+    return results
+
+def _plan(indir,backend):
+    from .create import plan
+    return plan(indir,indir/'projects',backend=backend)
+
+def bench_create(workdir,scales=(100,),file_size=1.,strace=False,**kwds):
+    # reading the subjects of a day of TIFFs natively and with the exiftool stub
+    results = []
+    for n in scales:
+        indir = prepare(workdir/'day-{}'.format(n),corpus.day_folder,images=n,
+                        size=int(file_size*1024*1024))
+        for backend in ('native','exiftool'):
+            results.append(stage('create','plan',backend,_plan,(indir,backend),scale=n,items=n,unit='images',
+                                 strace=strace))
+    return results
+
+def _krpano(krpanotools,inpano,outdir,native):
+    from .krpano import KRPano
+    pano = {'pname':'pano','input':str(inpano),'panotype':'cylinder','hfov':360}
+    krpano = KRPano(krpanotools,outdir,'template.xml',native=native)
+    outdir.mkdir(parents=True,exist_ok=True)
+    if native:
+        krpano.tile(pano,inpano,outdir)
+    else:
+        krpano.makepano(pano,inpano,outdir)
+
+def bench_krpano(workdir,size=(20000,8000),stubs=None,strace=False,**kwds):
+    # tiling a panorama with the krpanotools stub and the native tiler
+    inname = workdir/'pano.tif'
+    if not inname.exists():
+        synthetic_image(inname,size,compression='tiff_lzw')
+    outdir = workdir/'krpano'
+    results = []
+    for impl,native in (('makepano',False),('native',True)):
+        results.append(stage('krpano','tiles',impl,_krpano,(stubs['krpanotools'],inname,outdir,native),
+                             items=size[0]*size[1]/1e6,unit='MP',reset=lambda: _remove(outdir),
+                             strace=strace))
+    return results
+
+def _gpx_update(root,dbname):
+    from .gpx import GPXIndex
+    GPXIndex(dbname).update(root)
+
+def _gpx_covering(dbname,times):
+    from .gpx import GPXIndex
+    index = GPXIndex(dbname)
+    for t in times:
+        index.covering(t,t+600)
+
+def bench_gpx(workdir,scales=(100,),strace=False,**kwds):
+    # indexing a GPX archive of n tracks and looking up the tracks of n photos
+    results = []
+    for n in scales:
+        root = prepare(workdir/'gpx-{}'.format(n),corpus.gpx_archive,days=max(n//2,1),
+                       tracks_per_day=2,points=600)
+        dbname = workdir/'gpx-{}.sqlite'.format(n)
+        results.append(stage('gpx','update','cold',_gpx_update,(root,dbname),scale=n,items=n,unit='tracks',
+                             reset=lambda: _remove(dbname),strace=strace))
+        results.append(stage('gpx','update','warm',_gpx_update,(root,dbname),scale=n,items=n,unit='tracks',
+                             strace=strace))
+        start = datetime.datetime(2026,1,1,8,tzinfo=datetime.timezone.utc).timestamp()
+        times = [start+i*43200+300 for i in range(n)]
+        results.append(stage('gpx','covering','index',_gpx_covering,(dbname,times),scale=n,items=n,
+                             unit='queries',strace=strace))
+    return results
+
+BENCHMARKS = {'scale':bench_scale,'sizes':bench_sizes,'tiler':bench_tiler,'tasks':bench_tasks,
+              'archive':bench_archive,'backup':bench_backup,'create':bench_create,'krpano':bench_krpano,
+              'gpx':bench_gpx,'import':bench_import,'startup':bench_startup}
+
+HISTORY = Path('~/.cache/photo-workflow/benchmarks.jsonl')
+# slowdown against the previous run flagged as a regression, differences
+# below NOISE seconds are ignored
+REGRESSION = 1.2
+NOISE = 0.05
+
+def key(r):
+    return (r['benchmark'],r['case'],r['impl'],r['scale'])
+
+def git_revision():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],cwd=Path(__file__).parent,
+                              capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def previous(history,host):
+    # the latest time of each result measured on this host
+    times = {}
+    if not history.exists():
+        return times
+    with open(history) as f:
+        for l in f:
+            run = json.loads(l)
+            if run['host'] != host:
+                continue
+            for r in run['results']:
+                times[key(r)] = (r['time'],run['revision'])
+    return times
+
+def record(history,results,host):
+    history.parent.mkdir(parents=True,exist_ok=True)
+    with open(history,'a') as f:
+        f.write(json.dumps({'date':datetime.datetime.now().isoformat(timespec='seconds'),
+                            'revision':git_revision(),'host':host,'python':sys.version.split()[0],
+                            'results':results})+'\n')
+
+def report(results,before={}):
+    print('{:10s} {:10s} {:12s} {:>6s} {:>9s} {:>9s} {:>18s} {:>10s} {:>8s}'.format(
+        'benchmark','case','impl','scale','time [s]','RSS [MB]','throughput','syscalls','change'))
+    regressions = []
+    for r in results:
+        throughput = ''
+        if r['items'] is not None and r['time'] > 0:
+            throughput = '{:.1f} {}/s'.format(r['items']/r['time'],r['unit'])
+        change = ''
+        if key(r) in before and before[key(r)][0] > 0:
+            t,rev = before[key(r)]
+            change = '{:+.0%}'.format(r['time']/t-1)
+            if r['time'] > REGRESSION*t and r['time']-t > NOISE:
+                change += ' REGRESSION'
+                regressions.append((r,rev))
+        print('{:10s} {:10s} {:12s} {:>6s} {:9.2f} {:9.1f} {:>18s} {:>10s} {:>8s}'.format(
+            r['benchmark'],r['case'],r['impl'],'' if r['scale'] is None else str(r['scale']),
+            r['time'],r['rss']/1024/1024,throughput,'' if r['syscalls'] is None else str(r['syscalls']),change))
+    for r,rev in regressions:
+        print('{} {} {} is {:.0%} slower than at {}'.format(r['benchmark'],r['case'],r['impl'],
+                                                            r['time']/before[key(r)][0]-1,rev or 'the last run'))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the photo workflow on synthetic data')
+    parser.add_argument('benchmark',nargs='*',
+                        help='benchmarks to run, one of {}, default all'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('-w','--workdir',type=Path,
+                        help='directory for the synthetic data, default a temporary directory')
+    parser.add_argument('-s','--size',type=int,nargs=2,default=[20000,8000],metavar=('WIDTH','HEIGHT'),
+                        help='size of the synthetic images and panoramas, default 20000 8000')
+    parser.add_argument('-n','--scale',type=int,action='append',
+                        help='number of files of the synthetic corpora, can be repeated, default 100')
+    parser.add_argument('-f','--file-size',type=float,default=1.,metavar='MB',
+                        help='size of the synthetic raw files and TIFFs in MB, default 1')
+    parser.add_argument('-l','--latency',type=float,default=0.05,
+                        help='seconds each call of the stub darktable-cli, exiftool and krpanotools takes, default 0.05')
+    parser.add_argument('--strace',action='store_true',default=False,
+                        help='count the system calls of all processes with strace, without only the reads and '
+                        'writes of the benchmarked process are counted')
+    parser.add_argument('--history',type=Path,default=HISTORY,
+                        help='file the results are appended to and compared with, default {}'.format(HISTORY))
+    parser.add_argument('--no-history',action='store_true',default=False,
+                        help='neither compare nor store the results')
+    args = parser.parse_args(argv)
+    for b in args.benchmark:
+        if b not in BENCHMARKS:
+            parser.error('unknown benchmark {}'.format(b))
+    if args.strace and shutil.which('strace') is None:
+        parser.error('strace not found')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir if args.workdir is not None else Path(tmpdir)
+        workdir.mkdir(parents=True,exist_ok=True)
+        # the stubs replace the tools found in the PATH of the measured processes
+        stubs = corpus.write_stubs(workdir/'bin',latency=args.latency)
+        os.environ['PATH'] = str(workdir/'bin')+os.pathsep+os.environ.get('PATH','')
+        results = []
+        for b in args.benchmark or BENCHMARKS:
+            results += BENCHMARKS[b](workdir,size=tuple(args.size),scales=args.scale or [100],
+                                     file_size=args.file_size,stubs=stubs,strace=args.strace)
+
+    history = args.history.expanduser()
+    host = socket.gethostname()
+    before = {} if args.no_history else previous(history,host)
+    report(results,before)
+    if not args.no_history:
+        record(history,results,host)
+    if any(r['impl'] == 'OVER BUDGET' for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+__all__ = ['main']
+
+import sys
+
+# subcommands, their modules and a short description, the modules are only
+# imported when the subcommand is run so that startup stays fast
+COMMANDS = {
+    'create-project':('create','sort the images of a day into project folders'),
+    'backup-project':('backup','back up projects'),
+    'download-gpx':('getgpx','download GPX tracks from the WebDAV server'),
+    'gpx-index':('gpx','index and query the GPX tracks'),
+    'geotag':('geotag','write positions from GPX tracks into the XMP sidecars'),
+    'archive':('archive','render the raw files to JPEGs'),
+    'krpano':('krpano','build panoramas, krpano build DIR builds all panoramas in DIR'),
+    'scale':('scale','scale images'),
+    'stack-preview':('stackpreview','write contact sheets and focus stack previews of project folders'),
+    'watch':('watch','render, sort and back up new images as they arrive'),
+    'benchmark':('benchmark','benchmark the workflow on synthetic data'),
+}
+
+def usage(out=sys.stdout):
+    out.write('usage: photo COMMAND [ARGS]\n\ncommands:\n')
+    for c,(m,d) in COMMANDS.items():
+        out.write('  {:16s} {}\n'.format(c,d))
+    out.write('\nrun photo COMMAND --help for the options of a command\n')
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ('-h','--help'):
+        usage()
+        return
+    if argv[0] not in COMMANDS:
+        sys.stderr.write('photo: unknown command {}\n'.format(argv[0]))
+        usage(sys.stderr)
+        sys.exit(2)
+    import importlib
+    module = importlib.import_module('.'+COMMANDS[argv[0]][0],__package__)
+    # argparse takes the program name shown in the help from sys.argv
+    sys.argv[0] = 'photo '+argv[0]
+    return module.main(argv[1:])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+__all__ = ['asset_tree','tiff_with_xmp','project_tree','day_folder','gpx_archive','write_stubs']
+
+import os
+import sys
+import stat
+import struct
+import datetime
+from pathlib import Path
+
+from .tiff import TIFF, make_tiff, STRIP_BYTES
+
+# synthetic data for the benchmarks
+
+XMP = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:darktable="http://darktable.sf.net/">
+   <dc:subject><rdf:Bag>{subjects}</rdf:Bag></dc:subject>
+   <darktable:history><rdf:Seq>{history}</rdf:Seq></darktable:history>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+MODULES = ['exposure','colorin','denoiseprofile','lens','filmicrgb','diffuse']
+
+def _xmp(subjects=(),modules=()):
+    return XMP.format(subjects=''.join('<rdf:li>{}</rdf:li>'.format(s) for s in subjects),
+                      history=''.join('<rdf:li darktable:operation="{}" darktable:enabled="1"/>'.format(m)
+                                      for m in modules))
+
+def _fill(f,size,block=os.urandom(1024*1024)):
+    # write size bytes of incompressible data
+    while size > 0:
+        n = min(size,len(block))
+        f.write(block[:n])
+        size -= n
+
+def _raw(fname,size):
+    # a TIFF structured file padded to size like a raw file
+    header = tiff_bytes(16,16)
+    with open(fname,'wb') as f:
+        f.write(header)
+        _fill(f,max(size-len(header),0))
+
+def tiff_bytes(width,height,xmp=None,data=None):
+    order = '<'
+    def short(v):
+        return (3,1,v.to_bytes(2,'little'))
+    tags = {0x100:short(width),0x101:short(height),0x102:(3,3,b'\x08\x00'*3),
+            0x103:short(1),0x106:short(2),0x115:short(3),0x116:short(height)}
+    if xmp is not None:
+        xmp = xmp.encode()
+        tags[700] = (7,len(xmp),xmp)
+    if data is None:
+        data = bytes(width*height*3)
+    return make_tiff(order,tags,[data])
+
+def tiff_with_xmp(fname,size,subjects=()):
+    # an uncompressed RGB TIFF of about size bytes with the subjects in its
+    # XMP packet, the pixels are streamed to the file after the header
+    width = 1024
+    height = max(size//(width*3),1)
+    header = bytearray(tiff_bytes(width,height,xmp=_xmp(subjects),data=b''))
+    tiff = TIFF(header)
+    entries,nxt = tiff.ifd(tiff.first)
+    struct.pack_into('<I',header,entries[STRIP_BYTES][2],width*height*3)
+    with open(fname,'wb') as f:
+        f.write(header)
+        _fill(f,width*height*3)
+    return fname
+
+def asset_tree(root,days=10,per_day=50,raw_size=4*1024*1024,year=2026,xmp_fraction=0.5,
+               suffix='.ORF'):
+    # year/day folders with raw files, some of them with XMP sidecars
+    root = Path(root)
+    files = []
+    start = datetime.date(year,1,1)
+    n = 0
+    for d in range(days):
+        day = start+datetime.timedelta(days=d)
+        folder = root/day.strftime('%Y')/day.strftime('%Y-%m-%d_trip')
+        folder.mkdir(parents=True,exist_ok=True)
+        for i in range(per_day):
+            fname = folder/'IMG_{:05d}{}'.format(n,suffix)
+            _raw(fname,raw_size)
+            if (n*xmp_fraction)%1+xmp_fraction >= 1:
+                with open(str(fname)+'.xmp','w') as x:
+                    x.write(_xmp(modules=MODULES[:n%len(MODULES)+1]))
+            files.append(fname)
+            n += 1
+    return files
+
+def day_folder(root,images=100,size=1024*1024):
+    # the TIFFs of a day tagged as panoramas and focus stacks
+    root = Path(root)
+    root.mkdir(parents=True,exist_ok=True)
+    files = []
+    for i in range(images):
+        group = i//10
+        if group%2:
+            subjects = ('focus stack','s{:08d}'.format(20260101+group))
+        else:
+            subjects = ('panorama','p{:08d}'.format(20260101+group))
+        files.append(tiff_with_xmp(root/'IMG_{:05d}.tif'.format(i),size,subjects))
+    return files
+
+def project_tree(root,projects=4,per_project=10,tif_size=64*1024*1024,jpg_size=2*1024*1024):
+    # panoramas and stack projects with large TIFFs and small JPEGs
+    root = Path(root)
+    files = []
+    for p in range(projects):
+        kind = 'panoramas' if p%2 == 0 else 'stack'
+        folder = root/kind/'{}{:08d}'.format(kind[0],20260101+p)
+        folder.mkdir(parents=True,exist_ok=True)
+        for i in range(per_project):
+            files.append(tiff_with_xmp(folder/'IMG_{:05d}.tif'.format(i),tif_size))
+            with open(folder/'IMG_{:05d}.jpg'.format(i),'wb') as f:
+                _fill(f,jpg_size)
+            files.append(folder/'IMG_{:05d}.jpg'.format(i))
+    return files
+
+def gpx_archive(root,days=365,tracks_per_day=2,points=3600,year=2026):
+    # daily GPX tracks in year/day folders, one point per second
+    root = Path(root)
+    files = []
+    start = datetime.datetime(year,1,1,8,tzinfo=datetime.timezone.utc)
+    for d in range(days):
+        for t in range(tracks_per_day):
+            t0 = start+datetime.timedelta(days=d,hours=4*t)
+            folder = root/t0.strftime('%Y')/t0.strftime('%Y-%m-%d')
+            folder.mkdir(parents=True,exist_ok=True)
+            fname = folder/t0.strftime('%Y-%m-%d_%H-%M_%a.gpx')
+            with open(fname,'w') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>\n')
+                for i in range(points):
+                    f.write('<trkpt lat="{:.6f}" lon="{:.6f}"><ele>{:.1f}</ele><time>{}</time></trkpt>\n'.format(
+                        55.9+i*1e-5,-3.2+i*1e-5,100+i%50,
+                        (t0+datetime.timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%SZ')))
+                f.write('</trkseg></trk></gpx>\n')
+            files.append(fname)
+    return files
+
+DARKTABLE = """
+import sys, os, time, shutil
+time.sleep({latency})
+args = sys.argv[1:]
+if '--core' in args:
+    args = args[:args.index('--core')]
+files = []
+i = 0
+while i < len(args):
+    if args[i] in ('--width','--height','--out-ext'):
+        i += 2
+        continue
+    files.append(args[i])
+    i += 1
+out = files[-1]
+inputs = [f for f in files[:-1] if not f.endswith('.xmp')]
+for f in inputs:
+    if os.path.isdir(out):
+        o = os.path.join(out,os.path.splitext(os.path.basename(f))[0]+'.jpg')
+    else:
+        o = out
+    with open(o,'wb') as jpg:
+        jpg.write(b'\\xff\\xd8'+bytes(1024)+b'\\xff\\xd9')
+"""
+
+EXIFTOOL = """
+import sys, json, time
+def subjects(f):
+    n = int(''.join(c for c in f if c.isdigit()) or 0)//10
+    if n%2:
+        return ['focus stack','s{{:08d}}'.format(20260101+n)]
+    return ['panorama','p{{:08d}}'.format(20260101+n)]
+args = sys.argv[1:]
+if args[:2] != ['-stay_open','True']:
+    time.sleep({latency})
+    print('Subject                         : '+', '.join(subjects(args[-1])))
+    sys.exit(0)
+while True:
+    args = []
+    while True:
+        l = sys.stdin.readline()
+        if not l:
+            sys.exit(0)
+        l = l.rstrip('\\n')
+        if l == '-execute':
+            break
+        args.append(l)
+        if args[-2:] == ['-stay_open','False']:
+            sys.exit(0)
+    time.sleep({latency})
+    files = [a for a in args if not a.startswith('-')]
+    sys.stdout.write(json.dumps([{{'SourceFile':f,'Subject':subjects(f)}} for f in files])+'\\n{{ready}}\\n')
+    sys.stdout.flush()
+"""
+
+KRPANOTOOLS = """
+import sys, os, time
+time.sleep({latency})
+args = dict(a.lstrip('-').split('=',1) for a in sys.argv[2:-1] if '=' in a)
+if sys.argv[1] != 'makepano':
+    sys.exit(0)
+tilepath = args['tilepath'].replace('[mres_c/]','').replace('[_c]','')
+for l in (1,2,3):
+    for v in range(1,l+1):
+        for h in range(1,2*l+1):
+            f = tilepath.replace('%Al',str(l)).replace('%Av',str(v)).replace('%Ah',str(h))
+            os.makedirs(os.path.dirname(f),exist_ok=True)
+            with open(f,'wb') as t:
+                t.write(b'\\xff\\xd8'+bytes(4096)+b'\\xff\\xd9')
+for p in ('previewpath','thumbpath'):
+    with open(args[p],'wb') as t:
+        t.write(b'\\xff\\xd8\\xff\\xd9')
+with open(args['xmlpath'],'w') as x:
+    x.write('<krpano><view fov="90"/><image/></krpano>')
+print('done')
+"""
+
+def write_stubs(bindir,latency=0.):
+    # stub darktable-cli, exiftool and krpanotools sleeping latency seconds per call
+    bindir = Path(bindir)
+    bindir.mkdir(parents=True,exist_ok=True)
+    stubs = {}
+    for name,body in (('darktable-cli',DARKTABLE),('exiftool',EXIFTOOL),('krpanotools',KRPANOTOOLS)):
+        fname = bindir/name
+        with open(fname,'w') as f:
+            f.write('#!{}\n'.format(sys.executable)+body.format(latency=latency))
+        fname.chmod(fname.stat().st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+        stubs[name] = fname
+    return stubs
@@ -1,54 +1,98 @@
 from pathlib import Path
 import argparse, sys
-import subprocess
 import logging
 import re
-import shutil
+import os
+import errno
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 from .config import read_config
+from .metadata import image_tags
+from .backup import copy_file
+from .execute import configure_from
 
-def get_image_tags(image):
-    tags = subprocess.check_output(['exiftool','-Subject',image])
-    tags = tags.split(b':')[1]
-    new_tags = []
-    for t in tags.split(b','):
-        new_tags.append(t.strip().decode())
-    return new_tags
-
-def create_folder(indir,outprefix,glob='*.tif'):
-    re_pano  = re.compile('p[0-9]{8}.*')
-    re_stack = re.compile('s[0-9]{8}.*')
-    for p in indir.glob(glob):
-        tags = get_image_tags(p)
-        if 'panorama' in tags:
-            for t in tags:
-                if re_pano.match(t):
-                    break
-            else:
-                logging.warning('could not find correct panorama tag')
-                continue
-            outdir = outprefix/'panoramas'/t
-            outdir.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(p),str(outdir))
-        elif 'focus stack' in tags:
-            for t in tags:
-                if re_stack.match(t):
-                    break
-            else:
-                logging.warning('could not find correct panorama tag')
-                continue
-            outdir = outprefix/'stack'/t
-            outdir.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(p),str(outdir))
-        else:
-            logging.warning('unknown tags associated with image {}'.format(p))
-
-def main():
+re_pano  = re.compile('p[0-9]{8}.*')
+re_stack = re.compile('s[0-9]{8}.*')
+
+@functools.lru_cache(maxsize=None)
+def classify(tags):
+    # return the target folder for a tuple of tags or None and a reason
+    if 'panorama' in tags:
+        for t in tags:
+            if re_pano.match(t):
+                return Path('panoramas',t),None
+        return None,'could not find correct panorama tag'
+    elif 'focus stack' in tags:
+        for t in tags:
+            if re_stack.match(t):
+                return Path('stack',t),None
+        return None,'could not find correct focus stack tag'
+    return None,'unknown tags associated with image'
+
+def plan(indir,outprefix,glob='*.tif',backend='native',images=None):
+    # return the list of (image, target directory) moves of images, default
+    # all images in indir matching glob
+    if images is None:
+        images = indir.glob(glob)
+    images = sorted(images)
+    all_tags = image_tags(images,backend=backend)
+    moves = []
+    for p in images:
+        target,reason = classify(tuple(all_tags[p]))
+        if target is None:
+            logging.warning('{}: {}'.format(p,reason))
+            continue
+        moves.append((p,outprefix/target))
+    return moves
+
+def move_file(src,outdir):
+    # never replace an image that is already in the project folder
+    dst = outdir/src.name
+    if dst.exists():
+        raise FileExistsError(errno.EEXIST,'target exists',str(dst))
+    if os.stat(src).st_dev == os.stat(outdir).st_dev:
+        os.rename(src,dst)
+    else:
+        # different filesystems, copy in chunks and remove the original
+        copy_file(src,dst)
+        os.unlink(src)
+    return dst
+
+def move_files(moves,num_threads=4):
+    for d in sorted(set(o for p,o in moves)):
+        d.mkdir(parents=True,exist_ok=True)
+    errors = []
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = dict((executor.submit(move_file,p,o),p) for p,o in moves)
+    for f,p in futures.items():
+        if f.exception() is not None:
+            logging.error('failed to move {}: {}'.format(p,f.exception()))
+            errors.append((p,f.exception()))
+    return errors
+
+def create_folder(indir,outprefix,glob='*.tif',backend='native',num_threads=4,dry_run=False,
+                  images=None):
+    moves = plan(indir,outprefix,glob=glob,backend=backend,images=images)
+    if dry_run:
+        for p,o in moves:
+            print('{} -> {}'.format(p,o))
+        return []
+    return move_files(moves,num_threads=num_threads)
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('-c','--config',help='read configuration from file')
-    args = parser.parse_args()
+    parser.add_argument('-b','--backend',choices=['native','exiftool'],default='native',
+                        help='read the tags from the TIFF headers (native) or with exiftool, default native')
+    parser.add_argument('-n','--num-threads',type=int,default=4,
+                        help='the number of concurrent moves, default 4')
+    parser.add_argument('--dry-run',action='store_true',default=False,
+                        help='only print where the images would be moved to')
+    args = parser.parse_args(argv)
 
     cfg = read_config(args.config)
+    configure_from(cfg)
 
     indir = Path(cfg['directories']['tempdir'])
     outprefix = Path(cfg['directories']['tempdir'])
@@ -57,7 +101,10 @@ def main():
             parser.error('no such directory {}'.format(d))
             sys.exit(1)
 
-    create_folder(indir,outprefix)
+    errors = create_folder(indir,outprefix,backend=args.backend,
+                           num_threads=args.num_threads,dry_run=args.dry_run)
+    if errors:
+        parser.exit(1,'failed to move {} images\n'.format(len(errors)))
     
 if __name__ == '__main__':
     main()
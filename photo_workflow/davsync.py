@@ -0,0 +1,111 @@
+__all__ = ['DAVSync']
+
+import os
+import json
+import logging
+import xml.etree.ElementTree
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+PROPFIND = """<?xml version="1.0" encoding="utf-8"?>
+<propfind xmlns="DAV:"><prop><getetag/><getlastmodified/></prop></propfind>
+"""
+
+def cache_dir():
+    return Path(os.environ.get('XDG_CACHE_HOME',Path.home()/'.cache'))/'photo-workflow'
+
+class DAVSync:
+    # download files from a WebDAV collection through an easywebdav client
+    # using a pool of keep-alive connections and a cached remote listing
+    def __init__(self,dav,cache=None,num_threads=4):
+        self.dav = dav
+        self.num_threads = num_threads
+        import requests.adapters
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,pool_maxsize=num_threads)
+        self.dav.session.mount(self.dav.baseurl,adapter)
+        if cache is None:
+            host = self.dav.baseurl.split('://')[-1].replace('/','_')
+            cache = cache_dir()/'webdav-{}.json'.format(host)
+        self._cache = Path(cache)
+
+    def collection_tag(self):
+        # the ETag and Last-Modified of the collection change when its content changes
+        response = self.dav._send('PROPFIND','.',(207,301),data=PROPFIND,
+                                  headers={'Depth':'0','Content-Type':'application/xml'})
+        if response.status_code != 207:
+            return None
+        tree = xml.etree.ElementTree.fromstring(response.content)
+        etag = tree.findtext('.//{DAV:}getetag')
+        modified = tree.findtext('.//{DAV:}getlastmodified')
+        if etag is None and modified is None:
+            return None
+        return [etag,modified]
+
+    def listing(self):
+        # return a list of (name, size) of the remote files
+        tag = self.collection_tag()
+        if tag is not None and self._cache.exists():
+            with open(self._cache) as c:
+                cached = json.load(c)
+            if cached['tag'] == tag:
+                logging.debug('using cached listing {}'.format(self._cache))
+                return [tuple(f) for f in cached['files']]
+        logging.debug('fetching remote listing')
+        files = [(Path(f.name).name,f.size) for f in self.dav.ls() if not f.name.endswith('/')]
+        if tag is not None:
+            if not self._cache.parent.exists():
+                self._cache.parent.mkdir(parents=True)
+            tmp = self._cache.with_suffix('.part')
+            with open(tmp,'w') as c:
+                json.dump({'tag':tag,'files':files},c)
+            os.replace(tmp,self._cache)
+        return files
+
+    def _get(self,name,offset):
+        headers = {}
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        return self.dav._send('GET',name,(200,206,416),headers=headers,stream=True)
+
+    def download(self,name,outfile,size=None):
+        # download name to outfile, resuming a partial download
+        outfile = Path(outfile)
+        part = outfile.with_name(outfile.name+'.part')
+        offset = part.stat().st_size if part.exists() else 0
+        if size and offset == size:
+            logging.debug('partial download of {} is complete'.format(name))
+            os.replace(part,outfile)
+            return
+        if size and offset > size:
+            logging.warning('partial download of {} is larger than the file, restarting'.format(name))
+            offset = 0
+        response = self._get(name,offset)
+        if response.status_code == 416:
+            # the server cannot serve the rest, start from the beginning
+            logging.warning('cannot resume download of {}, restarting'.format(name))
+            response.close()
+            offset = 0
+            response = self._get(name,offset)
+            if response.status_code == 416:
+                raise RuntimeError('cannot download {}'.format(name))
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(part,mode) as out:
+            for chunk in response.iter_content(1024*1024):
+                out.write(chunk)
+        if size and part.stat().st_size != size:
+            raise RuntimeError('incomplete download of {}'.format(name))
+        os.replace(part,outfile)
+
+    def sync(self,files):
+        # download a list of (name, size, outfile) concurrently
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            futures = {}
+            for name,size,outfile in files:
+                logging.info('downloading gpx file {}'.format(outfile))
+                futures[executor.submit(self.download,name,outfile,size)] = name
+        for f,name in futures.items():
+            if f.exception() is not None:
+                logging.error('failed to download {}: {}'.format(name,f.exception()))
+                errors.append((name,f.exception()))
+        return errors
@@ -0,0 +1,250 @@
+__all__ = ['Executor','Process','Result','configure','configure_from','executor','run','summary']
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+import contextlib
+import collections
+import subprocess
+from pathlib import Path
+
+Result = collections.namedtuple('Result',['returncode','stdout','wall','utime','stime','maxrss'])
+
+# number of output lines kept for error messages
+TAIL = 50
+# seconds to wait for the output after the command exited
+GRACE = 5
+
+def _killpg(pid):
+    try:
+        os.killpg(pid,signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def _usage(pid):
+    # CPU times and peak RSS of a running process from /proc, zero where
+    # they cannot be read
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')',1)[1].split()
+        with open('/proc/{}/status'.format(pid)) as f:
+            hwm = [l for l in f if l.startswith('VmHWM:')]
+    except OSError:
+        return 0.,0.,0
+    ticks = os.sysconf('SC_CLK_TCK')
+    maxrss = int(hwm[0].split()[1])*1024 if hwm else 0
+    return int(fields[11])/ticks,int(fields[12])/ticks,maxrss
+
+class Process:
+    # a long-lived tool such as exiftool -stay_open, it holds one slot of its
+    # executor until closed and every batch of work sent to it is recorded
+    def __init__(self,executor,cmd,tool=None):
+        self._executor = executor
+        self.cmd = [str(c) for c in cmd]
+        self.tool = tool if tool is not None else Path(self.cmd[0]).name
+        queued = time.time()
+        executor._slots.acquire()
+        self._wait = time.time()-queued
+        try:
+            logging.debug('starting command: '+' '.join(self.cmd))
+            self.proc = subprocess.Popen(self.cmd,stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL,start_new_session=True)
+        except BaseException:
+            executor._slots.release()
+            raise
+        self._usage = (0.,0.)
+
+    @contextlib.contextmanager
+    def batch(self,timeout=None):
+        # the process is killed when the batch takes longer than timeout
+        # seconds, TimeoutExpired is raised instead of the error it causes
+        start = time.time()
+        expired = threading.Event()
+        def kill():
+            expired.set()
+            _killpg(self.proc.pid)
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout,kill)
+            timer.start()
+        returncode = 0
+        try:
+            yield self.proc
+        except Exception:
+            returncode = self.proc.poll() or 1
+            if not expired.is_set():
+                raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            utime,stime,maxrss = _usage(self.proc.pid)
+            self._executor._record(tool=self.tool,cmd=self.cmd,start=start,wait=self._wait,
+                                   wall=time.time()-start,utime=max(utime-self._usage[0],0.),
+                                   stime=max(stime-self._usage[1],0.),maxrss=maxrss,
+                                   returncode=returncode,timeout=expired.is_set())
+            self._usage = (utime,stime)
+            self._wait = 0.
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(self.cmd,timeout)
+
+    def close(self,timeout=GRACE):
+        # wait for the process to exit after it was asked to, then give the
+        # slot back
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logging.warning('{} did not exit, killing it'.format(self.tool))
+            _killpg(self.proc.pid)
+            self.proc.wait()
+        finally:
+            for pipe in (self.proc.stdin,self.proc.stdout):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+            self._executor._slots.release()
+
+class Executor:
+    # run external tools with a common limit on the number of processes,
+    # stream their output to the log and record wall time, CPU time and
+    # peak RSS of every command as JSON lines
+    def __init__(self,max_procs=None,metrics=None):
+        self._max_procs = max_procs if max_procs is not None else os.cpu_count()
+        self._slots = threading.BoundedSemaphore(self._max_procs)
+        self._metrics = Path(metrics).expanduser() if metrics is not None else None
+        self._lock = threading.Lock()
+
+    @property
+    def max_procs(self):
+        return self._max_procs
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def _record(self,**entry):
+        if self._metrics is None:
+            return
+        with self._lock:
+            with open(self._metrics,'a') as out:
+                out.write(json.dumps(entry)+'\n')
+
+    def _stream(self,pipe,tool,lines,tail):
+        for l in pipe:
+            l = l.decode(errors='replace').rstrip('\r\n')
+            if lines is not None:
+                lines.append(l)
+            if l:
+                tail.append(l)
+                logging.debug('{}: {}'.format(tool,l))
+        pipe.close()
+
+    def start(self,cmd,tool=None):
+        return Process(self,cmd,tool=tool)
+
+    def run(self,cmd,tool=None,timeout=None,capture=False,check=True,cwd=None):
+        # run cmd, the lines of stdout are returned if capture is set,
+        # otherwise stdout and stderr only go to the log, raises
+        # CalledProcessError with the tail of the output if check is set and
+        # TimeoutExpired if the command takes longer than timeout seconds
+        cmd = [str(c) for c in cmd]
+        if tool is None:
+            tool = Path(cmd[0]).name
+        queued = time.time()
+        with self._slots:
+            start = time.time()
+            logging.debug('running command: '+' '.join(cmd))
+            # a session of its own so that helpers forked by the tool are
+            # killed with it
+            proc = subprocess.Popen(cmd,stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,cwd=cwd,start_new_session=True)
+            lines = [] if capture else None
+            tail = collections.deque(maxlen=TAIL)
+            readers = [threading.Thread(target=self._stream,args=(proc.stdout,tool,lines,tail)),
+                       threading.Thread(target=self._stream,args=(proc.stderr,tool,None,tail))]
+            for r in readers:
+                r.start()
+            expired = threading.Event()
+            def kill():
+                expired.set()
+                _killpg(proc.pid)
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout,kill)
+                timer.start()
+            # reap the child ourselves to get its resource usage
+            pid,status,rusage = os.wait4(proc.pid,0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            if timer is not None:
+                timer.cancel()
+            for r in readers:
+                r.join(GRACE)
+            if any(r.is_alive() for r in readers):
+                # helpers left behind still hold the pipes
+                logging.warning('{} left processes behind, killing them'.format(tool))
+                _killpg(proc.pid)
+                for r in readers:
+                    r.join()
+            wall = time.time()-start
+        result = Result(proc.returncode,lines,wall,rusage.ru_utime,rusage.ru_stime,rusage.ru_maxrss*1024)
+        self._record(tool=tool,cmd=cmd,start=start,wait=start-queued,wall=wall,
+                     utime=result.utime,stime=result.stime,maxrss=result.maxrss,
+                     returncode=result.returncode,timeout=expired.is_set())
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(cmd,timeout,output='\n'.join(tail))
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode,cmd,output='\n'.join(tail))
+        return result
+
+_executor = Executor()
+
+def configure(max_procs=None,metrics=None):
+    # replace the executor shared by all tools
+    global _executor
+    _executor = Executor(max_procs=max_procs,metrics=metrics)
+    return _executor
+
+def configure_from(cfg):
+    # configure from the [execute] section of the configuration
+    sec = cfg.get('execute',{})
+    max_procs = int(sec['max_processes']) if sec.get('max_processes') else None
+    return configure(max_procs=max_procs,metrics=sec.get('metrics') or None)
+
+def executor():
+    return _executor
+
+def run(cmd,**kwds):
+    return _executor.run(cmd,**kwds)
+
+def summary(fname):
+    # per tool totals of a metrics file
+    tools = collections.OrderedDict()
+    with open(fname) as f:
+        for l in f:
+            m = json.loads(l)
+            t = tools.setdefault(m['tool'],{'count':0,'failed':0,'wait':0.,'wall':0.,'cpu':0.,'maxrss':0})
+            t['count'] += 1
+            t['failed'] += m['returncode'] != 0
+            t['wait'] += m['wait']
+            t['wall'] += m['wall']
+            t['cpu'] += m['utime']+m['stime']
+            t['maxrss'] = max(t['maxrss'],m['maxrss'])
+    return tools
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='summarise the metrics of external commands')
+    parser.add_argument('metrics',type=Path,help='the JSON lines file written by the commands')
+    args = parser.parse_args(argv)
+
+    print('{:24s} {:>6s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s}'.format(
+        'tool','count','failed','wait [s]','wall [s]','cpu [s]','RSS [MB]'))
+    for tool,t in summary(args.metrics).items():
+        print('{:24s} {:6d} {:6d} {:10.2f} {:10.2f} {:10.2f} {:10.1f}'.format(
+            tool,t['count'],t['failed'],t['wait'],t['wall'],t['cpu'],t['maxrss']/1024/1024))
+
+if __name__ == '__main__':
+    main()
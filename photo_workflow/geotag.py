@@ -0,0 +1,211 @@
+__all__ = ['Track','photo_time','photo_times','write_gps','geotag']
+
+from pathlib import Path
+import argparse, sys, os
+import logging
+import datetime
+import tempfile
+from array import array
+import xml.etree.ElementTree
+
+import numpy
+
+from .config import read_config
+from .tiff import open_tiff
+from .gpx import iter_points, GPXIndex
+from .archive import RAW
+
+DATE_TIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+
+NS = {'x':'adobe:ns:meta/',
+      'rdf':'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+      'exif':'http://ns.adobe.com/exif/1.0/'}
+
+EMPTY_XMP = """<?xml version="1.0" encoding="UTF-8"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="XMP Core 4.4.0-Exiv2">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:exif="http://ns.adobe.com/exif/1.0/"/>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+class Track:
+    # all track points as arrays sorted by time
+    def __init__(self,fnames):
+        t,lat,lon,ele = array('d'),array('d'),array('d'),array('d')
+        for f in fnames:
+            for p in iter_points(f):
+                t.append(p[0])
+                lat.append(p[1])
+                lon.append(p[2])
+                ele.append(p[3])
+        order = numpy.argsort(t,kind='stable')
+        self.t = numpy.asarray(t)[order]
+        self.lat = numpy.asarray(lat)[order]
+        self.lon = numpy.asarray(lon)[order]
+        self.ele = numpy.asarray(ele)[order]
+
+    def __len__(self):
+        return len(self.t)
+
+    def interpolate(self,times,max_gap=300):
+        # linearly interpolate the positions at times in one pass, positions
+        # outside the track or within gaps longer than max_gap are nan
+        times = numpy.asarray(times,dtype=float)
+        nan = numpy.full(times.shape,numpy.nan)
+        if len(self.t) < 2:
+            return nan,nan.copy(),nan.copy()
+        i = numpy.clip(numpy.searchsorted(self.t,times,side='right'),1,len(self.t)-1)
+        t0 = self.t[i-1]
+        t1 = self.t[i]
+        dt = t1-t0
+        valid = (times >= self.t[0]) & (times <= self.t[-1]) & (dt <= max_gap)
+        w = numpy.where(dt > 0,(times-t0)/numpy.where(dt > 0,dt,1),0.)
+        result = []
+        for a in (self.lat,self.lon,self.ele):
+            result.append(numpy.where(valid,a[i-1]+w*(a[i]-a[i-1]),numpy.nan))
+        return tuple(result)
+
+def photo_time(fname,tz=None):
+    # return the time the photo was taken in seconds since the epoch
+    with open_tiff(fname) as tiff:
+        taken = offset = None
+        for entries in tiff.ifds():
+            if DATE_TIME_ORIGINAL in entries:
+                taken = tiff.tag(entries,DATE_TIME_ORIGINAL).rstrip(b'\0').decode()
+                if OFFSET_TIME_ORIGINAL in entries:
+                    offset = tiff.tag(entries,OFFSET_TIME_ORIGINAL).rstrip(b'\0').decode()
+                break
+    if taken is None:
+        return None
+    d = datetime.datetime.strptime(taken,'%Y:%m:%d %H:%M:%S')
+    if offset:
+        d = datetime.datetime.fromisoformat(d.isoformat()+offset)
+    elif tz is not None:
+        d = d.replace(tzinfo=tz)
+    return d.timestamp()
+
+def _dms(value,pos,neg):
+    ref = pos if value >= 0 else neg
+    value = abs(value)
+    deg = int(value)
+    return '{},{:.6f}{}'.format(deg,(value-deg)*60,ref)
+
+def _register_namespaces(fname):
+    for event,(prefix,uri) in xml.etree.ElementTree.iterparse(str(fname),events=('start-ns',)):
+        xml.etree.ElementTree.register_namespace(prefix,uri)
+
+def has_gps(xmpfile):
+    if not xmpfile.exists():
+        return False
+    with open(xmpfile,'rb') as xmp:
+        return b'GPSLatitude' in xmp.read()
+
+def write_gps(xmpfile,lat,lon,ele=None):
+    # add the position to the sidecar, the file is replaced atomically so that
+    # the new mtime triggers a re-render
+    xmpfile = Path(xmpfile)
+    if xmpfile.exists():
+        _register_namespaces(xmpfile)
+        tree = xml.etree.ElementTree.parse(xmpfile)
+    else:
+        tree = xml.etree.ElementTree.ElementTree(xml.etree.ElementTree.fromstring(EMPTY_XMP))
+    for prefix,uri in NS.items():
+        xml.etree.ElementTree.register_namespace(prefix,uri)
+    desc = tree.getroot().find('rdf:RDF/rdf:Description',NS)
+    if desc is None:
+        raise RuntimeError('no rdf:Description in {}'.format(xmpfile))
+    exif = '{'+NS['exif']+'}'
+    desc.set(exif+'GPSVersionID','2.2.0.0')
+    desc.set(exif+'GPSLatitude',_dms(lat,'N','S'))
+    desc.set(exif+'GPSLongitude',_dms(lon,'E','W'))
+    if ele is not None and not numpy.isnan(ele):
+        desc.set(exif+'GPSAltitudeRef','0' if ele >= 0 else '1')
+        desc.set(exif+'GPSAltitude','{}/100'.format(int(round(abs(ele)*100))))
+    fd,tmp = tempfile.mkstemp(dir=xmpfile.parent,prefix='.',suffix='.xmp')
+    with os.fdopen(fd,'wb') as out:
+        tree.write(out,encoding='UTF-8',xml_declaration=True)
+    os.replace(tmp,xmpfile)
+
+def photo_times(photos,tz=None):
+    times = []
+    for p in photos:
+        try:
+            t = photo_time(p,tz=tz)
+        except (OSError,ValueError) as e:
+            logging.warning('cannot read time of {}: {}'.format(p,e))
+            t = None
+        times.append(numpy.nan if t is None else t)
+    return numpy.array(times)
+
+def geotag(photos,times,track,max_gap=300):
+    # geotag the photos taken at times, return the number of tagged photos
+    lat,lon,ele = track.interpolate(times,max_gap=max_gap)
+    tagged = 0
+    for p,la,lo,el in zip(photos,lat,lon,ele):
+        if numpy.isnan(la):
+            logging.debug('no position for {}'.format(p))
+            continue
+        logging.info('tagging {} with {:.5f},{:.5f}'.format(p,la,lo))
+        write_gps(Path(str(p)+'.xmp'),la,lo,el)
+        tagged += 1
+    return tagged
+
+def main(argv=None):
+    TODAY=datetime.datetime.now()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c','--config',help='read configuration from file')
+    parser.add_argument('-y','--year',type=int,default=TODAY.year,help="geotag photos for YEAR, default={}".format(TODAY.year))
+    parser.add_argument('-m','--month',type=int,default=TODAY.month,help="geotag photos for MONTH, default={}".format(TODAY.month))
+    parser.add_argument('-d','--day',type=int,default=TODAY.day,help="geotag photos for DAY, default={}".format(TODAY.day))
+    parser.add_argument('-g','--max-gap',type=float,default=300,
+                        help="largest gap between track points in seconds to interpolate over, default 300")
+    parser.add_argument('-t','--timezone',
+                        help="UTC offset of the camera clock, e.g. +01:00, default: local time")
+    parser.add_argument('-f','--force',action='store_true',default=False,
+                        help="overwrite existing positions")
+    parser.add_argument("directory", nargs='*', type=Path,
+                        help="directories containing the raw files, default the assets folder of the day")
+    args = parser.parse_args(argv)
+
+    cfg = read_config(args.config)
+    assets = Path(cfg['directories']['assets'])
+
+    tz = None
+    if args.timezone is not None:
+        try:
+            tz = datetime.datetime.fromisoformat('2000-01-01T00:00:00'+args.timezone).tzinfo
+        except ValueError:
+            parser.error('cannot parse timezone {}'.format(args.timezone))
+
+    directories = args.directory
+    if not directories:
+        date = datetime.date(args.year,args.month,args.day)
+        directories = [d for d in (assets/date.strftime('%Y')).glob(date.strftime('%Y-%m-%d')+'*')
+                       if d.is_dir()]
+
+    index = None
+    if (assets/'gpx.sqlite').exists():
+        index = GPXIndex(assets/'gpx.sqlite')
+
+    for d in directories:
+        photos = sorted(p for p in d.iterdir() if p.suffix in RAW and
+                        (args.force or not has_gps(Path(str(p)+'.xmp'))))
+        if not photos:
+            continue
+        times = photo_times(photos,tz=tz)
+        gpx = set(p.absolute() for p in d.glob('*.gpx'))
+        if index is not None and not numpy.isnan(times).all():
+            gpx.update(Path(t['path']) for t in index.covering(numpy.nanmin(times)-args.max_gap,
+                                                               numpy.nanmax(times)+args.max_gap))
+        track = Track(sorted(gpx))
+        if len(track) == 0:
+            logging.warning('no track points for {}'.format(d))
+            continue
+        n = geotag(photos,times,track,max_gap=args.max_gap)
+        logging.info('geotagged {} of {} photos in {}'.format(n,len(photos),d))
+
+if __name__ == '__main__':
+    main()
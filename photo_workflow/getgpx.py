@@ -1,15 +1,15 @@
 from pathlib import Path
 import argparse, sys
 import logging
-import easywebdav 
 import datetime
-import keyring,getpass
+import bisect
 
 from .config import read_config
-
-logging.basicConfig(level=logging.INFO)
+from .davsync import DAVSync
+from .gpx import GPXIndex
 
 def get_password(host,user):
+    import keyring,getpass
     pw = keyring.get_password('photo_workflow_'+host,user)
     if pw is None:
         pw = getpass.getpass('Password for {}@{}: '.format(user,host))
@@ -17,32 +17,42 @@ def get_password(host,user):
     return pw
                              
 
-def download_gpx(dav,date,daterange,outdir,add_datedir=True):
+def download_gpx(dav,date,daterange,outdir,add_datedir=True,num_threads=4,index=None):
     prefix=date.strftime('%Y-%m-%d')
     if add_datedir:
         outdir = outdir/date.strftime('%Y')/prefix
-    for gpx in dav.ls():
-        gpx = Path(gpx.name)
+    sync = DAVSync(dav,num_threads=num_threads)
+    if daterange[0] is not None:
+        first,last = daterange
+    else:
+        first,last = date,date
+    # the names start with the date, so the sorted listing can be bisected
+    files = sorted(sync.listing())
+    names = [f[0] for f in files]
+    lo = bisect.bisect_left(names,first.strftime('%Y-%m-%d'))
+    hi = bisect.bisect_left(names,(last+datetime.timedelta(days=1)).strftime('%Y-%m-%d'))
+    todo = []
+    for name,size in files[lo:hi]:
+        gpx = Path(name)
         try:
-            gpx_date = datetime.datetime.strptime(gpx.name,'%Y-%m-%d_%H-%M_%a.gpx').date()
-        except:
+            datetime.datetime.strptime(gpx.name,'%Y-%m-%d_%H-%M_%a.gpx')
+        except ValueError:
             continue
-        if daterange[0] is not None:
-            if gpx_date < daterange[0] or gpx_date > daterange[1]:
-                continue
-        else:
-            if gpx_date != date:
-                continue
-        
+
         o = outdir/gpx.name
         if not o.exists():
-            if not outdir.exists():
-                logging.info('create directory {}'.format(outdir))
-                outdir.mkdir(parents=True)
-            logging.info('downloding gpx file {}'.format(o))
-            dav.download(gpx.name,str(o))
+            todo.append((gpx.name,size,o))
+    if todo and not outdir.exists():
+        logging.info('create directory {}'.format(outdir))
+        outdir.mkdir(parents=True)
+    errors = sync.sync(todo)
+    if index is not None:
+        for name,size,o in todo:
+            if o.exists():
+                index.add(o)
+    return errors
 
-def main():
+def main(argv=None):
     TODAY=datetime.datetime.now()
     
     parser = argparse.ArgumentParser()
@@ -55,8 +65,11 @@ def main():
     
     parser.add_argument('-s','--start-date',metavar='YYYY-MM-DD',help='the start date from which to extract data')
     parser.add_argument('-e','--end-date',metavar='YYYY-MM-DD',help='the end date until which to extract data')
+    parser.add_argument('-n','--num-threads',type=int,default=4,
+                        help='the number of concurrent downloads, default 4')
     
-    args=parser.parse_args()
+    args=parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
 
     date = datetime.date(args.year,args.month,args.day)
 
@@ -83,13 +96,18 @@ def main():
         add_datedir = False
         outdir = Path(args.output_dir)
     
+    import easywebdav
     pw = get_password(cfg['webdav']['host'],cfg['webdav']['username'])
     webdav = easywebdav.connect(cfg['webdav']['host'],username=cfg['webdav']['username'],
                                 password=pw,
                                 protocol=cfg['webdav']['protocol'], port=cfg['webdav']['port'],
                                 path= cfg['webdav']['basedir'])
 
-    download_gpx(webdav,date,(start,end),outdir,add_datedir=add_datedir)
+    index = GPXIndex(Path(cfg['directories']['assets'])/'gpx.sqlite')
+    errors = download_gpx(webdav,date,(start,end),outdir,add_datedir=add_datedir,
+                          num_threads=args.num_threads,index=index)
+    if errors:
+        parser.exit(1,'failed to download {} files\n'.format(len(errors)))
     
 if __name__ == '__main__':
     main()
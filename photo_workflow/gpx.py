@@ -0,0 +1,204 @@
+__all__ = ['iter_points','track_summary','GPXIndex']
+
+import os
+import sqlite3
+import logging
+import datetime
+import argparse
+import xml.etree.ElementTree
+from pathlib import Path
+
+from .config import read_config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+  path TEXT PRIMARY KEY,
+  day TEXT,
+  start REAL,
+  end REAL,
+  minlat REAL,
+  minlon REAL,
+  maxlat REAL,
+  maxlon REAL,
+  npoints INTEGER,
+  size INTEGER,
+  mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS tracks_start ON tracks (start);
+CREATE INDEX IF NOT EXISTS tracks_day ON tracks (day);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value REAL
+);
+"""
+
+FIELDS = ('path','day','start','end','minlat','minlon','maxlat','maxlon','npoints')
+
+def parse_time(t):
+    t = t.strip()
+    if t.endswith('Z'):
+        t = t[:-1]+'+00:00'
+    d = datetime.datetime.fromisoformat(t)
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=datetime.timezone.utc)
+    return d.timestamp()
+
+def _local(tag):
+    return tag.rsplit('}',1)[-1]
+
+def iter_points(fname):
+    # stream the (time, lat, lon, ele) of all track points, time in seconds
+    # since the epoch, elements are cleared as soon as they are read
+    for event,elem in xml.etree.ElementTree.iterparse(str(fname),events=('end',)):
+        if _local(elem.tag) != 'trkpt':
+            continue
+        t = None
+        ele = float('nan')
+        for child in elem:
+            name = _local(child.tag)
+            if name == 'time':
+                t = parse_time(child.text)
+            elif name == 'ele':
+                ele = float(child.text)
+        if t is not None:
+            yield t,float(elem.attrib['lat']),float(elem.attrib['lon']),ele
+        elem.clear()
+
+def track_summary(fname):
+    start = end = None
+    minlat = minlon = float('inf')
+    maxlat = maxlon = -float('inf')
+    n = 0
+    for t,lat,lon,ele in iter_points(fname):
+        if start is None or t < start:
+            start = t
+        if end is None or t > end:
+            end = t
+        minlat = min(minlat,lat)
+        maxlat = max(maxlat,lat)
+        minlon = min(minlon,lon)
+        maxlon = max(maxlon,lon)
+        n += 1
+    if n == 0:
+        return None
+    day = datetime.datetime.fromtimestamp(start,datetime.timezone.utc).strftime('%Y-%m-%d')
+    return {'day':day,'start':start,'end':end,'minlat':minlat,'minlon':minlon,
+            'maxlat':maxlat,'maxlon':maxlon,'npoints':n}
+
+class GPXIndex:
+    # tracks sorted by start time, the B-tree index on start turns range
+    # queries into a binary search followed by a short scan
+    def __init__(self,dbname):
+        self._dbname = Path(dbname)
+        if not self._dbname.parent.exists():
+            self._dbname.parent.mkdir(parents=True)
+        self._db = sqlite3.connect(str(self._dbname))
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    @property
+    def dbname(self):
+        return self._dbname
+
+    def close(self):
+        self._db.close()
+
+    def add(self,fname,st=None):
+        fname = Path(fname).absolute()
+        if st is None:
+            st = fname.stat()
+        try:
+            summary = track_summary(fname)
+        except (xml.etree.ElementTree.ParseError,ValueError) as e:
+            logging.warning('cannot parse {}: {}'.format(fname,e))
+            summary = None
+        if summary is None:
+            summary = dict((f,None) for f in FIELDS)
+        summary['path'] = str(fname)
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO tracks ({},size,mtime) VALUES ({})'.format(
+                ','.join(FIELDS),','.join('?'*(len(FIELDS)+2))),
+                             tuple(summary[f] for f in FIELDS)+(st.st_size,st.st_mtime_ns))
+            if summary['start'] is not None:
+                # the longest track bounds the scan of range queries
+                self._db.execute('INSERT OR REPLACE INTO meta (key,value) VALUES (?,MAX(?,?))',
+                                 ('longest',summary['end']-summary['start'],self.longest))
+
+    def update(self,root):
+        # add new and modified tracks below root and drop removed ones
+        root = Path(root).absolute()
+        known = dict((r['path'],(r['size'],r['mtime'])) for r in self._db.execute(
+            'SELECT path,size,mtime FROM tracks WHERE path LIKE ?',(str(root)+os.sep+'%',)))
+        for dirpath,dirs,files in os.walk(root):
+            for n in files:
+                if not n.endswith('.gpx'):
+                    continue
+                f = Path(dirpath,n)
+                st = f.stat()
+                if known.pop(str(f),None) != (st.st_size,st.st_mtime_ns):
+                    logging.debug('indexing {}'.format(f))
+                    self.add(f,st)
+        with self._db:
+            self._db.executemany('DELETE FROM tracks WHERE path=?',[(p,) for p in known])
+
+    @property
+    def longest(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key='longest'").fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def _rows(self,query,args):
+        return [dict(r) for r in self._db.execute('SELECT {} FROM tracks WHERE {} ORDER BY start'.format(
+            ','.join(FIELDS),query),args)]
+
+    def covering(self,start,end):
+        # tracks overlapping the time window [start,end], times in seconds since the epoch
+        return self._rows('start BETWEEN ? AND ? AND end >= ?',(start-self.longest,end,start))
+
+    def day(self,day):
+        return self._rows('day = ?',(day.strftime('%Y-%m-%d'),))
+
+    def days(self,first,last):
+        return self._rows('day BETWEEN ? AND ?',(first.strftime('%Y-%m-%d'),last.strftime('%Y-%m-%d')))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c','--config',help='read configuration from file')
+    parser.add_argument('-u','--update',action='store_true',default=False,
+                        help='update the index from the GPX files below the assets directory')
+    parser.add_argument('-d','--day',metavar='YYYY-MM-DD',help='list the tracks recorded on DAY')
+    parser.add_argument('-s','--start',metavar='YYYY-MM-DDTHH:MM:SS',
+                        help='list the tracks covering the time window starting at START')
+    parser.add_argument('-e','--end',metavar='YYYY-MM-DDTHH:MM:SS',
+                        help='list the tracks covering the time window ending at END, default START')
+    args = parser.parse_args(argv)
+
+    cfg = read_config(args.config)
+    assets = Path(cfg['directories']['assets'])
+    index = GPXIndex(assets/'gpx.sqlite')
+
+    if args.update:
+        index.update(assets)
+
+    tracks = []
+    try:
+        if args.day is not None:
+            tracks = index.day(datetime.datetime.strptime(args.day,'%Y-%m-%d').date())
+        elif args.start is not None:
+            start = parse_time(args.start)
+            end = start if args.end is None else parse_time(args.end)
+            tracks = index.covering(start,end)
+    except ValueError as e:
+        parser.error('cannot parse date: {}'.format(e))
+    for t in tracks:
+        if t['start'] is None:
+            continue
+        print('{} {} {} {:.5f},{:.5f} {:.5f},{:.5f}'.format(
+            t['path'],
+            datetime.datetime.fromtimestamp(t['start'],datetime.timezone.utc).isoformat(),
+            datetime.datetime.fromtimestamp(t['end'],datetime.timezone.utc).isoformat(),
+            t['minlat'],t['minlon'],t['maxlat'],t['maxlon']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+__all__ = ['TaskIndex','digest']
+
+import sqlite3
+import hashlib
+from pathlib import Path
+
+# number of bytes hashed at the start and at the end of a file
+DIGEST_BLOCK = 64*1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+  path TEXT PRIMARY KEY,
+  mtime INTEGER,
+  out_mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+  directory TEXT,
+  name TEXT,
+  size INTEGER,
+  mtime INTEGER,
+  digest TEXT,
+  xmp_size INTEGER,
+  xmp_mtime INTEGER,
+  xmp_digest TEXT,
+  out_size INTEGER,
+  out_mtime INTEGER,
+  rendered TEXT,
+  pending INTEGER,
+  PRIMARY KEY (directory, name)
+);
+"""
+
+FIELDS = ('name','size','mtime','digest','xmp_size','xmp_mtime','xmp_digest',
+          'out_size','out_mtime','rendered','pending')
+
+def digest(path,size):
+    # quick content hash: the size plus the first and last block of the file
+    h = hashlib.blake2b(str(size).encode(),digest_size=16)
+    with open(path,'rb') as f:
+        if size <= 2*DIGEST_BLOCK:
+            h.update(f.read())
+        else:
+            h.update(f.read(DIGEST_BLOCK))
+            f.seek(-DIGEST_BLOCK,2)
+            h.update(f.read(DIGEST_BLOCK))
+    return h.hexdigest()
+
+class TaskIndex:
+    def __init__(self,dbname):
+        self._dbname = Path(dbname)
+        if not self._dbname.parent.exists():
+            self._dbname.parent.mkdir(parents=True)
+        self._db = sqlite3.connect(str(self._dbname),check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    @property
+    def dbname(self):
+        return self._dbname
+
+    def close(self):
+        self._db.close()
+
+    def directory(self,path):
+        row = self._db.execute('SELECT mtime,out_mtime FROM directories WHERE path=?',
+                               (str(path),)).fetchone()
+        if row is None:
+            return None
+        return row['mtime'],row['out_mtime']
+
+    def files(self,path):
+        rows = self._db.execute('SELECT {} FROM files WHERE directory=?'.format(','.join(FIELDS)),
+                                (str(path),))
+        return {r['name']:dict(r) for r in rows}
+
+    def pending(self,path):
+        rows = self._db.execute('SELECT {} FROM files WHERE directory=? AND pending=1 ORDER BY name'.format(','.join(FIELDS)),
+                                (str(path),))
+        return [dict(r) for r in rows]
+
+    def update(self,path,mtime,out_mtime,records):
+        path = str(path)
+        with self._db:
+            self._db.execute('DELETE FROM files WHERE directory=?',(path,))
+            self._db.executemany('INSERT INTO files (directory,{}) VALUES (?,{})'.format(
+                ','.join(FIELDS),','.join('?'*len(FIELDS))),
+                                 [(path,)+tuple(r[k] for k in FIELDS) for r in records])
+            self._db.execute('INSERT OR REPLACE INTO directories (path,mtime,out_mtime) VALUES (?,?,?)',
+                             (path,mtime,out_mtime))
@@ -0,0 +1,59 @@
+__all__ = ['Journal']
+
+import json
+import time
+import threading
+from pathlib import Path
+
+# append-only record of the life of archive tasks, one JSON object per line
+EVENTS = ('queued','started','finished','failed')
+
+def _path(p):
+    if p is None:
+        return None
+    return str(p)
+
+class Journal:
+    def __init__(self,fname,resume=False):
+        self._fname = Path(fname)
+        self._lock = threading.Lock()
+        if not self._fname.parent.exists():
+            self._fname.parent.mkdir(parents=True)
+        self._journal = open(self._fname,'a' if resume else 'w')
+
+    @property
+    def fname(self):
+        return self._fname
+
+    def close(self):
+        self._journal.close()
+
+    def record(self,event,task,**extra):
+        assert event in EVENTS
+        infile,xmpfile,outfile = task
+        entry = {'time':time.time(),'event':event,'input':_path(infile),
+                 'xmp':_path(xmpfile),'output':_path(outfile)}
+        entry.update(extra)
+        with self._lock:
+            self._journal.write(json.dumps(entry)+'\n')
+            self._journal.flush()
+
+    @staticmethod
+    def replay(fname):
+        # return the last state of every task recorded in the journal
+        state = {}
+        with open(fname) as journal:
+            for l in journal:
+                try:
+                    entry = json.loads(l)
+                except ValueError:
+                    # the last line may be truncated if we were killed
+                    continue
+                xmp = entry['xmp']
+                task = (Path(entry['input']),None if xmp is None else Path(xmp),Path(entry['output']))
+                state[entry['output']] = (task,entry['event'])
+        return state
+
+    @staticmethod
+    def unfinished(fname):
+        return [t for t,e in Journal.replay(fname).values() if e != 'finished']
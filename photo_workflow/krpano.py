@@ -2,17 +2,17 @@ __all__ = ["KRPano"]
 
 import argparse, sys, os
 import logging
-import yaml
 import shutil
-from pathlib import Path
+import tempfile
 import subprocess
-import xml.etree.ElementTree
-import pkg_resources
-from jinja2 import Template
+import threading
+from pathlib import Path
+import functools
+import importlib.resources
 from .config import read_config
-from .scale import scale
+from . import execute
 
-template = Template("""
+HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -42,7 +42,51 @@ template = Template("""
 
 </body>
 </html>
-""")
+"""
+
+HOTSPOTS = """<krpano>
+  <include url="%VIEWER%/plugins/showtext.xml" />
+  <style name="letter"
+               capture="false" handcursor="false"
+               fillcolor="0xffff00" fillalpha="0.30"
+               bordercolor="0xffff00" borderalpha="0.80"
+               onover="tween(alpha, 0.1, 0.25);"
+               onout="tween(alpha, 1.0, 0.25);"
+               ondown.touch="onover(); asyncloop(pressed, onhover(); );"
+               onup.touch="onout();"
+               />
+  <textstyle name="STYLE7"
+             font="Arial" fontsize="14" padding="4" bold="false"
+             edge="left" textalign="left" xoffset="15" yoffset="0"
+             />
+	<style name="button_style"
+               type="text"
+               bgcolor="0x000000"
+               bgalpha="0.5"
+               bgroundedge="0"
+               css="calc:'color:#FFFFFF;font-size:' + 20 + 'px;'"
+               padding="calc:6 + ' ' + 10"
+               />
+
+	<layer name="hotspots" style="button_style" html="Toggle Hotspots"     align="lefttop" y="10" x="10"   onclick="toggle_hotspots();"     />
+
+	<action name="toggle_hotspots">
+          for(set(i,0), i LT hotspot.count, inc(i),
+	  if (hotspot[get(i)].alpha == 0,
+	  set(hotspot[get(i)].alpha ,1);,
+	  set(hotspot[get(i)].alpha ,0););
+          );
+        </action>
+{% for h in hotspots %}  <hotspot name="spot{{ loop.index0 }}" style="letter" type="image" url="hs_circle.png"
+           scale="0.3" ath="{{ h['ath'] }}" atv="{{ h['atv'] }}"
+           onhover="showtext({{ h['description'] }}, STYLE7);"/>
+{% endfor %}</krpano>"""
+
+@functools.lru_cache()
+def compiled(source):
+    # jinja2 is only imported and the templates only compiled when needed
+    import jinja2
+    return jinja2.Environment().from_string(source)
 
 class KRPanoBase:
     def __init__(self,krpanotools):
@@ -51,21 +95,13 @@ class KRPanoBase:
     def krpanotools(self):
         return self._krpanotools
 
-    def run(self,cmd,args):
+    def run(self,cmd,args,timeout=None):
         cmd =  [str(self.krpanotools),cmd] + args
-        logging.debug('running command: '+' '.join(cmd))
-
-        result = subprocess.run(cmd, capture_output=True)
-        if result.returncode != 0:
-            msg = []
-            for l in result.stdout.split(b'\n'):
-                if len(l) > 0:
-                    msg.append(l)
-            raise RuntimeError(b' '.join(msg).decode())
-        else:
-            for l in result.stdout.split(b'\n'):
-                if len(l)>0:
-                    logging.debug(l.decode())
+        # the output is logged line by line as it arrives
+        try:
+            execute.run(cmd,tool='krpanotools '+cmd[1],timeout=timeout)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(' '.join(e.output.split('\n')))
 
 class KRViewer(KRPanoBase):
     def run(self,viewer,domains):
@@ -78,10 +114,13 @@ class KRViewer(KRPanoBase):
         super().run('protect', krpano_args)
 
 class KRPano(KRPanoBase):
-    def __init__(self,krpanotools, panoramas, template):
+    def __init__(self,krpanotools, panoramas, template, native=False, num_processes=None):
         super().__init__(krpanotools)
         self._panoramas = Path(panoramas)
         self._template = Path(template)
+        self._native = native
+        self._num_processes = num_processes
+        self._copied = set()
 
     @property
     def template(self):
@@ -100,78 +139,110 @@ class KRPano(KRPanoBase):
                 raise RuntimeError(f'no such file {fname} or {pname}')
         return pname
 
+    # panoramas built concurrently share the data files
+    _data_lock = threading.Lock()
+
     def add_data(self,dfile,outdir):
+        # the data files are copied at most once per output directory
         oc = outdir/dfile
-        ic = Path(pkg_resources.resource_filename('photo_workflow',
-                                                  'data/'+dfile))
-        if not outdir.exists():
-            outdir.mkdir(parents=True)
-        if not oc.exists():
-            logging.debug(f'copying data file {ic} to {oc}')
-            shutil.copy(ic,oc)
+        with self._data_lock:
+            if oc in self._copied:
+                return
+            outdir.mkdir(parents=True,exist_ok=True)
+            if not oc.exists():
+                with importlib.resources.as_file(importlib.resources.files(__package__)/'data'/dfile) as ic:
+                    logging.debug(f'copying data file {ic} to {oc}')
+                    shutil.copy(ic,oc)
+            self._copied.add(oc)
 
-    def html(self,pano,template,outdir):
-        pass
+    def html(self,pano,outdir,source=HTML):
+        with open(outdir/(pano['pname']+'.html'),'w') as out:
+            out.write(compiled(source).render(**pano))
 
     def hotspots(self,pano,outdir):
-        if not outdir.exists():
-            outdir.mkdir(parents=True)
+        outdir.mkdir(parents=True,exist_ok=True)
 
         self.add_data('hs_circle.png',outdir)
         self.add_data('showtext.xml',outdir/'plugins')
         if 'hotspots' in pano:
             with open(outdir/Path(pano['pname']+'_hotspots.xml'),'w') as hotspots:
-                hotspots.write("""<krpano>
-  <include url="%VIEWER%/plugins/showtext.xml" />
-  <style name="letter"
-               capture="false" handcursor="false"
-               fillcolor="0xffff00" fillalpha="0.30"
-               bordercolor="0xffff00" borderalpha="0.80"
-               onover="tween(alpha, 0.1, 0.25);"
-               onout="tween(alpha, 1.0, 0.25);"
-               ondown.touch="onover(); asyncloop(pressed, onhover(); );"
-               onup.touch="onout();"
-               />
-  <textstyle name="STYLE7"
-             font="Arial" fontsize="14" padding="4" bold="false"
-             edge="left" textalign="left" xoffset="15" yoffset="0"
-             />
-	<style name="button_style"
-               type="text"
-               bgcolor="0x000000"
-               bgalpha="0.5"
-               bgroundedge="0"
-               css="calc:'color:#FFFFFF;font-size:' + 20 + 'px;'"
-               padding="calc:6 + ' ' + 10"
-               />
+                hotspots.write(compiled(HOTSPOTS).render(hotspots=pano['hotspots']))
+
+    def base_xml(self,pano,outdir):
+        # the xml as written by the tiler before the view, hotspots and
+        # debug settings are applied
+        return outdir/Path(pano['pname']+'.base.xml')
+
+    def tiles(self,pano,outdir):
+        return outdir/Path(pano['pname']+'.tiles')
+
+    def params(self,pano):
+        # the settings of the yaml file affecting the tiles and the base xml
+        return dict((o,pano.get(o,'')) for o in ['input','panotype','hfov','vfov','voffset'])
+
+    def tiles_current(self,pano,inpano,outdir):
+        base = self.base_xml(pano,outdir)
+        if not base.is_file() or inpano.stat().st_ctime > base.stat().st_ctime:
+            return False
+        from .tiler import read_manifest, manifest_name
+        return read_manifest(manifest_name(self.tiles(pano,outdir)))['params'] == self.params(pano)
+
+    def tile(self,pano,inpano,outdir):
+        from .tiler import Tiler
+        tiler = Tiler(self.tiles(pano,outdir),num_processes=self._num_processes)
+        sizes = tiler.run(inpano,params=self.params(pano),pname=pano['pname'])
+        tiler.xml(pano,sizes,self.base_xml(pano,outdir))
+        return tiler.changed
+
+    def makepano(self,pano,inpano,outdir,html=False):
+        # render into a staging directory next to the output and only move
+        # the tiles that changed into place
+        with tempfile.TemporaryDirectory(dir=outdir,prefix='.'+pano['pname']+'-') as staging:
+            staging = Path(staging)
+            tiles = staging/Path(pano['pname']+'.tiles')
+            outxml = staging/Path(pano['pname']+'.xml')
+            # setup krpano arguments
+            krpano_args = [
+                f"-panotype={pano['panotype']}",
+                f"-hfov={pano['hfov']}",
+                "-flash=false",
+                f"-tilepath={tiles}/[mres_c/]l%Al/%Av/l%Al[_c]_%Av_%Ah.jpg",
+                f"-xmlpath={outxml}",
+                f"-previewpath={tiles}/preview.jpg",
+                f"-customimage[mobile].path={tiles}/mobile_%s.jpg",
+                f"-config={self.template}",
+                f"-thumbpath={tiles}/thumb.jpg",
+            ]
+
+            if html:
+                krpano_args.append("-html=true")
+                krpano_args.append(f"-htmlpath={outdir}/{pano['pname']}.html")
+            else:
+                krpano_args.append("-html=false")
 
-	<layer name="hotspots" style="button_style" html="Toggle Hotspots"     align="lefttop" y="10" x="10"   onclick="toggle_hotspots();"     />
+            for o in ['vfov','voffset']:
+                if o in pano and pano[o] != '':
+                    krpano_args.append(f"-{o}={pano[o]}")
 
-	<action name="toggle_hotspots">
-          for(set(i,0), i LT hotspot.count, inc(i),
-	  if (hotspot[get(i)].alpha == 0,
-	  set(hotspot[get(i)].alpha ,1);,
-	  set(hotspot[get(i)].alpha ,0););
-          );
-        </action>
-""")
-                for nspot,h in enumerate(pano["hotspots"]):
-                    hotspots.write(f'''  <hotspot name="spot{nspot}" style="letter" type="image" url="hs_circle.png"
-           scale="0.3" ath="{h['ath']}" atv="{h['atv']}"
-           onhover="showtext({h['description']}, STYLE7);"/>
-''')
-                hotspots.write('</krpano>')
+            # run krpano
+            super().run('makepano',krpano_args + [str(inpano)])
 
-    def run(self,pano,outdir, debug=False, html=False):
-        inpano = self.pname(pano['input'])
-        logging.debug(f'input panorama: {inpano}')
-        outxml = outdir/Path(pano['pname']+'.xml')
-        logging.debug(f'output xml: {outxml}')
+            from .tiler import sync_tiles
+            changed = sync_tiles(tiles,self.tiles(pano,outdir),params=self.params(pano))
+            os.replace(outxml,self.base_xml(pano,outdir))
+        logging.info('{} files changed in {}'.format(len(changed),self.tiles(pano,outdir)))
+        return changed
 
-        if not outdir.exists():
-            outdir.mkdir(parents=True)
+    def build_tiles(self,pano,outdir,html=False):
+        inpano = self.pname(pano['input'])
+        if self.tiles_current(pano,inpano,outdir):
+            logging.debug(f"tiles of {pano['pname']} are up to date")
+        elif self._native:
+            self.tile(pano,inpano,outdir)
+        else:
+            self.makepano(pano,inpano,outdir,html=html)
 
-        # handle preview
+    def copy_preview(self,pano,outdir):
         if 'preview' in pano and len(pano['preview']) > 0:
             inpreview = self.pname(pano['preview'])
             outpreview = outdir/Path(pano['pname']+'_small.jpg')
@@ -179,82 +250,71 @@ class KRPano(KRPanoBase):
             if not outpreview.exists() or \
                inpreview.stat().st_ctime > outpreview.stat().st_ctime:
                 logging.debug(f'copying preview {inpreview} to {outpreview}')
+                from .scale import scale
                 scale(inpreview,outpreview)
 
-        # handle twitter card
+    def copy_twittercard(self,pano,outdir):
         if 'twittercard' in pano and len(pano['twittercard'])>0:
             intc = self.pname(pano['twittercard'])
             outtc = outdir/Path(pano['pname']+'_tc.jpg')
-    
+
             if not outtc.exists() or \
                intc.stat().st_ctime > outtc.stat().st_ctime:
                 logging.debug(f'copying twittercard {intc} to {outtc}')
                 shutil.copy(intc,outtc)
 
-        # check output xml
-        if outxml.is_file():
-            if inpano.stat().st_ctime > outxml.stat().st_ctime:
-                logging.debug(f'removing {outxml} as input is newer')
-                outxml.unlink()
-            else:
-                logging.debug('nothing to do')
-                return
-
-        # setup krpano arguments
-        krpano_args = [
-            f"-panotype={pano['panotype']}",
-            f"-hfov={pano['hfov']}",
-            "-flash=false",
-            f"-tilepath={outdir}/{pano['pname']}.tiles/[mres_c/]l%Al/%Av/l%Al[_c]_%Av_%Ah.jpg",
-            f"-xmlpath={outxml}",
-            f"-previewpath={outdir}/{pano['pname']}.tiles/preview.jpg",
-            f"-customimage[mobile].path={outdir}/{pano['pname']}.tiles/mobile_%s.jpg",
-            f"-config={self.template}",
-            f"-thumbpath={outdir}/{pano['pname']}.tiles/thumb.jpg",
-        ]
-
-        if html:
-            krpano_args.append("-html=true")
-            krpano_args.append(f"-htmlpath={outdir}/{pano['pname']}.html")
-        else:
-            krpano_args.append("-html=false")
-            
-        for o in ['vfov','voffset']:
-            if o in pano and pano[o] != '':
-                krpano_args.append(f"-{o}={pano[o]}") 
-
-        # run krpano
-        super().run('makepano',krpano_args + [str(inpano)])
-
-        et = xml.etree.ElementTree.parse(outxml)
-        root = et.getroot()
-        view=root.find('view')
-        if view is not None:
-            for o in ['hlookat','vlookat','fov']:
-                if o in pano and pano[o] != '':
-                    view.attrib[o] = str(pano[o])
+    def patch(self,pano,outdir,debug=False):
+        # stream the base xml applying the view, hotspots and debug settings,
+        # the output is only rewritten if it changes
+        outxml = outdir/Path(pano['pname']+'.xml')
+        view = dict((o,str(pano[o])) for o in ['hlookat','vlookat','fov'] if o in pano and pano[o] != '')
+        append = []
         if 'hotspots' in pano:
-            self.hotspots(pano,outdir)
-            include = xml.etree.ElementTree.SubElement(et.getroot(), 'include')
-            include.attrib['url'] = pano['pname']+'_hotspots.xml'
+            append.append(('include',{'url':pano['pname']+'_hotspots.xml'}))
         if debug:
-            events = xml.etree.ElementTree.SubElement(et.getroot(), 'events')
-            events.attrib['onviewchange'] = "showlog(true);trace('hlookat ',view.hlookat);trace('vlookat ',view.vlookat);trace('fov ',view.fov);"
-
-            include = xml.etree.ElementTree.SubElement(et.getroot(), 'include')
-            include.attrib['url'] = "partialpano_helpertool.xml"
+            append.append(('events',{'onviewchange':"showlog(true);trace('hlookat ',view.hlookat);trace('vlookat ',view.vlookat);trace('fov ',view.fov);"}))
+            append.append(('include',{'url':"partialpano_helpertool.xml"}))
             self.add_data("partialpano_helpertool.xml",outdir)
 
             for t in ['grid.xml','polygonalhotspot_editor.xml','stickie_data.xml',
                       'stickies.xml','numbers.xml','scrollingtext.xml','stickie_engine.xml',
                       'toolbox.xml','distortedhotspot_editor.xml']:
                 self.add_data(t,outdir/'plugins')
-            toolbox = xml.etree.ElementTree.SubElement(et.getroot(), 'include')
-            toolbox.attrib['url'] = "plugins/toolbox.xml"
+            append.append(('include',{'url':"plugins/toolbox.xml"}))
+
+        # xml.sax pulls in urllib, only import it when needed
+        from .xmlpatch import patch_xml
+        data = patch_xml(self.base_xml(pano,outdir),view=view,append=append)
+        if outxml.is_file() and outxml.read_bytes() == data:
+            logging.debug(f'{outxml} is up to date')
+            return False
+        with open(outxml,'wb') as out:
+            out.write(data)
+        return True
+
+    def run(self,pano,outdir, debug=False, html=False):
+        inpano = self.pname(pano['input'])
+        logging.debug(f'input panorama: {inpano}')
+
+        if not outdir.exists():
+            outdir.mkdir(parents=True)
+
+        self.copy_preview(pano,outdir)
+        self.copy_twittercard(pano,outdir)
+
+        self.build_tiles(pano,outdir,html=html)
+
+        if 'hotspots' in pano:
+            self.hotspots(pano,outdir)
+        self.patch(pano,outdir,debug=debug)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'build':
+        from .panobuild import main as build_main
+        return build_main(argv[1:])
 
-        et.write(outxml)
-            
-def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("input", nargs='?',
                         metavar="FILE",help="name of input file")
@@ -269,12 +329,17 @@ def main():
                         help="generate html file")
     parser.add_argument('-s','--hotspots',action="store_true",default=False,
                         help="generate hotspots file only"),
+    parser.add_argument('-N','--native',action="store_true",default=None,
+                        help="generate the tiles without krpano makepano")
+    parser.add_argument('-n','--num-processes',type=int,
+                        help="number of processes used to encode the tiles, default number of CPUs")
     parser.add_argument("-o","--output-dir",metavar="DIR",
                         default="panoramas",type=Path,
                         help="name of output base directory")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     cfg = read_config(args.config)
+    execute.configure_from(cfg)
 
     if args.debug:
         level=logging.DEBUG
@@ -282,8 +347,11 @@ def main():
         level=logging.INFO
     logging.basicConfig(level=level)
     
+    native = args.native
+    if native is None:
+        native = cfg['krpano'].get('tiler','makepano') == 'native'
     krpano = KRPano(cfg['krpano']['tools'],cfg['directories']['panoramas'],
-                    cfg['krpano']['template'])
+                    cfg['krpano']['template'],native=native,num_processes=args.num_processes)
 
     if args.domain is not None:
         krviewer = KRViewer(cfg['krpano']['tools'])
@@ -292,6 +360,7 @@ def main():
         if args.input is None:
             parser.error('no input specified')
     
+        import yaml
         pano = yaml.load(open(args.input,'r'), Loader=yaml.CLoader)
 
     
@@ -301,8 +370,7 @@ def main():
             krpano.run(pano,args.output_dir, debug=args.debug)
 
         if args.html:
-            with open(args.output_dir/(pano['pname']+'.html'),'w') as out:
-                out.write(template.render(**pano))
+            krpano.html(pano,args.output_dir)
             
 if __name__ == '__main__':
     main()
@@ -0,0 +1,112 @@
+__all__ = ['ExifTool','xmp_packet','xmp_subjects','image_tags']
+
+import re
+import json
+import logging
+from html import unescape
+
+from . import execute
+from .tiff import open_tiff, STRIP_OFFSETS, TILE_OFFSETS
+
+XMP_TAG = 700
+# bytes searched for a packet when the image data cannot be located
+HEADER_SCAN = 1024*1024
+
+re_subject = re.compile(rb'<dc:subject>\s*<rdf:(?:Bag|Seq)>(.*?)</rdf:(?:Bag|Seq)>\s*</dc:subject>',re.S)
+re_item = re.compile(rb'<rdf:li[^>]*>(.*?)</rdf:li>',re.S)
+
+def xmp_packet(fname):
+    # return the XMP packet stored in the TIFF header of fname
+    with open_tiff(fname) as tiff:
+        entries,nxt = tiff.ifd(tiff.first)
+        if XMP_TAG in entries:
+            typ,count,pos = entries[XMP_TAG]
+            offset = tiff.unpack('I',pos)[0]
+            return bytes(tiff.buf[offset:offset+count])
+        # only search the header, the pixel data is not paged in and cannot
+        # be mistaken for a packet
+        offsets = [o for t in (STRIP_OFFSETS,TILE_OFFSETS) for o in tiff.tag(entries,t,())]
+        limit = min(offsets) if offsets else min(len(tiff.buf),HEADER_SCAN)
+        start = tiff.buf.find(b'<x:xmpmeta',0,limit)
+        if start < 0:
+            return None
+        end = tiff.buf.find(b'</x:xmpmeta>',start,limit)
+        if end < 0:
+            return None
+        return bytes(tiff.buf[start:end+12])
+
+def xmp_subjects(packet):
+    m = re_subject.search(packet)
+    if m is None:
+        return []
+    return [unescape(t.decode()).strip() for t in re_item.findall(m.group(1))]
+
+class ExifTool:
+    # a single long-lived exiftool process started through the executor
+    def __init__(self,exiftool='exiftool',executor=None,timeout=None):
+        if executor is None:
+            executor = execute.executor()
+        self._process = executor.start([exiftool,'-stay_open','True','-@','-'])
+        self.timeout = timeout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def execute(self,*args):
+        cmd = '\n'.join(str(a) for a in args)+'\n-execute\n'
+        with self._process.batch(timeout=self.timeout) as proc:
+            proc.stdin.write(cmd.encode())
+            proc.stdin.flush()
+            output = b''
+            while not output.endswith(b'{ready}\n'):
+                l = proc.stdout.readline()
+                if not l:
+                    raise RuntimeError('exiftool terminated unexpectedly')
+                output += l
+        return output[:-len(b'{ready}\n')]
+
+    def subjects(self,fnames):
+        if not fnames:
+            return {}
+        output = self.execute('-json','-Subject',*fnames)
+        tags = {}
+        for entry in json.loads(output or b'[]'):
+            subject = entry.get('Subject',[])
+            if not isinstance(subject,list):
+                subject = [subject]
+            tags[entry['SourceFile']] = [str(t).strip() for t in subject]
+        return dict((f,tags.get(str(f),[])) for f in fnames)
+
+    def close(self):
+        if self._process.proc.poll() is None:
+            try:
+                self._process.proc.stdin.write(b'-stay_open\nFalse\n')
+                self._process.proc.stdin.flush()
+            except OSError:
+                pass
+        self._process.close()
+
+def image_tags(fnames,backend='native',exiftool='exiftool'):
+    # return the XMP subjects of all images in one go
+    tags = {}
+    missing = []
+    if backend == 'native':
+        for f in fnames:
+            try:
+                packet = xmp_packet(f)
+            except (OSError,ValueError) as e:
+                logging.debug('cannot read XMP of {}: {}'.format(f,e))
+                packet = None
+            if packet is None:
+                missing.append(f)
+            else:
+                tags[f] = xmp_subjects(packet)
+    else:
+        missing = list(fnames)
+    if missing:
+        with ExifTool(exiftool) as et:
+            tags.update(et.subjects(missing))
+    return tags
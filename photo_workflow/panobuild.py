@@ -0,0 +1,171 @@
+__all__ = ['Step','pano_steps','schedule','find_panoramas']
+
+import argparse, sys, os
+import time
+import logging
+import threading
+import collections
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import yaml
+
+from .config import read_config
+from .krpano import KRPano
+from . import execute
+
+# source identifies the panorama, pname need not be unique across directories
+Step = collections.namedtuple('Step',['pname','name','func','deps','heavy','source'],defaults=(None,))
+
+def find_panoramas(directory):
+    # the (yaml file, panorama) pairs below directory
+    panos = []
+    for f in sorted(Path(directory).glob('**/*.y*ml')):
+        if f.suffix not in ('.yaml','.yml'):
+            continue
+        try:
+            with open(f) as y:
+                pano = yaml.load(y, Loader=yaml.CLoader)
+        except yaml.YAMLError as e:
+            logging.warning(f'cannot read {f}: {e}')
+            continue
+        if not isinstance(pano,dict) or 'pname' not in pano or 'input' not in pano:
+            logging.debug(f'{f} is not a panorama')
+            continue
+        panos.append((f,pano))
+    return panos
+
+def pano_steps(krpano,pano,outdir,debug=False,html=False,source=None):
+    # the steps building a single panorama and their dependencies
+    p = pano['pname']
+    if source is None:
+        source = p
+    steps = [Step(p,'preview',lambda: krpano.copy_preview(pano,outdir),(),False,source),
+             Step(p,'twittercard',lambda: krpano.copy_twittercard(pano,outdir),(),False,source),
+             Step(p,'tiles',lambda: krpano.build_tiles(pano,outdir,html=html),(),True,source)]
+    patch_deps = ('tiles',)
+    if 'hotspots' in pano:
+        steps.append(Step(p,'hotspots',lambda: krpano.hotspots(pano,outdir),(),False,source))
+        patch_deps += ('hotspots',)
+    steps.append(Step(p,'patch',lambda: krpano.patch(pano,outdir,debug=debug),patch_deps,False,source))
+    if html:
+        steps.append(Step(p,'html',lambda: krpano.html(pano,outdir),(),False,source))
+    return steps
+
+def _key(step,name=None):
+    return (step.source if step.source is not None else step.pname,step.name if name is None else name)
+
+def schedule(steps,num_threads=None,heavy=1):
+    # run the steps as soon as their dependencies have finished, at most
+    # heavy of the heavy steps run at the same time, return the elapsed time
+    # and error of each step keyed by (source,name), steps depending on a
+    # failed step are skipped and steps whose dependencies never run fail
+    semaphore = threading.Semaphore(heavy)
+    results = {}
+
+    def run(step):
+        start = time.perf_counter()
+        if step.heavy:
+            with semaphore:
+                start = time.perf_counter()
+                step.func()
+        else:
+            step.func()
+        return time.perf_counter()-start
+
+    pending = list(steps)
+    running = {}
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        while pending or running:
+            waiting = []
+            for s in pending:
+                deps = [results.get(_key(s,d)) for d in s.deps]
+                if any(d is not None and d[1] is not None for d in deps):
+                    logging.warning('skipping {} of {}'.format(s.name,s.pname))
+                    results[_key(s)] = (0.,'skipped')
+                elif all(d is not None for d in deps):
+                    running[pool.submit(run,s)] = s
+                else:
+                    waiting.append(s)
+            if not running:
+                if len(waiting) == len(pending):
+                    # nothing can run and nothing will finish
+                    for s in waiting:
+                        logging.error('{} of {} depends on steps that do not exist'.format(s.name,s.pname))
+                        results[_key(s)] = (0.,'unresolved dependency')
+                    waiting = []
+                pending = waiting
+                continue
+            pending = waiting
+            done,not_done = wait(running,return_when=FIRST_COMPLETED)
+            for f in done:
+                s = running.pop(f)
+                try:
+                    results[_key(s)] = (f.result(),None)
+                except Exception as e:
+                    logging.error('{} of {} failed: {}'.format(s.name,s.pname,e))
+                    results[_key(s)] = (0.,e)
+    return results
+
+def report(results,elapsed):
+    summary = collections.OrderedDict()
+    for (source,name),(t,error) in results.items():
+        count,total,longest,failed = summary.get(name,(0,0.,0.,0))
+        if error is None:
+            summary[name] = (count+1,total+t,max(longest,t),failed)
+        else:
+            summary[name] = (count,total,longest,failed+1)
+    print('{:12s} {:>6s} {:>6s} {:>10s} {:>10s}'.format('step','done','failed','total [s]','max [s]'))
+    for name,(count,total,longest,failed) in summary.items():
+        print('{:12s} {:6d} {:6d} {:10.2f} {:10.2f}'.format(name,count,failed,total,longest))
+    print('built {} panoramas in {:.2f}s'.format(len(set(p for p,n in results)),elapsed))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='photo-krpano build')
+    parser.add_argument("directory", type=Path,
+                        help="directory containing the panorama yaml files")
+    parser.add_argument('-c','--config',help='read configuration from file')
+    parser.add_argument('-d','--debug',action="store_true",default=False,
+                        help="add debug functionality to panoramas")
+    parser.add_argument('-H','--html',action="store_true",default=False,
+                        help="generate html files")
+    parser.add_argument('-N','--native',action="store_true",default=None,
+                        help="generate the tiles without krpano makepano")
+    parser.add_argument('-n','--num-processes',type=int,
+                        help="number of processes used to encode the tiles, default number of CPUs")
+    parser.add_argument('-j','--jobs',type=int,default=1,
+                        help="number of tile jobs running at the same time, default 1")
+    parser.add_argument('-t','--threads',type=int,default=os.cpu_count(),
+                        help="number of steps running at the same time, default number of CPUs")
+    parser.add_argument("-o","--output-dir",metavar="DIR",
+                        default="panoramas",type=Path,
+                        help="name of output base directory")
+    args = parser.parse_args(argv)
+
+    cfg = read_config(args.config)
+    execute.configure_from(cfg)
+
+    if args.debug:
+        level=logging.DEBUG
+    else:
+        level=logging.INFO
+    logging.basicConfig(level=level)
+
+    native = args.native
+    if native is None:
+        native = cfg['krpano'].get('tiler','makepano') == 'native'
+    krpano = KRPano(cfg['krpano']['tools'],cfg['directories']['panoramas'],
+                    cfg['krpano']['template'],native=native,num_processes=args.num_processes)
+
+    args.output_dir.mkdir(parents=True,exist_ok=True)
+    steps = []
+    for f,pano in find_panoramas(args.directory):
+        steps += pano_steps(krpano,pano,args.output_dir,debug=args.debug,html=args.html,source=f)
+
+    start = time.perf_counter()
+    results = schedule(steps,num_threads=args.threads,heavy=args.jobs)
+    report(results,time.perf_counter()-start)
+    if any(e is not None for t,e in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+__all__ = ['embedded_previews','extract_preview']
+
+import io
+import os
+import logging
+
+from .tiff import open_tiff
+
+# tags pointing at embedded JPEG images
+JPEG_OFFSET = 0x201
+JPEG_LENGTH = 0x202
+JPEG_FROM_RAW = 0x2e
+STRIP_OFFSETS = 0x111
+STRIP_BYTES = 0x117
+COMPRESSION = 0x103
+ORIENTATION = 0x112
+
+SOI = b'\xff\xd8\xff'
+# previews smaller than this are thumbnails, keep looking for a larger one
+MIN_PREVIEW = 256*1024
+
+# Image.transpose operations for the EXIF orientations
+TRANSPOSE = {2:'FLIP_LEFT_RIGHT',3:'ROTATE_180',4:'FLIP_TOP_BOTTOM',5:'TRANSPOSE',
+             6:'ROTATE_270',7:'TRANSVERSE',8:'ROTATE_90'}
+
+def _jpeg_length(buf,start):
+    # walk the JPEG segments starting at start and return the length of the image
+    pos = start+2
+    end = len(buf)
+    while pos+4 <= end:
+        if buf[pos] != 0xff:
+            return None
+        marker = buf[pos+1]
+        if marker == 0xff:
+            pos += 1
+            continue
+        if marker == 0xd9:
+            return pos+2-start
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            pos += 2
+            continue
+        length = int.from_bytes(buf[pos+2:pos+4],'big')
+        pos += 2+length
+        if marker == 0xda:
+            eoi = buf.find(b'\xff\xd9',pos)
+            if eoi < 0:
+                return None
+            return eoi+2-start
+    return None
+
+def embedded_previews(tiff):
+    buf = tiff.buf
+    found = set()
+    for entries in tiff.ifds():
+        offset = tiff.tag(entries,JPEG_OFFSET)
+        length = tiff.tag(entries,JPEG_LENGTH)
+        if offset is not None and length is not None:
+            found.add((offset[0],length[0]))
+        if JPEG_FROM_RAW in entries:
+            typ,count,pos = entries[JPEG_FROM_RAW]
+            found.add((tiff.unpack('I',pos)[0],count))
+        if tiff.tag(entries,COMPRESSION,(1,))[0] in (6,7):
+            offsets = tiff.tag(entries,STRIP_OFFSETS)
+            lengths = tiff.tag(entries,STRIP_BYTES)
+            if offsets is not None and lengths is not None and len(offsets) == 1:
+                found.add((offsets[0],lengths[0]))
+    previews = [(o,l) for o,l in found if l > 0 and o+l <= len(buf) and buf[o:o+3] == SOI]
+    if max((l for o,l in previews),default=0) < MIN_PREVIEW:
+        # some makers hide the preview in their maker notes, look for the JPEG markers
+        pos = buf.find(SOI,8)
+        while pos >= 0:
+            length = _jpeg_length(buf,pos)
+            if length is not None:
+                previews.append((pos,length))
+                pos = buf.find(SOI,pos+length)
+            else:
+                pos = buf.find(SOI,pos+3)
+    return sorted(set(previews),key=lambda p: p[1],reverse=True)
+
+def extract_preview(infile,outfile,size=(2048,1024)):
+    from PIL import Image
+
+    with open_tiff(infile) as tiff:
+        previews = embedded_previews(tiff)
+        if not previews:
+            raise RuntimeError('no embedded preview found in {}'.format(infile))
+        offset,length = previews[0]
+        data = tiff.buf[offset:offset+length]
+        entries,nxt = tiff.ifd(tiff.first)
+        orientation = tiff.tag(entries,ORIENTATION,(1,))[0]
+
+    if orientation > 4:
+        # the image is rotated by 90 degrees
+        size = (size[1],size[0])
+    image = Image.open(io.BytesIO(data))
+    image.draft('RGB',size)
+    image.thumbnail(size)
+    if orientation in TRANSPOSE:
+        image = image.transpose(getattr(Image.Transpose,TRANSPOSE[orientation]))
+    logging.debug('writing preview {} of {}'.format(outfile,infile))
+    image.save(outfile,quality=90)
+    # back-date the proof so that the next darktable run replaces it
+    os.utime(outfile,(0,0))
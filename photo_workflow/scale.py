@@ -1,31 +1,212 @@
 from pathlib import Path
-import argparse, sys
+import argparse, sys, os
+import io
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
-import numpy
 
+from .tiff import open_tiff, make_tiff, STRIP_OFFSETS, STRIP_BYTES
 
-def scale(inname, outname, long_side=1500):
+# TIFFs with more pixels than this are decoded in bands
+BAND_LIMIT = 64*1024*1024
+# approximate number of rows decoded at a time
+BAND_ROWS = 512
+
+IMAGE_WIDTH = 0x100
+IMAGE_LENGTH = 0x101
+BITS_PER_SAMPLE = 0x102
+COMPRESSION = 0x103
+SAMPLES_PER_PIXEL = 0x115
+ROWS_PER_STRIP = 0x116
+TILE_OFFSETS = 0x144
+PLANAR_CONFIG = 0x11c
+# tags describing the pixel data, all others are dropped from the bands
+PIXEL_TAGS = (0x100,0x102,0x103,0x106,0x10a,0x115,0x11c,0x13d,0x152,0x153,
+              0x15b,0x212,0x213,0x214)
+
+def target_size(size,long_side):
+    scale = min(long_side / max(size), 1)
+    return tuple(max(int(s*scale),1) for s in size)
+
+def tiff_bands(inname,rows=BAND_ROWS,multiple=1):
+    # yield (first row, band image) decoding only a few strips at a time, the
+    # band heights are a multiple of multiple
+    with open_tiff(inname) as tiff:
+        entries,nxt = tiff.ifd(tiff.first)
+        if TILE_OFFSETS in entries or tiff.tag(entries,PLANAR_CONFIG,(1,))[0] != 1:
+            raise ValueError('cannot decode {} in bands'.format(inname))
+        width = tiff.tag(entries,IMAGE_WIDTH)[0]
+        height = tiff.tag(entries,IMAGE_LENGTH)[0]
+        rps = min(tiff.tag(entries,ROWS_PER_STRIP,(height,))[0],height)
+        offsets = tiff.tag(entries,STRIP_OFFSETS)
+        counts = tiff.tag(entries,STRIP_BYTES)
+        raw = tiff.tag(entries,COMPRESSION,(1,))[0] == 1
+        if raw:
+            # uncompressed strips can be split into single rows
+            bits = sum(tiff.tag(entries,BITS_PER_SAMPLE,(8,)))
+            if len(tiff.tag(entries,BITS_PER_SAMPLE,(8,))) == 1:
+                bits *= tiff.tag(entries,SAMPLES_PER_PIXEL,(1,))[0]
+            stride = (width*bits+7)//8
+            offsets = [o+r*stride for o in offsets for r in range(rps)][:height]
+            counts = [stride]*len(offsets)
+            rps = 1
+        tags = dict((t,entries[t][:2]+(tiff.raw(entries[t]),)) for t in PIXEL_TAGS if t in entries)
+        order = 'little' if tiff.order == '<' else 'big'
+        tiff_order = tiff.order
+    step = multiple//math.gcd(rps,multiple)
+    nstrips = max(rows//(rps*step),1)*step
+    # read the strips with pread rather than through the map so that the
+    # pages of the whole file do not end up in our resident set
+    with open(inname,'rb') as f:
+        for i in range(0,len(offsets),nstrips):
+            y0 = i*rps
+            band = min(nstrips*rps,height-y0)
+            btags = dict(tags)
+            btags[IMAGE_LENGTH] = (4,1,band.to_bytes(4,order))
+            btags[ROWS_PER_STRIP] = (4,1,rps.to_bytes(4,order))
+            strips = [os.pread(f.fileno(),c,o) for o,c in zip(offsets[i:i+nstrips],counts[i:i+nstrips])]
+            if raw:
+                btags[ROWS_PER_STRIP] = (4,1,band.to_bytes(4,order))
+                strips = [b''.join(strips)]
+            image = Image.open(io.BytesIO(make_tiff(tiff_order,btags,strips)))
+            image.load()
+            yield y0,image
+
+def _scale_bands(inname,image,new_size):
+    # reduce the bands by an integer factor and paste them into a canvas
+    # holding at most four times the pixels of the output
+    factor = max(min(image.size[0]//new_size[0],image.size[1]//new_size[1]),1)
+    canvas = None
+    for y0,band in tiff_bands(inname,multiple=factor):
+        if factor > 1:
+            band = band.reduce(factor)
+        if canvas is None:
+            canvas = Image.new(band.mode,(band.size[0],-(-image.size[1]//factor)))
+        canvas.paste(band,(0,y0//factor))
+    return canvas.resize(new_size)
+
+def load_scaled(inname, long_side=1500):
+    # return the image scaled to long_side decoding as little as possible
     image = Image.open(inname)
-    scale = min(long_side / max(image.size), 1)
-    new_size = numpy.array(image.size)*scale
-    new_image = image.resize(new_size.astype(int))
-    new_image.save(outname)
+    new_size = target_size(image.size,long_side)
+    if image.format == 'JPEG':
+        # let the decoder scale in the DCT domain
+        image.draft(None,new_size)
+    elif image.format == 'TIFF' and image.size[0]*image.size[1] > BAND_LIMIT:
+        try:
+            return _scale_bands(inname,image,new_size)
+        except (ValueError,OSError):
+            pass
+    return image.resize(new_size, reducing_gap=3.0)
+
+def scale(inname, outname, long_side=1500):
+    load_scaled(inname, long_side=long_side).save(outname)
 
+FORMATS = {'jpeg':('JPEG','.jpg'),'webp':('WEBP','.webp')}
 
-def main():
+def save_options(fmt,quality=None,progressive=False):
+    options = {}
+    if fmt is not None:
+        options['format'] = FORMATS[fmt][0]
+    if quality is not None:
+        options['quality'] = quality
+    if progressive and fmt != 'webp':
+        options['progressive'] = True
+        options['optimize'] = True
+    return options
+
+def up_to_date(inname,outname):
+    try:
+        return Path(outname).stat().st_mtime >= Path(inname).stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+def scale_sizes(inname,outputs,force=False,**options):
+    # produce all (outname,long_side) from a single decode, each size is
+    # computed from the next larger one, return the names written
+    todo = sorted(((o,l) for o,l in outputs if force or not up_to_date(inname,o)),
+                  key=lambda x: x[1],reverse=True)
+    if not todo:
+        return []
+    image = load_scaled(inname,long_side=todo[0][1])
+    for outname,long_side in todo:
+        new_size = target_size(image.size,long_side)
+        if new_size != image.size:
+            image = image.resize(new_size, reducing_gap=3.0)
+        out = image
+        fmt = options.get('format') or Image.registered_extensions().get(Path(outname).suffix.lower())
+        if fmt == 'JPEG' and out.mode not in ('RGB','L'):
+            out = out.convert('RGB')
+        out.save(outname,**options)
+    return [o for o,l in todo]
+
+def parse_size(value):
+    name,sep,pixels = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError('expected NAME=PIXELS, got {}'.format(value))
+    return name,int(pixels)
+
+def outputs(inname,sizes,outdir=None,fmt=None):
+    inname = Path(inname)
+    if outdir is None:
+        outdir = inname.parent
+    suffix = inname.suffix if fmt is None else FORMATS[fmt][1]
+    return [(outdir/'{}_{}{}'.format(name,inname.stem,suffix),pixels) for name,pixels in sizes]
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--long-side', type=int, default=1500,
                         help="number of pixel of long side, default=1500")
     parser.add_argument('-p', '--prefix', default="small_",
                         help="add prefix to output name, default=small")
+    parser.add_argument('-s', '--size', type=parse_size, action='append', metavar='NAME=PIXELS',
+                        help="produce an image NAME_IMAGE with PIXELS on the long side, "
+                        "can be repeated, overrides --long-side and --prefix")
+    parser.add_argument('-o', '--outdir', type=Path,
+                        help="write the images to OUTDIR, default next to the input")
+    parser.add_argument('-f', '--format', choices=sorted(FORMATS),
+                        help="output format, default the format of the input")
+    parser.add_argument('-q', '--quality', type=int,
+                        help="quality of the output images")
+    parser.add_argument('--progressive', action='store_true', default=False,
+                        help="write progressive JPEGs")
+    parser.add_argument('-n', '--num-processes', type=int,
+                        help="number of processes, default number of CPUs")
+    parser.add_argument('--force', action='store_true', default=False,
+                        help="overwrite output images that are up to date")
     parser.add_argument("image", nargs='+', type=Path,
                         help="image files to be processed")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    options = save_options(args.format,quality=args.quality,progressive=args.progressive)
+    if args.outdir is not None:
+        args.outdir.mkdir(parents=True,exist_ok=True)
 
+    jobs = []
     for p in args.image:
-        out = p.parent / Path(args.prefix + p.name)
-        if not out.exists():
-            scale(p, out, long_side=args.long_side)
+        if args.size:
+            out = outputs(p,args.size,outdir=args.outdir,fmt=args.format)
+        else:
+            outdir = p.parent if args.outdir is None else args.outdir
+            name = args.prefix + (p.name if args.format is None else p.stem+FORMATS[args.format][1])
+            out = [(outdir/name,args.long_side)]
+        jobs.append((p,out))
+
+    if len(jobs) == 1 or args.num_processes == 1:
+        for p,out in jobs:
+            scale_sizes(p,out,force=args.force,**options)
+        return
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.num_processes) as pool:
+        futures = dict((pool.submit(scale_sizes,p,out,force=args.force,**options),p) for p,out in jobs)
+        for f in as_completed(futures):
+            try:
+                f.result()
+            except Exception as e:
+                print('failed to scale {}: {}'.format(futures[f],e),file=sys.stderr)
+                failed = True
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+__all__ = ['estimate_cost','default_workers','xmp_modules']
+
+import os
+import re
+import logging
+
+# relative cost of developing the different raw formats
+FORMAT_COST = {'.RW2':1.0,'.nef':1.2,'.NEF':1.2,'.ORF':1.3}
+# extra cost of expensive darktable modules, relative to a plain export
+HEAVY_MODULES = {'denoiseprofile':1.5,'nlmeans':1.5,'bilateral':0.5,'diffuse':3.0,
+                 'retouch':1.0,'liquify':0.5,'lens':0.3,'ashift':0.3,
+                 'hazeremoval':0.5,'toneequal':0.5,'atrous':0.5,'bilat':0.3}
+# memory needed by a single darktable-cli process
+WORKER_MEMORY = 1536*1024*1024
+
+re_history = re.compile(rb'<rdf:li\b[^>]*?darktable:operation="([a-z0-9_]+)"[^>]*>')
+re_enabled = re.compile(rb'darktable:enabled="0"')
+
+def xmp_modules(xmpfile):
+    modules = set()
+    with open(xmpfile,'rb') as xmp:
+        for m in re_history.finditer(xmp.read()):
+            if re_enabled.search(m.group(0)):
+                modules.discard(m.group(1).decode())
+            else:
+                modules.add(m.group(1).decode())
+    return modules
+
+def estimate_cost(infile,xmpfile=None):
+    try:
+        size = os.stat(infile).st_size
+    except OSError:
+        size = 0
+    cost = size/(1024*1024)*FORMAT_COST.get(os.path.splitext(str(infile))[1],1.0)
+    if xmpfile is not None:
+        try:
+            modules = xmp_modules(xmpfile)
+        except OSError:
+            modules = set()
+        cost *= 1 + sum(HEAVY_MODULES.get(m,0) for m in modules)
+    return cost
+
+def available_memory():
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for l in meminfo:
+                if l.startswith('MemAvailable:'):
+                    return int(l.split()[1])*1024
+    except OSError:
+        pass
+    return None
+
+def default_workers(memory=WORKER_MEMORY):
+    ncpu = len(os.sched_getaffinity(0)) if hasattr(os,'sched_getaffinity') else os.cpu_count()
+    nproc = ncpu or 1
+    mem = available_memory()
+    if mem is not None:
+        nproc = min(nproc,mem//memory)
+    nproc = max(nproc,1)
+    logging.debug('using {} workers ({} cpus, {} bytes available memory)'.format(nproc,ncpu,mem))
+    return nproc
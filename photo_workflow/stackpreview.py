@@ -0,0 +1,166 @@
+__all__ = ['frames','contact_sheet','focus_stack','preview_folder','find_folders']
+
+from pathlib import Path
+import argparse, sys, os
+import math
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .config import read_config
+
+CONTACT = 'contact_sheet.jpg'
+FOCUS = 'focus_preview.jpg'
+# long side of the focus stack preview and of the thumbnails
+PREVIEW = 2048
+THUMB = 240
+# rows of the preview handled at a time when comparing the frames
+TILE = 256
+COLUMNS = 12
+LABEL = 16
+
+def frames(folder):
+    # the TIFFs of a project folder, the JPEGs if there are none
+    folder = Path(folder)
+    images = sorted(f for f in folder.iterdir() if f.suffix.lower() in ('.tif','.tiff'))
+    if not images:
+        images = sorted(f for f in folder.iterdir()
+                        if f.suffix.lower() in ('.jpg','.jpeg') and f.name not in (CONTACT,FOCUS))
+    return images
+
+def up_to_date(images,outputs):
+    try:
+        oldest = min(o.stat().st_mtime for o in outputs)
+    except FileNotFoundError:
+        return False
+    return all(f.stat().st_mtime <= oldest for f in images)
+
+def laplacian_energy(gray):
+    # absolute Laplacian smoothed over 3x3 pixels, the first and last row and
+    # column only see the replicated edge
+    import numpy
+    g = numpy.pad(gray,1,mode='edge')
+    lap = numpy.abs(4*g[1:-1,1:-1]-g[:-2,1:-1]-g[2:,1:-1]-g[1:-1,:-2]-g[1:-1,2:])
+    lap = numpy.pad(lap,1,mode='edge')
+    energy = sum(lap[dy:dy+gray.shape[0],dx:dx+gray.shape[1]] for dy in range(3) for dx in range(3))
+    return energy
+
+class FocusStack:
+    # keep the pixels of the sharpest frame seen so far, the frames are
+    # added one at a time so that the memory needed does not depend on
+    # their number and only TILE rows of temporaries exist at once
+    def __init__(self,tile=TILE):
+        self.tile = tile
+        self.size = None
+        self.energy = None
+        self.best = None
+
+    def add(self,image):
+        import numpy
+        if self.size is None:
+            self.size = image.size
+            self.energy = numpy.full((image.size[1],image.size[0]),-1,dtype=numpy.float32)
+            self.best = numpy.zeros((image.size[1],image.size[0],3),dtype=numpy.uint8)
+        elif image.size != self.size:
+            image = image.resize(self.size)
+        rgb = numpy.asarray(image.convert('RGB'))
+        gray = numpy.asarray(image.convert('L'),dtype=numpy.float32)
+        h = gray.shape[0]
+        for y0 in range(0,h,self.tile):
+            y1 = min(y0+self.tile,h)
+            # two rows of context for the Laplacian and the smoothing
+            a,b = max(y0-2,0),min(y1+2,h)
+            e = laplacian_energy(gray[a:b])[y0-a:y1-a]
+            sharper = e > self.energy[y0:y1]
+            self.energy[y0:y1][sharper] = e[sharper]
+            self.best[y0:y1][sharper] = rgb[y0:y1][sharper]
+
+    def image(self):
+        from PIL import Image
+        return Image.fromarray(self.best)
+
+def contact_sheet(thumbs,names,thumb=THUMB,columns=COLUMNS):
+    from PIL import Image, ImageDraw
+    columns = min(columns,max(math.ceil(math.sqrt(len(thumbs))),1))
+    rows = -(-len(thumbs)//columns)
+    sheet = Image.new('RGB',(columns*thumb,rows*(thumb+LABEL)),'white')
+    draw = ImageDraw.Draw(sheet)
+    for i,(t,name) in enumerate(zip(thumbs,names)):
+        x = (i%columns)*thumb
+        y = (i//columns)*(thumb+LABEL)
+        sheet.paste(t,(x+(thumb-t.size[0])//2,y+(thumb-t.size[1])//2))
+        draw.text((x+2,y+thumb+2),name,fill='black')
+    return sheet
+
+def preview_folder(folder,size=PREVIEW,thumb=THUMB,stack=None,force=False,quality=85):
+    # write the contact sheet and for focus stacks the focus stack preview
+    # of folder, every frame is decoded once at preview size, return the
+    # number of frames or None if the outputs are up to date
+    from .scale import load_scaled, target_size
+    folder = Path(folder)
+    if stack is None:
+        stack = folder.parent.name == 'stack'
+    images = frames(folder)
+    outputs = [folder/CONTACT]+([folder/FOCUS] if stack else [])
+    if not images or (not force and up_to_date(images,outputs)):
+        return None
+    focus = FocusStack() if stack else None
+    thumbs = []
+    for f in images:
+        logging.debug('reading {}'.format(f))
+        image = load_scaled(f,long_side=size if stack else thumb)
+        if image.mode not in ('RGB','L'):
+            image = image.convert('RGB')
+        if focus is not None:
+            focus.add(image)
+        thumbs.append(image.resize(target_size(image.size,thumb),reducing_gap=3.0))
+    contact_sheet(thumbs,[f.name for f in images],thumb=thumb).save(folder/CONTACT,quality=quality)
+    if focus is not None:
+        focus.image().save(folder/FOCUS,quality=quality)
+    return len(images)
+
+def find_folders(root):
+    return [d for p in ('panoramas','stack') if (root/p).is_dir()
+            for d in sorted((root/p).iterdir()) if d.is_dir()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='write contact sheets and focus stack previews of project folders')
+    parser.add_argument('folder',nargs='*',type=Path,
+                        help='project folders, default all below panoramas and stack in the temporary directory')
+    parser.add_argument('-c','--config',help='read configuration from file')
+    parser.add_argument('-j','--jobs',type=int,
+                        help='number of folders processed at the same time, default number of CPUs')
+    parser.add_argument('-s','--size',type=int,default=PREVIEW,
+                        help='long side of the focus stack preview, default {}'.format(PREVIEW))
+    parser.add_argument('-t','--thumb',type=int,default=THUMB,
+                        help='long side of the thumbnails of the contact sheet, default {}'.format(THUMB))
+    parser.add_argument('-f','--force',action='store_true',default=False,
+                        help='rewrite previews that are up to date')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    folders = args.folder
+    if not folders:
+        cfg = read_config(args.config)
+        folders = find_folders(Path(cfg['directories']['tempdir']))
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = dict((executor.submit(preview_folder,d,size=args.size,thumb=args.thumb,force=args.force),d)
+                       for d in folders)
+        for f in as_completed(futures):
+            d = futures[f]
+            try:
+                n = f.result()
+            except Exception as e:
+                logging.error('failed to preview {}: {}'.format(d,e))
+                failed += 1
+                continue
+            if n is None:
+                logging.debug('{} is up to date'.format(d))
+            else:
+                logging.info('{}: {} frames'.format(d,n))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
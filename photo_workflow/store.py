@@ -0,0 +1,131 @@
+__all__ = ['Store']
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+from .backup import copy_data, is_partial
+
+# size of the chunks files are split into
+CHUNK = 8*1024*1024
+
+class Store:
+    # content addressed backup store, files are split into chunks which are
+    # stored once and each project tree is described by a manifest
+    def __init__(self,root,chunk_size=CHUNK):
+        self._root = Path(root)
+        self.chunk_size = chunk_size
+        for d in (self.chunks,self.manifests):
+            if not d.exists():
+                d.mkdir(parents=True,exist_ok=True)
+
+    @property
+    def root(self):
+        return self._root
+
+    @property
+    def chunks(self):
+        return self._root/'chunks'
+
+    @property
+    def manifests(self):
+        return self._root/'manifests'
+
+    def chunk(self,h):
+        return self.chunks/h[:2]/h[2:]
+
+    def manifest(self,name):
+        return self.manifests/(str(name)+'.json')
+
+    def _write(self,fname,data):
+        if not fname.parent.exists():
+            fname.parent.mkdir(parents=True,exist_ok=True)
+        fd,tmp = tempfile.mkstemp(dir=fname.parent,prefix='.',suffix='.part')
+        with os.fdopen(fd,'wb') as out:
+            out.write(data)
+        os.replace(tmp,fname)
+
+    def put(self,fname):
+        # store the content of fname, return the hashes of its chunks
+        hashes = []
+        with open(fname,'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data and hashes:
+                    break
+                h = hashlib.blake2b(data,digest_size=20).hexdigest()
+                c = self.chunk(h)
+                if not c.exists():
+                    self._write(c,data)
+                    c.chmod(0o444)
+                hashes.append(h)
+                if len(data) < self.chunk_size:
+                    break
+        return hashes
+
+    def load(self,name):
+        m = self.manifest(name)
+        if not m.exists():
+            return {}
+        with open(m) as f:
+            return json.load(f)
+
+    def backup(self,name,tree,include_tif=True):
+        # store all files below tree, unchanged files are taken from the previous manifest
+        tree = Path(tree)
+        old = self.load(name)
+        files = {}
+        for root,dirs,fnames in os.walk(tree):
+            root = Path(root)
+            for n in fnames:
+                if is_partial(n) or (not include_tif and n.endswith('.tif')):
+                    continue
+                f = root/n
+                rel = str(f.relative_to(tree))
+                st = f.stat()
+                prev = old.get(rel)
+                if prev is not None and prev['size'] == st.st_size and prev['mtime'] == st.st_mtime_ns:
+                    files[rel] = prev
+                    continue
+                logging.debug('storing file {}'.format(f))
+                files[rel] = {'size':st.st_size,'mtime':st.st_mtime_ns,
+                              'mode':st.st_mode & 0o777,'chunks':self.put(f)}
+        if files != old:
+            self._write(self.manifest(name),json.dumps(files,indent=1).encode())
+        return files
+
+    def restore(self,name,dest,hardlink=False):
+        # materialise the tree described by manifest name below dest
+        dest = Path(dest)
+        files = self.load(name)
+        if not files:
+            raise RuntimeError('no manifest {}'.format(name))
+        for rel,entry in files.items():
+            o = dest/rel
+            if not o.parent.exists():
+                o.parent.mkdir(parents=True,exist_ok=True)
+            if o.exists():
+                o.unlink()
+            if hardlink and len(entry['chunks']) == 1:
+                # shares the read-only chunk, mode and mtime are those of the store
+                try:
+                    os.link(self.chunk(entry['chunks'][0]),o)
+                    continue
+                except OSError:
+                    pass
+            with open(o,'wb') as out:
+                # copy_file_range shares the extents on filesystems supporting reflinks
+                for h in entry['chunks']:
+                    c = self.chunk(h)
+                    with open(c,'rb') as inp:
+                        copy_data(inp.fileno(),out.fileno(),os.fstat(inp.fileno()).st_size)
+            os.chmod(o,entry['mode'])
+            os.utime(o,ns=(entry['mtime'],entry['mtime']))
+        return files
+
+    def projects(self):
+        return sorted(str(m.relative_to(self.manifests))[:-len('.json')]
+                      for m in self.manifests.glob('**/*.json'))
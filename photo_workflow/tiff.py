@@ -0,0 +1,139 @@
+__all__ = ['TIFF','open_tiff','make_tiff']
+
+import mmap
+import struct
+from contextlib import contextmanager
+
+# size of the TIFF field types
+TYPES = {1:1,2:1,3:2,4:4,5:8,6:1,7:1,8:2,9:4,10:8,11:4,12:8,13:4,16:8,17:8,18:8}
+FORMATS = {1:'B',2:'c',3:'H',4:'I',5:'II',6:'b',7:'B',8:'h',9:'i',10:'ii',11:'f',12:'d',13:'I',
+           16:'Q',17:'q',18:'Q'}
+# magic numbers of plain TIFF, Panasonic RW2 and Olympus ORF files
+MAGIC = (42,0x55,0x4f52,0x5352)
+
+EXIF_IFD = 0x8769
+SUB_IFDS = 0x14a
+STRIP_OFFSETS = 0x111
+STRIP_BYTES = 0x117
+TILE_OFFSETS = 0x144
+
+class TIFF:
+    def __init__(self,buf):
+        self.buf = buf
+        order = bytes(buf[:2])
+        if order == b'II':
+            self.order = '<'
+        elif order == b'MM':
+            self.order = '>'
+        else:
+            raise ValueError('not a TIFF file')
+        magic, = self.unpack('H',2)
+        if magic not in MAGIC:
+            raise ValueError('unknown TIFF magic number {:#x}'.format(magic))
+        self.first, = self.unpack('I',4)
+
+    def unpack(self,fmt,offset):
+        return struct.unpack_from(self.order+fmt,self.buf,offset)
+
+    def ifd(self,offset,base=0):
+        # return the entries of the IFD at offset and the offset of the next IFD
+        entries = {}
+        n, = self.unpack('H',base+offset)
+        for i in range(n):
+            pos = base+offset+2+12*i
+            tag,typ,count = self.unpack('HHI',pos)
+            entries[tag] = (typ,count,pos+8)
+        nxt, = self.unpack('I',base+offset+2+12*n)
+        return entries,nxt
+
+    def value(self,entry,base=0):
+        typ,count,pos = entry
+        size = TYPES.get(typ,1)*count
+        if size > 4:
+            pos = base+self.unpack('I',pos)[0]
+        if typ in (2,7):
+            return bytes(self.buf[pos:pos+count])
+        fmt = FORMATS[typ]
+        return self.unpack('{}{}'.format(count,fmt) if len(fmt)==1 else fmt*count,pos)
+
+    def raw(self,entry):
+        # return the bytes holding the value of entry
+        typ,count,pos = entry
+        size = TYPES.get(typ,1)*count
+        if size > 4:
+            pos = self.unpack('I',pos)[0]
+        return bytes(self.buf[pos:pos+size])
+
+    def tag(self,entries,tag,default=None,base=0):
+        if tag not in entries:
+            return default
+        return self.value(entries[tag],base=base)
+
+    def ifds(self):
+        # walk the IFD chain together with the EXIF and sub IFDs
+        todo = [self.first]
+        seen = set()
+        while todo:
+            offset = todo.pop(0)
+            if offset == 0 or offset in seen or offset >= len(self.buf):
+                continue
+            seen.add(offset)
+            try:
+                entries,nxt = self.ifd(offset)
+            except struct.error:
+                continue
+            yield entries
+            for t in (EXIF_IFD,SUB_IFDS):
+                if t in entries:
+                    todo += list(self.value(entries[t]))
+            todo.append(nxt)
+
+@contextmanager
+def open_tiff(path):
+    with open(path,'rb') as f:
+        buf = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            yield TIFF(buf)
+        finally:
+            buf.close()
+
+def make_tiff(order,tags,strips):
+    # build a single image TIFF from the raw tag values {tag: (type,count,bytes)}
+    # and the already encoded strips
+    tags = dict(tags)
+    tags[STRIP_OFFSETS] = (4,len(strips),None)
+    tags[STRIP_BYTES] = (4,len(strips),struct.pack(order+'{}I'.format(len(strips)),*(len(d) for d in strips)))
+    n = len(tags)
+    pos = 8+2+12*n+4
+    extra = []
+    for t in sorted(tags):
+        typ,count,value = tags[t]
+        size = TYPES.get(typ,1)*count
+        if size > 4:
+            extra.append(t)
+            pos += size+(size&1)
+    offsets = []
+    for d in strips:
+        offsets.append(pos)
+        pos += len(d)
+    tags[STRIP_OFFSETS] = (4,len(strips),struct.pack(order+'{}I'.format(len(strips)),*offsets))
+
+    out = bytearray(b'II' if order == '<' else b'MM')
+    out += struct.pack(order+'HI',42,8)
+    out += struct.pack(order+'H',n)
+    pos = 8+2+12*n+4
+    values = bytearray()
+    for t in sorted(tags):
+        typ,count,value = tags[t]
+        if t in extra:
+            out += struct.pack(order+'HHII',t,typ,count,pos+len(values))
+            values += value
+            if len(value)&1:
+                values += b'\0'
+        else:
+            out += struct.pack(order+'HHI',t,typ,count)+value.ljust(4,b'\0')
+    out += struct.pack(order+'I',0)
+    out += values
+    for d in strips:
+        out += d
+    return bytes(out)
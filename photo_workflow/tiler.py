@@ -0,0 +1,324 @@
+__all__ = ['Tiler','levels','vfov','manifest_name','mobile_name','read_manifest','write_manifest','prune','sync_tiles']
+
+import os
+import math
+import json
+import hashlib
+import tempfile
+import logging
+import collections
+import xml.etree.ElementTree
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+from .scale import tiff_bands
+
+TILESIZE = 512
+QUALITY = 80
+PREVIEW = 1024
+MOBILE = 2048
+THUMB = 240
+# levels with fewer pixels are also kept as a whole for the preview images
+KEEP = 4096*4096
+
+# krpano image types and their geometry elements
+GEOMETRY = {'flat':'flat','cylinder':'cylinder','sphere':'sphere'}
+
+def levels(size,tilesize=TILESIZE):
+    # sizes of the levels from the largest to the one fitting a single tile
+    sizes = [tuple(size)]
+    while max(sizes[-1]) > tilesize:
+        w,h = sizes[-1]
+        sizes.append((-(-w//2),-(-h//2)))
+    return sizes
+
+def vfov(panotype,hfov,size):
+    # vertical field of view of an image of size covering hfov degrees
+    w,h = size
+    if panotype == 'flat':
+        return math.degrees(2*math.atan(math.tan(math.radians(hfov)/2)*h/w))
+    if panotype == 'cylinder':
+        return math.degrees(2*math.atan(math.radians(hfov)*h/w/2))
+    return hfov*h/w
+
+def _digits(n):
+    return len(str(n))
+
+def _placeholder(c,n):
+    # krpano pads the tile index with %0v, %00v, ...
+    return '%'+'0'*(_digits(n)-1)+c
+
+def mobile_name(pname):
+    # the name makepano gives the mobile image
+    return 'mobile_{}.jpg'.format(pname)
+
+def manifest_name(tiles):
+    return Path(tiles).parent/(Path(tiles).name+'.json')
+
+def read_manifest(fname):
+    # {'params': ..., 'tiles': {path relative to the tiles directory: hash}}
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (FileNotFoundError,ValueError):
+        return {'params':None,'tiles':{}}
+
+def write_manifest(fname,manifest):
+    fname = Path(fname)
+    fd,tmp = tempfile.mkstemp(dir=fname.parent,prefix='.',suffix='.json')
+    with os.fdopen(fd,'w') as out:
+        json.dump(manifest,out,indent=0,sort_keys=True)
+    os.replace(tmp,fname)
+
+def prune(tiles,keep):
+    # remove all files below tiles not in keep and the empty directories
+    removed = []
+    for dirpath,dirs,files in os.walk(tiles,topdown=False):
+        for n in files:
+            f = Path(dirpath,n)
+            rel = f.relative_to(tiles).as_posix()
+            if rel not in keep:
+                f.unlink()
+                removed.append(rel)
+        if dirpath != str(tiles) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+def pixel_hash(image):
+    h = hashlib.blake2b(digest_size=16)
+    h.update('{} {} {}'.format(image.mode,*image.size).encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+def file_hash(fname):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fname,'rb') as f:
+        for block in iter(lambda: f.read(1024*1024),b''):
+            h.update(block)
+    return h.hexdigest()
+
+def save_if_changed(image,tiles,rel,old,quality):
+    # encode image unless a file with the same pixels exists, return the hash
+    # and whether the file was written
+    digest = pixel_hash(image)
+    path = tiles/rel
+    if old.get(rel) == digest and path.exists():
+        return digest,False
+    path.parent.mkdir(parents=True,exist_ok=True)
+    image.save(path,quality=quality)
+    return digest,True
+
+def sync_tiles(staging,tiles,params=None):
+    # move the files rendered into staging over tiles keeping the files whose
+    # content did not change, the hashes are over the encoded files, return
+    # the changed files
+    mname = manifest_name(tiles)
+    old = read_manifest(mname)['tiles']
+    new = {}
+    changed = []
+    for dirpath,dirs,files in os.walk(staging):
+        for n in files:
+            src = Path(dirpath,n)
+            rel = src.relative_to(staging).as_posix()
+            new[rel] = file_hash(src)
+            dst = tiles/rel
+            if old.get(rel) == new[rel] and dst.exists():
+                continue
+            dst.parent.mkdir(parents=True,exist_ok=True)
+            os.replace(src,dst)
+            changed.append(rel)
+    tiles.mkdir(parents=True,exist_ok=True)
+    prune(tiles,new)
+    write_manifest(mname,{'params':params,'tiles':new})
+    return changed
+
+def _save_tiles(mode,size,data,tiles,paths,old,tilesize,quality):
+    row = Image.frombytes(mode,size,data)
+    result = []
+    for h,rel in enumerate(paths):
+        tile = row.crop((h*tilesize,0,min((h+1)*tilesize,size[0]),size[1]))
+        result.append((rel,)+save_if_changed(tile,tiles,rel,old,quality))
+    return result
+
+def _vstack(top,bottom):
+    image = Image.new(top.mode,(top.size[0],top.size[1]+bottom.size[1]))
+    image.paste(top,(0,0))
+    image.paste(bottom,(0,top.size[1]))
+    return image
+
+class Tiler:
+    # build the multires tile pyramid of a flat or partial panorama, the
+    # source is read in bands which are pushed through all levels, only
+    # tiles whose pixels changed since the last run are encoded
+    def __init__(self,tiles,tilesize=TILESIZE,quality=QUALITY,num_processes=None):
+        self._tiles = Path(tiles)
+        self._changed = []
+        self._tilesize = tilesize
+        self._quality = quality
+        self._num_processes = num_processes if num_processes is not None else os.cpu_count()
+
+    @property
+    def tiles(self):
+        return self._tiles
+
+    @property
+    def manifest(self):
+        return manifest_name(self.tiles)
+
+    @property
+    def changed(self):
+        # the files written by the last run
+        return self._changed
+
+    @property
+    def tilesize(self):
+        return self._tilesize
+
+    def ntiles(self,size):
+        return -(-size[0]//self.tilesize),-(-size[1]//self.tilesize)
+
+    def tile_path(self,sizes,k,v,h):
+        # l%Al/%Av/l%Al_%Av_%Ah.jpg with l1 the smallest level
+        nh,nv = self.ntiles(sizes[k])
+        l = '{:0{}d}'.format(len(sizes)-k,_digits(len(sizes)))
+        v = '{:0{}d}'.format(v+1,_digits(nv))
+        h = '{:0{}d}'.format(h+1,_digits(nh))
+        return Path('l'+l,v,'l{}_{}_{}.jpg'.format(l,v,h))
+
+    def url(self,sizes,k):
+        nh,nv = self.ntiles(sizes[k])
+        l = _placeholder('l',len(sizes))
+        return 'l{l}/{v}/l{l}_{v}_{h}.jpg'.format(l=l,v=_placeholder('v',nv),h=_placeholder('h',nh))
+
+    def _bands(self,inname):
+        image = Image.open(inname)
+        if image.format == 'TIFF':
+            bands = tiff_bands(inname,rows=self.tilesize)
+            try:
+                first = next(bands)
+            except (ValueError,OSError):
+                pass
+            else:
+                yield first
+                yield from bands
+                return
+        image.load()
+        for y0 in range(0,image.size[1],self.tilesize):
+            yield y0,image.crop((0,y0,image.size[0],min(y0+self.tilesize,image.size[1])))
+
+    def _emit(self,k,row):
+        v = self._rows[k]
+        self._rows[k] += 1
+        nh,nv = self.ntiles(self._sizes[k])
+        paths = [self.tile_path(self._sizes,k,v,h).as_posix() for h in range(nh)]
+        old = dict((p,self._old[p]) for p in paths if p in self._old)
+        self._futures.append(self._pool.submit(_save_tiles,row.mode,row.size,row.tobytes(),
+                                               self.tiles,paths,old,self.tilesize,self._quality))
+        # bound the number of tile rows waiting to be encoded
+        while len(self._futures) > 2*self._num_processes:
+            self._collect(self._futures.popleft())
+        if self._full[k] is not None:
+            self._full[k].paste(row,(0,v*self.tilesize))
+        if k+1 < len(self._sizes):
+            self._push(k+1,row.reduce(2))
+
+    def _collect(self,future):
+        for rel,digest,written in future.result():
+            self._new[rel] = digest
+            if written:
+                self._changed.append(rel)
+
+    def _push(self,k,band):
+        if self._pending[k] is not None:
+            band = _vstack(self._pending[k],band)
+        while band.size[1] >= self.tilesize:
+            self._emit(k,band.crop((0,0,band.size[0],self.tilesize)))
+            band = band.crop((0,self.tilesize,band.size[0],band.size[1]))
+        self._pending[k] = band if band.size[1] > 0 else None
+
+    def run(self,inname,params=None,pname='pano'):
+        # write the tiles, preview, mobile and thumb images, return the level sizes
+        with Image.open(inname) as image:
+            size = image.size
+        self._old = read_manifest(self.manifest)['tiles']
+        self._new = {}
+        self._changed = []
+        self._sizes = levels(size,self.tilesize)
+        self._rows = [0]*len(self._sizes)
+        self._pending = [None]*len(self._sizes)
+        self._full = [None]*len(self._sizes)
+        self._futures = collections.deque()
+        logging.debug('tiling {} into {} levels'.format(inname,len(self._sizes)))
+        with ProcessPoolExecutor(max_workers=self._num_processes) as self._pool:
+            for y0,band in self._bands(inname):
+                if band.mode not in ('RGB','L'):
+                    band = band.convert('RGB')
+                if y0 == 0:
+                    self._full = [Image.new(band.mode,s) if s[0]*s[1] <= KEEP else None
+                                  for s in self._sizes]
+                self._push(0,band)
+            for k in range(len(self._sizes)):
+                if self._pending[k] is not None:
+                    band = self._pending[k]
+                    self._pending[k] = None
+                    self._emit(k,band)
+            while self._futures:
+                self._collect(self._futures.popleft())
+        self._pool = None
+
+        self.tiles.mkdir(parents=True,exist_ok=True)
+        for rel,image in (('preview.jpg',self._scaled(PREVIEW)),
+                          (mobile_name(pname),self._scaled(MOBILE)),
+                          ('thumb.jpg',ImageOps.fit(self._scaled(2*THUMB),(THUMB,THUMB)))):
+            digest,written = save_if_changed(image,self.tiles,rel,self._old,self._quality)
+            self._new[rel] = digest
+            if written:
+                self._changed.append(rel)
+        self._full = None
+        removed = prune(self.tiles,self._new)
+        write_manifest(self.manifest,{'params':params,'tiles':self._new})
+        logging.info('wrote {} of {} files, removed {} stale files in {}'.format(
+            len(self._changed),len(self._new),len(removed),self.tiles))
+        return self._sizes
+
+    def _scaled(self,long_side):
+        # the smallest kept level at least long_side pixels wide scaled to long_side
+        kept = [i for i in self._full if i is not None]
+        image = kept[0]
+        for i in kept:
+            if max(i.size) >= long_side:
+                image = i
+        s = min(long_side/max(image.size),1)
+        return image.resize((max(int(image.size[0]*s),1),max(int(image.size[1]*s),1)),reducing_gap=3.0)
+
+    def xml(self,pano,sizes,outxml):
+        # write the krpano multires xml, tile urls are relative to outxml
+        panotype = pano['panotype']
+        if panotype not in GEOMETRY:
+            raise ValueError('cannot tile panorama type {}'.format(panotype))
+        prefix = os.path.relpath(self.tiles,Path(outxml).parent)
+        hfov = float(pano['hfov'])
+        if pano.get('vfov','') != '':
+            vf = float(pano['vfov'])
+        else:
+            vf = vfov(panotype,hfov,sizes[0])
+        voffset = float(pano.get('voffset') or 0)
+
+        root = xml.etree.ElementTree.Element('krpano',version='1.20',title=pano.get('title',''))
+        xml.etree.ElementTree.SubElement(root,'view',hlookat='0',vlookat='{:g}'.format(voffset),
+                                         fovtype='HFOV',fov='{:g}'.format(min(hfov,90)),
+                                         maxpixelzoom='2.0',limitview='auto')
+        xml.etree.ElementTree.SubElement(root,'preview',url=prefix+'/preview.jpg')
+        attrs = {'type':panotype.upper(),'hfov':'{:g}'.format(hfov),'vfov':'{:g}'.format(vf),
+                 'voffset':'{:g}'.format(voffset)}
+        image = xml.etree.ElementTree.SubElement(root,'image',devices='!mobile',multires='true',
+                                                 tilesize=str(self.tilesize),**attrs)
+        for k,(w,h) in enumerate(sizes):
+            level = xml.etree.ElementTree.SubElement(image,'level',tiledimagewidth=str(w),
+                                                     tiledimageheight=str(h))
+            xml.etree.ElementTree.SubElement(level,GEOMETRY[panotype],url=prefix+'/'+self.url(sizes,k))
+        mobile = xml.etree.ElementTree.SubElement(root,'image',devices='mobile',**attrs)
+        xml.etree.ElementTree.SubElement(mobile,GEOMETRY[panotype],url=prefix+'/'+mobile_name(pano['pname']))
+        xml.etree.ElementTree.indent(root)
+        xml.etree.ElementTree.ElementTree(root).write(outxml,encoding='UTF-8',xml_declaration=True)
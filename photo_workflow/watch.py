@@ -0,0 +1,345 @@
+__all__ = ['Inotify','Poller','watcher','Changes']
+
+from pathlib import Path
+import argparse, sys, os
+import time
+import queue
+import select
+import struct
+import logging
+import threading
+import itertools
+
+from .config import read_config
+from . import execute
+
+# inotify event masks from <sys/inotify.h>
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+EVENT = struct.Struct('iIII')
+WATCH_MASK = IN_CLOSE_WRITE|IN_MOVED_TO|IN_CREATE|IN_ATTRIB
+
+class Inotify(threading.Thread):
+    # report the files written or moved into the watched directories, the
+    # thread sleeps in poll until the kernel has events so that an idle
+    # watcher costs no CPU, None is reported when events were lost
+    def __init__(self,roots,changes):
+        super().__init__(daemon=True)
+        import ctypes, ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC|IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(),os.strerror(ctypes.get_errno()))
+        self._roots = dict((Path(r),recursive) for r,recursive in roots)
+        self._changes = changes
+        self._watches = {}
+        for r,recursive in self._roots.items():
+            if r.is_dir():
+                self.add(r,recursive)
+
+    def _add_watch(self,path):
+        wd = self._libc.inotify_add_watch(self._fd,os.fsencode(path),WATCH_MASK)
+        if wd < 0:
+            import ctypes
+            logging.warning('cannot watch {}: {}'.format(path,os.strerror(ctypes.get_errno())))
+            return
+        self._watches[wd] = path
+
+    def add(self,path,recursive):
+        self._add_watch(path)
+        if recursive:
+            for root,dirs,files in os.walk(path):
+                for d in dirs:
+                    self._add_watch(Path(root,d))
+
+    def recursive(self,path):
+        # whether directory path is watched recursively, None if not at all
+        if path in self._roots:
+            return self._roots[path]
+        for r,recursive in self._roots.items():
+            if recursive and r in path.parents:
+                return True
+        return None
+
+    def run(self):
+        poll = select.poll()
+        poll.register(self._fd,select.POLLIN)
+        while True:
+            poll.poll()
+            try:
+                buf = os.read(self._fd,64*1024)
+            except BlockingIOError:
+                continue
+            pos = 0
+            while pos < len(buf):
+                wd,mask,cookie,length = EVENT.unpack_from(buf,pos)
+                name = buf[pos+EVENT.size:pos+EVENT.size+length].rstrip(b'\0')
+                pos += EVENT.size+length
+                if mask & IN_Q_OVERFLOW:
+                    logging.warning('inotify queue overflow, rescanning everything')
+                    self._changes.put(None)
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd,None)
+                    continue
+                if wd not in self._watches:
+                    continue
+                path = self._watches[wd]/os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    recursive = self.recursive(path)
+                    if mask & (IN_CREATE|IN_MOVED_TO) and recursive is not None:
+                        self.add(path,recursive)
+                        # files may have landed before the watch was added
+                        for f in (path.glob('**/*') if recursive else path.iterdir()):
+                            self._changes.put(f)
+                    continue
+                if mask & IN_CREATE:
+                    # wait for the file to be closed
+                    continue
+                self._changes.put(path)
+
+class Poller(threading.Thread):
+    # compare the size and modification time of all files every interval
+    # seconds, the fallback where inotify is not available
+    def __init__(self,roots,changes,interval=10):
+        super().__init__(daemon=True)
+        self._roots = [(Path(r),recursive) for r,recursive in roots]
+        self._changes = changes
+        self._interval = interval
+        self._state = self.scan()
+
+    def scan(self):
+        state = {}
+        for r,recursive in self._roots:
+            for root,dirs,files in os.walk(r):
+                for name in files:
+                    try:
+                        st = os.stat(os.path.join(root,name))
+                    except FileNotFoundError:
+                        continue
+                    state[Path(root,name)] = (st.st_mtime_ns,st.st_size)
+                if not recursive:
+                    break
+        return state
+
+    def run(self):
+        while True:
+            time.sleep(self._interval)
+            state = self.scan()
+            for f,s in state.items():
+                if self._state.get(f) != s:
+                    self._changes.put(f)
+            self._state = state
+
+def watcher(roots,changes,poll=False,interval=10):
+    # inotify where possible, otherwise poll
+    if not poll:
+        try:
+            return Inotify(roots,changes)
+        except (OSError,AttributeError) as e:
+            logging.warning('inotify not available, polling every {}s: {}'.format(interval,e))
+    return Poller(roots,changes,interval=interval)
+
+class Changes:
+    # the work arising from a set of changed paths, None stands for everything
+    def __init__(self,assets,tempdir):
+        from .archive import RAW
+        self._raw = RAW
+        self.assets = assets
+        self.tempdir = tempdir
+        self.everything = False
+        self.raw_dirs = set()
+        self.tiffs = set()
+        self.projects = set()
+        # number of passes that failed on these changes
+        self.attempts = 0
+
+    def __bool__(self):
+        return self.everything or bool(self.raw_dirs or self.tiffs or self.projects)
+
+    def add(self,path):
+        if path is None:
+            self.everything = True
+            return
+        if self.assets in path.parents:
+            name = path.name[:-4] if path.name.endswith('.xmp') else path.name
+            if os.path.splitext(name)[1] in self._raw:
+                self.raw_dirs.add(path.parent)
+        elif path.parent == self.tempdir:
+            if path.suffix == '.tif':
+                self.tiffs.add(path)
+        elif self.tempdir in path.parents:
+            parts = path.relative_to(self.tempdir).parts
+            if parts[0] in ('panoramas','stack') and len(parts) > 2:
+                self.projects.add(self.tempdir/parts[0]/parts[1])
+
+def collect(changes,work,delay=2.,longest=60.,retry=60.):
+    # wait for the first change, then until no change arrived for delay
+    # seconds or longest seconds have passed, work left over from a failed
+    # pass is retried after at most retry seconds
+    if work:
+        try:
+            work.add(changes.get(timeout=retry))
+        except queue.Empty:
+            return work
+    else:
+        work.add(changes.get())
+    start = time.monotonic()
+    while time.monotonic()-start < longest:
+        try:
+            work.add(changes.get(timeout=delay))
+        except queue.Empty:
+            break
+    return work
+
+class Pipeline:
+    # the archive, create-project and backup-project stages run on the
+    # changed paths only
+    def __init__(self,cfg,num_process=None,backend='native',num_threads=4):
+        from .index import TaskIndex
+        dirs = cfg['directories']
+        self.assets = Path(dirs['assets'])
+        self.tempdir = Path(dirs['tempdir'])
+        self.project = Path(dirs['project'])
+        self.backedup = Path(dirs['backedup'])
+        self.archive = self.project/'archive'
+        self.index = TaskIndex(self.archive.with_suffix('.sqlite'))
+        self.darktable = cfg.get('darktable',{}).get('cli')
+        self.num_process = num_process
+        self.backend = backend
+        self.num_threads = num_threads
+
+    def roots(self):
+        return [(self.assets,True),(self.tempdir,False),
+                (self.tempdir/'panoramas',True),(self.tempdir/'stack',True)]
+
+    def render(self,work):
+        from .archive import generate_tasks, render_tasks, DARKTABLE
+        if work.everything:
+            generated = generate_tasks(self.assets,self.archive,Path('**'),index=self.index)
+        else:
+            # the directory times do not change with modified files, rescan
+            # the directories that had events
+            generated = itertools.chain.from_iterable(
+                generate_tasks(self.assets,self.archive,d.relative_to(self.assets),index=self.index,rescan=True)
+                for d in sorted(work.raw_dirs))
+        processed,failed = render_tasks(generated,num_process=self.num_process,
+                                        darktable=self.darktable or DARKTABLE)
+        for t in failed:
+            logging.error('failed to process {}'.format(t[0]))
+
+    def create(self,work):
+        from .create import create_folder
+        images = None if work.everything else [t for t in work.tiffs if t.exists()]
+        errors = create_folder(self.tempdir,self.tempdir,backend=self.backend,
+                               num_threads=self.num_threads,images=images)
+        if errors:
+            logging.error('failed to move {} images'.format(len(errors)))
+
+    def backup(self,work):
+        from .backup import CopyPool, backup_projects
+        pool = CopyPool(num_threads=self.num_threads)
+        projects = None if work.everything else sorted(work.projects)
+        backup_projects(self.tempdir,self.project,self.backedup,pool,projects=projects)
+        pool.wait()
+        if pool.errors:
+            logging.error('failed to copy {} files'.format(len(pool.errors)))
+
+    def __call__(self,work):
+        # run the stages, return the changes of the stages that failed
+        failed = Changes(work.assets,work.tempdir)
+        failed.attempts = work.attempts+1
+        if work.everything or work.raw_dirs:
+            logging.info('rendering {}'.format('everything' if work.everything else
+                                               ', '.join(str(d) for d in sorted(work.raw_dirs))))
+            try:
+                self.render(work)
+            except Exception:
+                logging.exception('rendering failed')
+                failed.everything |= work.everything
+                failed.raw_dirs |= work.raw_dirs
+        if work.everything or work.tiffs:
+            logging.info('sorting {} images into projects'.format('all' if work.everything else len(work.tiffs)))
+            try:
+                self.create(work)
+            except Exception:
+                logging.exception('sorting images into projects failed')
+                failed.everything |= work.everything
+                failed.tiffs |= work.tiffs
+        if work.everything or work.projects:
+            logging.info('backing up {}'.format('all projects' if work.everything else
+                                                ', '.join(str(d) for d in sorted(work.projects))))
+            try:
+                self.backup(work)
+            except Exception:
+                logging.exception('backing up projects failed')
+                failed.everything |= work.everything
+                failed.projects |= work.projects
+        return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='render, sort and back up new images as they arrive')
+    parser.add_argument('-c','--config',help='read configuration from file')
+    parser.add_argument('-n','--num-process',type=int,
+                        help='the number of darktable processes, default: based on number of cores and free memory')
+    parser.add_argument('-b','--backend',choices=['native','exiftool'],default='native',
+                        help='read the tags from the TIFF headers (native) or with exiftool, default native')
+    parser.add_argument('--delay',type=float,
+                        help='seconds without changes before the stages run, default 2')
+    parser.add_argument('--poll',action='store_true',default=False,
+                        help='poll the directories instead of using inotify')
+    parser.add_argument('-i','--interval',type=float,
+                        help='seconds between polls, default 10')
+    parser.add_argument('--no-initial',action='store_true',default=False,
+                        help='do not process everything at startup')
+    parser.add_argument('--retries',type=int,default=3,
+                        help='number of times the changes of a failed pass are retried, default 3')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    cfg = read_config(args.config)
+    execute.configure_from(cfg)
+    sec = cfg.get('watch',{})
+    delay = args.delay if args.delay is not None else float(sec.get('delay') or 2)
+    interval = args.interval if args.interval is not None else float(sec.get('interval') or 10)
+
+    pipeline = Pipeline(cfg,num_process=args.num_process,backend=args.backend)
+    for d in (pipeline.assets,pipeline.tempdir):
+        if not d.is_dir():
+            parser.error('no such directory {}'.format(d))
+
+    changes = queue.Queue()
+    w = watcher(pipeline.roots(),changes,poll=args.poll,interval=interval)
+    w.start()
+    if not args.no_initial:
+        # catch up with the changes made while the watcher was not running
+        changes.put(None)
+    logging.info('watching {} and {}'.format(pipeline.assets,pipeline.tempdir))
+    work = Changes(pipeline.assets,pipeline.tempdir)
+    try:
+        while True:
+            work = collect(changes,work,delay=delay)
+            if work:
+                try:
+                    work = pipeline(work)
+                except Exception:
+                    # a bad pass must not end the daemon
+                    logging.exception('pass failed')
+                    work.attempts += 1
+            if work and work.attempts > args.retries:
+                logging.error('giving up on changes that failed {} times'.format(work.attempts))
+                work = Changes(pipeline.assets,pipeline.tempdir)
+            elif not work:
+                work = Changes(pipeline.assets,pipeline.tempdir)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+__all__ = ['WorkQueue','Heartbeat','node_name']
+
+import os
+import time
+import socket
+import sqlite3
+import logging
+import threading
+import contextlib
+from pathlib import Path
+
+# archive tasks shared by the nodes rendering them, the database lives on
+# the shared filesystem and relies on its file locking, leases are compared
+# against the wall clock so the clocks of the nodes must be synchronised
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+  output TEXT PRIMARY KEY,
+  input TEXT NOT NULL,
+  xmp TEXT,
+  cost REAL,
+  state TEXT NOT NULL DEFAULT 'pending',
+  node TEXT,
+  lease REAL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  finished REAL,
+  error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, cost);
+CREATE TABLE IF NOT EXISTS nodes (
+  node TEXT PRIMARY KEY,
+  heartbeat REAL,
+  processed INTEGER NOT NULL DEFAULT 0,
+  failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+  name TEXT PRIMARY KEY,
+  node TEXT,
+  lease REAL
+);
+"""
+
+STATES = ('pending','claimed','done','failed')
+
+def node_name():
+    return '{}:{}'.format(socket.gethostname(),os.getpid())
+
+def _path(p):
+    if p is None:
+        return None
+    return str(p)
+
+def _task(row):
+    return (Path(row['input']),None if row['xmp'] is None else Path(row['xmp']),Path(row['output']))
+
+class WorkQueue:
+    # claims are made in BEGIN IMMEDIATE transactions so that two nodes
+    # never get the same task, a task whose lease ran out because its node
+    # stopped renewing it is handed out again
+    def __init__(self,dbname,node=None,lease=120,retries=2):
+        self._dbname = Path(dbname)
+        if not self._dbname.parent.exists():
+            self._dbname.parent.mkdir(parents=True)
+        self._db = sqlite3.connect(str(self._dbname),timeout=60,isolation_level=None,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._transaction():
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    self._db.execute(statement)
+        self.node = node if node is not None else node_name()
+        self.lease = lease
+        self.retries = retries
+
+    @property
+    def dbname(self):
+        return self._dbname
+
+    def close(self):
+        self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # take the write lock up front, a deferred transaction upgrading its
+        # lock can deadlock against another node
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def _query(self,query,args=()):
+        with self._lock:
+            return self._db.execute(query,args).fetchall()
+
+    def add(self,tasks,since=None):
+        # queue (cost,task) pairs, tasks that are finished are queued again
+        # unless they finished after since, when the scan started
+        if since is None:
+            since = time.time()
+        with self._transaction() as db:
+            db.executemany("""INSERT INTO tasks (output,input,xmp,cost) VALUES (?,?,?,?)
+                              ON CONFLICT (output) DO UPDATE SET
+                                state='pending',input=excluded.input,xmp=excluded.xmp,cost=excluded.cost,
+                                node=NULL,lease=NULL,attempts=0,error=NULL
+                              WHERE state IN ('done','failed') AND finished < ?""",
+                           [(str(t[2]),str(t[0]),_path(t[1]),c,since) for c,t in tasks])
+
+    def claim(self,n=1):
+        # the n most expensive pending tasks or those of dead nodes, a task
+        # whose nodes keep dying fails once it has used up its retries
+        now = time.time()
+        with self._transaction() as db:
+            for r in db.execute("""SELECT output,node FROM tasks
+                                   WHERE state='claimed' AND lease < ? AND attempts > ?""",
+                                (now,self.retries)).fetchall():
+                logging.error('giving up on {}, the lease of {} expired'.format(r['output'],r['node']))
+            db.execute("""UPDATE tasks SET state='failed',finished=?,lease=NULL,
+                          error='lease of '||node||' expired'
+                          WHERE state='claimed' AND lease < ? AND attempts > ?""",(now,now,self.retries))
+            rows = db.execute("""SELECT output,input,xmp,cost,state,node FROM tasks
+                                 WHERE state='pending' OR (state='claimed' AND lease < ?)
+                                 ORDER BY cost DESC LIMIT ?""",(now,n)).fetchall()
+            for r in rows:
+                if r['state'] == 'claimed':
+                    logging.warning('reclaiming {} from {}'.format(r['output'],r['node']))
+            db.executemany("""UPDATE tasks SET state='claimed',node=?,lease=?,attempts=attempts+1
+                              WHERE output=?""",[(self.node,now+self.lease,r['output']) for r in rows])
+        return [(r['cost'],_task(r)) for r in rows]
+
+    def renew(self):
+        # extend the leases of all tasks claimed by this node
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET lease=? WHERE node=? AND state='claimed'",(now+self.lease,self.node))
+            db.execute('UPDATE leases SET lease=? WHERE node=?',(now+self.lease,self.node))
+            db.execute('INSERT INTO nodes (node,heartbeat) VALUES (?,?) '
+                       'ON CONFLICT (node) DO UPDATE SET heartbeat=excluded.heartbeat',(self.node,now))
+
+    def done(self,task):
+        with self._transaction() as db:
+            # a node that lost its lease must not finish the task again
+            cur = db.execute("""UPDATE tasks SET state='done',finished=?,lease=NULL,error=NULL
+                                WHERE output=? AND node=? AND state='claimed'""",
+                             (time.time(),str(task[2]),self.node))
+            if cur.rowcount:
+                db.execute('UPDATE nodes SET processed=processed+1 WHERE node=?',(self.node,))
+
+    def fail(self,task,error=None):
+        # hand the task to the next node unless it has used up its retries
+        with self._transaction() as db:
+            cur = db.execute("""UPDATE tasks SET state=CASE WHEN attempts > ? THEN 'failed' ELSE 'pending' END,
+                                finished=?,lease=NULL,error=? WHERE output=? AND node=? AND state='claimed'""",
+                             (self.retries,time.time(),error,str(task[2]),self.node))
+            if cur.rowcount:
+                db.execute('UPDATE nodes SET failed=failed+1 WHERE node=?',(self.node,))
+
+    def unclaim(self):
+        # return the tasks claimed but not started by this node to the queue
+        with self._transaction() as db:
+            db.execute("""UPDATE tasks SET state='pending',node=NULL,lease=NULL,attempts=attempts-1
+                          WHERE node=? AND state='claimed'""",(self.node,))
+
+    def record(self,event,task,**extra):
+        # the journal interface of the archive workers
+        if event == 'finished':
+            self.done(task)
+        elif event == 'failed':
+            self.fail(task,extra.get('error'))
+
+    def acquire(self,name):
+        # a named lease held by at most one live node, e.g. for scanning
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute('SELECT node,lease FROM leases WHERE name=?',(name,)).fetchone()
+            if row is not None and row['node'] != self.node and row['lease'] >= now:
+                return False
+            db.execute('INSERT OR REPLACE INTO leases (name,node,lease) VALUES (?,?,?)',
+                       (name,self.node,now+self.lease))
+        return True
+
+    def release(self,name):
+        with self._transaction() as db:
+            db.execute('DELETE FROM leases WHERE name=? AND node=?',(name,self.node))
+
+    def held(self,name):
+        # whether a live node holds the lease
+        rows = self._query('SELECT lease FROM leases WHERE name=?',(name,))
+        return bool(rows) and rows[0]['lease'] >= time.time()
+
+    def active(self):
+        # the number of tasks that are pending or being rendered
+        return self._query("SELECT COUNT(*) FROM tasks WHERE state IN ('pending','claimed')")[0][0]
+
+    def counts(self):
+        counts = dict((s,0) for s in STATES)
+        for r in self._query('SELECT state,COUNT(*) AS n FROM tasks GROUP BY state'):
+            counts[r['state']] = r['n']
+        return counts
+
+    def nodes(self):
+        return [dict(r) for r in self._query('SELECT node,heartbeat,processed,failed FROM nodes ORDER BY node')]
+
+    def failed(self):
+        return [(_task(r),r['error']) for r in self._query(
+            "SELECT input,xmp,output,error FROM tasks WHERE state='failed' ORDER BY output")]
+
+class Heartbeat(threading.Thread):
+    # renew the leases of a node every interval seconds until stopped
+    def __init__(self,queue,interval=None):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.interval = interval if interval is not None else queue.lease/4
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.renew()
+            except sqlite3.Error as e:
+                logging.warning('cannot renew leases: {}'.format(e))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
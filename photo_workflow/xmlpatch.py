@@ -0,0 +1,39 @@
+__all__ = ['PatchFilter','patch_xml']
+
+import io
+import xml.sax
+import xml.sax.saxutils
+import xml.sax.xmlreader
+
+class PatchFilter(xml.sax.saxutils.XMLFilterBase):
+    # stream the krpano xml updating the attributes of the view element and
+    # appending elements to the root element
+    def __init__(self,parent,view,append):
+        super().__init__(parent)
+        self._view = view
+        self._append = append
+        self._depth = 0
+
+    def startElement(self,name,attrs):
+        self._depth += 1
+        if name == 'view' and self._depth == 2 and self._view:
+            a = dict(attrs)
+            a.update(self._view)
+            attrs = xml.sax.xmlreader.AttributesImpl(a)
+        super().startElement(name,attrs)
+
+    def endElement(self,name):
+        if self._depth == 1:
+            for tag,a in self._append:
+                super().startElement(tag,xml.sax.xmlreader.AttributesImpl(a))
+                super().endElement(tag)
+        self._depth -= 1
+        super().endElement(name)
+
+def patch_xml(fname,view={},append=[]):
+    # return the patched document without building a tree
+    out = io.BytesIO()
+    patch = PatchFilter(xml.sax.make_parser(),view,append)
+    patch.setContentHandler(xml.sax.saxutils.XMLGenerator(out,encoding='utf-8',short_empty_elements=True))
+    patch.parse(str(fname))
+    return out.getvalue()
@@ -4,7 +4,7 @@ from setuptools import setup
 
 setup(name='photo-workflow',
       python_requires='>=3',
-      install_requires = ['easywebdav','jinja2'],
+      install_requires = ['easywebdav','requests','jinja2','numpy'],
       version='0.3',
       description='marsupium photo workflow helpers',
       author='Magnus Hagdorn',
@@ -15,12 +15,18 @@ setup(name='photo-workflow',
       include_package_data = True,
       entry_points={
           'console_scripts': [
+              'photo = photo_workflow.cli:main',
               'photo-create-project = photo_workflow.create:main',
               'photo-backup-project = photo_workflow.backup:main',
               'photo-download-gpx = photo_workflow.getgpx:main',
+              'photo-gpx-index = photo_workflow.gpx:main',
+              'photo-geotag = photo_workflow.geotag:main',
               'photo-archive = photo_workflow.archive:main',
               'photo-krpano = photo_workflow.krpano:main',
               'photo-scale = photo_workflow.scale:main',
+              'photo-watch = photo_workflow.watch:main',
+              'photo-stack-preview = photo_workflow.stackpreview:main',
+              'photo-benchmark = photo_workflow.benchmark:main',
               ],
       },
 
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import signal
+import threading
+import subprocess
+from pathlib import Path
+
+from photo_workflow import corpus
+from photo_workflow.archive import generate_tasks, render_tasks, _tmp_prefix
+from photo_workflow.index import TaskIndex
+
+def run_with_timeout(func,timeout=60):
+    result = []
+    t = threading.Thread(target=lambda: result.append(func()),daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), 'render_tasks hangs'
+    return result[0]
+
+def test_render_failure_does_not_hang(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin')
+    indir = tmp_path/'assets'
+    outdir = tmp_path/'archive'
+    corpus.asset_tree(indir,days=1,per_day=3,raw_size=1024)
+    tasks = list(generate_tasks(indir,outdir,Path('*','*')))
+    # an output that is a directory cannot be replaced by the rendered file
+    tasks[0][2].mkdir(parents=True)
+    processed,failed = run_with_timeout(lambda: render_tasks(iter(tasks),num_process=2,retries=0,
+                                                             darktable=stubs['darktable-cli']))
+    assert [t[0] for t in failed] == [tasks[0][0]]
+    assert all(t[2].is_file() for t in tasks[1:])
+
+def test_processed_counts_successes_only(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin')
+    indir = tmp_path/'assets'
+    outdir = tmp_path/'archive'
+    corpus.asset_tree(indir,days=1,per_day=4,raw_size=1024)
+    tasks = list(generate_tasks(indir,outdir,Path('*','*')))
+    tasks[1][2].mkdir(parents=True)
+    processed,failed = run_with_timeout(lambda: render_tasks(iter(tasks),num_process=1,retries=0,
+                                                             darktable=stubs['darktable-cli']))
+    assert processed == 3
+    assert len(failed) == 1
+
+def test_index_notices_sidecar_edited_in_place(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin')
+    indir = tmp_path/'assets'
+    outdir = tmp_path/'archive'
+    files = corpus.asset_tree(indir,days=1,per_day=3,raw_size=1024,xmp_fraction=1)
+    index = TaskIndex(tmp_path/'index.sqlite')
+    tasks = list(generate_tasks(indir,outdir,Path('*','*'),index=index))
+    assert len(tasks) == 3
+    processed,failed = render_tasks(iter(tasks),num_process=1,darktable=stubs['darktable-cli'])
+    assert list(generate_tasks(indir,outdir,Path('*','*'),index=index)) == []
+    # rewrite a sidecar the way darktable does, the directory is unchanged
+    dmtime = os.stat(files[1].parent).st_mtime_ns
+    xmp = Path(str(files[1])+'.xmp')
+    xmp.write_text(xmp.read_text()+' ')
+    later = tasks[1][2].stat().st_mtime_ns+10**9
+    os.utime(xmp,ns=(later,later))
+    assert os.stat(files[1].parent).st_mtime_ns == dmtime
+    assert [t[0] for t in generate_tasks(indir,outdir,Path('*','*'),index=index)] == [files[1]]
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def record(self,event,task,**extra):
+        self.events.append((event,task))
+
+def test_expensive_image_in_last_directory_goes_first(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin',latency=0.1)
+    indir = tmp_path/'assets'
+    outdir = tmp_path/'archive'
+    files = corpus.asset_tree(indir,days=4,per_day=4,raw_size=1024,xmp_fraction=0)
+    # an image many times larger than the others in the last directory
+    files[-1].write_bytes(os.urandom(64*1024))
+    tasks = list(generate_tasks(indir,outdir,Path('*','*')))
+    tasks.sort(key=lambda t: t[2])
+    journal = Recorder()
+    processed,failed = run_with_timeout(lambda: render_tasks(iter(tasks),num_process=1,queue_size=1,
+                                                             journal=journal,darktable=stubs['darktable-cli']))
+    assert processed == 16
+    started = [t[0] for e,t in journal.events if e == 'started']
+    # at most the jobs handed out before the scan reached it run earlier
+    assert started.index(files[-1]) <= 2
+
+def test_stale_render_directories_are_removed(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin')
+    indir = tmp_path/'assets'
+    outdir = tmp_path/'archive'
+    corpus.asset_tree(indir,days=1,per_day=2,raw_size=1024)
+    tasks = list(generate_tasks(indir,outdir,Path('*','*')))
+    od = tasks[0][2].parent
+    od.mkdir(parents=True)
+    # a run killed while rendering leaves its temporary directory behind
+    code = ('import sys,tempfile,time,os\n'
+            'from photo_workflow.archive import _tmp_prefix\n'
+            'd = tempfile.mkdtemp(dir=sys.argv[1],prefix=_tmp_prefix())\n'
+            'open(os.path.join(d,"IMG.jpg"),"w").write("truncated")\n'
+            'print(d,flush=True)\n'
+            'time.sleep(60)\n')
+    proc = subprocess.Popen([sys.executable,'-c',code,str(od)],stdout=subprocess.PIPE,text=True)
+    stale = Path(proc.stdout.readline().strip())
+    proc.send_signal(signal.SIGKILL)
+    proc.wait()
+    proc.stdout.close()
+    # one of a run still in progress stays
+    live = od/(_tmp_prefix()+'live')
+    live.mkdir()
+    assert stale.is_dir()
+    processed,failed = run_with_timeout(lambda: render_tasks(iter(tasks),num_process=1,
+                                                             darktable=stubs['darktable-cli']))
+    assert processed == 2
+    assert not stale.exists()
+    assert live.is_dir()
+
+BATCH_STUB = """
+import sys, os, json
+args = sys.argv[1:]
+log = os.path.join(os.path.dirname(sys.argv[0]),'calls.jsonl')
+with open(log,'a') as f:
+    f.write(json.dumps(args)+'\\n')
+args = args[:args.index('--core')]
+files = []
+i = 0
+while i < len(args):
+    if args[i] in ('--width','--height','--out-ext'):
+        i += 2
+        continue
+    files.append(args[i])
+    i += 1
+fail = open(os.path.join(os.path.dirname(sys.argv[0]),'fail')).read().split()
+out = files[-1]
+status = 0
+for f in files[:-1]:
+    if f.endswith('.xmp'):
+        continue
+    if f in fail:
+        status = 1
+        continue
+    o = os.path.join(out,os.path.splitext(os.path.basename(f))[0]+'.jpg') if os.path.isdir(out) else out
+    with open(o,'wb') as jpg:
+        jpg.write(b'jpg')
+sys.exit(status)
+"""
+
+def test_batch_render(tmp_path):
+    bindir = tmp_path/'bin'
+    bindir.mkdir()
+    stub = bindir/'darktable-cli'
+    stub.write_text('#!{}\n'.format(sys.executable)+BATCH_STUB)
+    stub.chmod(0o755)
+    indir = tmp_path/'assets'
+    outdir = tmp_path/'archive'
+    corpus.asset_tree(indir,days=2,per_day=4,raw_size=1024,xmp_fraction=0.5)
+    tasks = sorted(generate_tasks(indir,outdir,Path('*','*')),key=lambda t: t[2])
+    # two images of the second day share a style sidecar
+    style = tasks[4][0].parent/'style.xmp'
+    style.write_text(corpus.XMP)
+    tasks[6] = (tasks[6][0],style,tasks[6][2])
+    tasks[7] = (tasks[7][0],style,tasks[7][2])
+    (bindir/'fail').write_text(str(tasks[1][0]))
+    processed,failed = run_with_timeout(lambda: render_tasks(iter(tasks),num_process=2,batch=3,retries=0,
+                                                             darktable=stub))
+    calls = [json.loads(l) for l in open(bindir/'calls.jsonl')]
+    groups = []
+    for c in calls:
+        args = c[:c.index('--core')]
+        inputs = [a for a in args if a.endswith('.ORF')]
+        # darktable-cli picks up the default sidecars itself
+        xmp = [a for a in args if a.endswith('.xmp') and a[:-4] not in inputs]
+        groups.append((sorted(inputs),xmp))
+        if len(inputs) > 1:
+            assert args[-2:] == ['--out-ext','jpg']
+        # one output directory per call
+        assert len(set(Path(i).parent for i in inputs)) == 1
+    expected = [(sorted(str(t[0]) for t in tasks[0:3]),[]),([str(tasks[3][0])],[]),
+                (sorted(str(t[0]) for t in tasks[4:6]),[]),(sorted(str(t[0]) for t in tasks[6:8]),[str(style)])]
+    assert sorted(groups) == sorted(expected)
+    # the failure of one image does not fail the rest of its batch
+    assert [t[0] for t in failed] == [tasks[1][0]]
+    assert processed == 7
+    for i,t in enumerate(tasks):
+        assert t[2].is_file() == (i != 1)
+    assert not list(outdir.glob('*/*/.archive-*'))
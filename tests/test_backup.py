@@ -0,0 +1,88 @@
+import os
+import errno
+
+import pytest
+
+from photo_workflow import backup
+from photo_workflow.backup import copy_data, copy_file, backup_projects, CopyPool
+
+DATA = os.urandom(3*1024*1024+17)
+
+def fail(*args):
+    raise OSError(errno.EXDEV,'not supported')
+
+def copy(tmp_path):
+    src = tmp_path/'src'
+    src.write_bytes(DATA)
+    dst = tmp_path/'dst'
+    with open(src,'rb') as fin, open(dst,'wb') as fout:
+        copy_data(fin.fileno(),fout.fileno(),len(DATA))
+    return dst.read_bytes()
+
+def test_copy_data(tmp_path):
+    assert copy(tmp_path) == DATA
+
+def test_copy_data_without_copy_file_range(tmp_path,monkeypatch):
+    monkeypatch.setattr(os,'copy_file_range',fail)
+    assert copy(tmp_path) == DATA
+
+def test_copy_data_without_kernel_copies(tmp_path,monkeypatch):
+    monkeypatch.setattr(os,'copy_file_range',fail)
+    monkeypatch.setattr(os,'sendfile',fail)
+    assert copy(tmp_path) == DATA
+
+def test_copy_data_fails_part_way(tmp_path,monkeypatch):
+    # the kernel copy stops after the first chunk, the rest is copied by
+    # the next method from where it stopped
+    monkeypatch.setattr(backup,'CHUNK',1024*1024)
+    copy_file_range = os.copy_file_range
+    calls = []
+    def first_only(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            fail()
+        return copy_file_range(*args)
+    monkeypatch.setattr(os,'copy_file_range',first_only)
+    monkeypatch.setattr(os,'sendfile',fail)
+    assert copy(tmp_path) == DATA
+    assert len(calls) == 2
+
+def test_copy_file_replaces_atomically(tmp_path):
+    src = tmp_path/'a.jpg'
+    src.write_bytes(DATA)
+    os.utime(src,(1e9,1e9))
+    dst = tmp_path/'out'/'a.jpg'
+    copy_file(src,dst,verify=True)
+    assert dst.read_bytes() == DATA
+    assert dst.stat().st_mtime == 1e9
+    assert os.listdir(dst.parent) == ['a.jpg']
+
+def test_failed_copy_keeps_old_file(tmp_path,monkeypatch):
+    src = tmp_path/'a.jpg'
+    src.write_bytes(DATA)
+    dst = tmp_path/'out'/'a.jpg'
+    dst.parent.mkdir()
+    dst.write_bytes(b'old')
+    # the copy is corrupted on the way
+    monkeypatch.setattr(backup,'checksum',lambda f: f.name)
+    with pytest.raises(RuntimeError):
+        copy_file(src,dst,verify=True)
+    assert dst.read_bytes() == b'old'
+    assert os.listdir(dst.parent) == ['a.jpg']
+
+def test_backup_projects(tmp_path):
+    indir = tmp_path/'temp'
+    project = indir/'panoramas'/'p20260101'
+    project.mkdir(parents=True)
+    (project/'pano.tif').write_bytes(b'tif')
+    (project/'pano.jpg').write_bytes(b'jpg')
+    # a copy in progress is not copied
+    (project/'.pano.jpg.part').write_bytes(b'part')
+    outdir = tmp_path/'project'
+    backupdir = tmp_path/'backup'
+    pool = CopyPool(num_threads=2)
+    backup_projects(indir,outdir,backupdir,pool)
+    pool.wait()
+    assert pool.errors == []
+    assert sorted(os.listdir(outdir/'panoramas'/'p20260101')) == ['pano.jpg','pano.tif']
+    assert sorted(os.listdir(backupdir/'panoramas'/'p20260101')) == ['pano.jpg']
@@ -0,0 +1,25 @@
+import pytest
+
+from photo_workflow.create import move_file, move_files
+
+def test_move_file(tmp_path):
+    src = tmp_path/'a.tif'
+    src.write_bytes(b'new')
+    outdir = tmp_path/'out'
+    outdir.mkdir()
+    assert move_file(src,outdir) == outdir/'a.tif'
+    assert (outdir/'a.tif').read_bytes() == b'new'
+    assert not src.exists()
+
+def test_move_file_does_not_overwrite(tmp_path):
+    src = tmp_path/'a.tif'
+    src.write_bytes(b'new')
+    outdir = tmp_path/'out'
+    outdir.mkdir()
+    (outdir/'a.tif').write_bytes(b'old')
+    with pytest.raises(FileExistsError):
+        move_file(src,outdir)
+    errors = move_files([(src,outdir)])
+    assert [p for p,e in errors] == [src]
+    assert (outdir/'a.tif').read_bytes() == b'old'
+    assert src.read_bytes() == b'new'
@@ -0,0 +1,125 @@
+import re
+import threading
+import http.server
+from email.utils import formatdate
+
+import easywebdav
+
+from photo_workflow.davsync import DAVSync
+
+FILES = {'a.gpx':b'a'*1000,'b.gpx':b'b'*2000,'c.gpx':b'c'*3000}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # a WebDAV collection of FILES below /, keeping connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self,*args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def reply(self,code,body=b'',headers=()):
+        self.send_response(code)
+        for k,v in headers:
+            self.send_header(k,v)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PROPFIND(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        modified = formatdate(usegmt=True)
+        if self.headers.get('Depth') == '0':
+            responses = ['<d:response><d:href>/</d:href><d:propstat><d:prop>'
+                         '<d:getetag>"1"</d:getetag></d:prop></d:propstat></d:response>']
+        else:
+            responses = ['<d:response><d:href>/{}</d:href><d:propstat><d:prop>'
+                         '<d:getcontentlength>{}</d:getcontentlength>'
+                         '<d:getlastmodified>{}</d:getlastmodified>'
+                         '<d:creationdate>{}</d:creationdate>'
+                         '<d:getcontenttype>application/gpx+xml</d:getcontenttype>'
+                         '</d:prop></d:propstat></d:response>'.format(name,len(data),modified,modified)
+                         for name,data in sorted(FILES.items())]
+        body = '<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">{}</d:multistatus>'.format(''.join(responses))
+        self.reply(207,body.encode(),[('Content-Type','application/xml')])
+
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        self.server.gets.append((name,self.headers.get('Range')))
+        data = FILES[name]
+        m = re.match(r'bytes=(\d+)-$',self.headers.get('Range') or '')
+        if m is None:
+            self.reply(200,data)
+        elif int(m.group(1)) >= len(data):
+            self.reply(416,headers=[('Content-Range','bytes */{}'.format(len(data)))])
+        else:
+            start = int(m.group(1))
+            self.reply(206,data[start:],[('Content-Range','bytes {}-{}/{}'.format(start,len(data)-1,len(data)))])
+
+def serve():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1',0),Handler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.gets = []
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+def client(server,tmp_path,num_threads=2):
+    dav = easywebdav.connect('127.0.0.1',port=server.server_address[1],protocol='http')
+    return DAVSync(dav,cache=tmp_path/'cache.json',num_threads=num_threads)
+
+def test_resume_partial_download(tmp_path):
+    server = serve()
+    sync = client(server,tmp_path)
+    (tmp_path/'b.gpx.part').write_bytes(FILES['b.gpx'][:500])
+    sync.download('b.gpx',tmp_path/'b.gpx',2000)
+    assert (tmp_path/'b.gpx').read_bytes() == FILES['b.gpx']
+    assert not (tmp_path/'b.gpx.part').exists()
+    assert server.gets == [('b.gpx','bytes=500-')]
+    server.shutdown()
+
+def test_complete_partial_download(tmp_path):
+    server = serve()
+    sync = client(server,tmp_path)
+    (tmp_path/'a.gpx.part').write_bytes(FILES['a.gpx'])
+    sync.download('a.gpx',tmp_path/'a.gpx',1000)
+    assert (tmp_path/'a.gpx').read_bytes() == FILES['a.gpx']
+    assert server.gets == []
+    server.shutdown()
+
+def test_oversized_partial_download(tmp_path):
+    server = serve()
+    sync = client(server,tmp_path)
+    (tmp_path/'a.gpx.part').write_bytes(b'x'*1500)
+    sync.download('a.gpx',tmp_path/'a.gpx',1000)
+    assert (tmp_path/'a.gpx').read_bytes() == FILES['a.gpx']
+    assert server.gets == [('a.gpx',None)]
+    server.shutdown()
+
+def test_unsatisfiable_range_restarts(tmp_path):
+    # the size is not known, the server rejects the range of a complete part
+    server = serve()
+    sync = client(server,tmp_path)
+    (tmp_path/'a.gpx.part').write_bytes(b'x'*1000)
+    sync.download('a.gpx',tmp_path/'a.gpx')
+    assert (tmp_path/'a.gpx').read_bytes() == FILES['a.gpx']
+    assert server.gets == [('a.gpx','bytes=1000-'),('a.gpx',None)]
+    server.shutdown()
+
+def test_sync_reuses_connections(tmp_path):
+    server = serve()
+    sync = client(server,tmp_path,num_threads=2)
+    files = sync.listing()
+    assert sorted(files) == sorted((name,len(data)) for name,data in FILES.items())
+    for i in range(3):
+        errors = sync.sync([(name,size,tmp_path/'{}-{}'.format(i,name)) for name,size in files])
+        assert errors == []
+    for i in range(3):
+        for name,data in FILES.items():
+            assert (tmp_path/'{}-{}'.format(i,name)).read_bytes() == data
+    assert len(server.gets) == 9
+    # at most one connection per thread besides the listing
+    assert server.connections <= 3
+    server.shutdown()
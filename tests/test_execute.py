@@ -0,0 +1,30 @@
+import subprocess
+import threading
+
+from photo_workflow import execute
+
+def run_with_timeout(func,timeout=30):
+    result = []
+    def target():
+        try:
+            result.append(func())
+        except Exception as e:
+            result.append(e)
+    t = threading.Thread(target=target,daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), 'run hangs'
+    return result[0]
+
+def test_timeout_kills_forked_helpers():
+    executor = execute.Executor()
+    # the background sleep keeps the pipes open after sh is killed
+    e = run_with_timeout(lambda: executor.run(['sh','-c','sleep 60 & sleep 60'],timeout=1))
+    assert isinstance(e,subprocess.TimeoutExpired)
+
+def test_helpers_left_behind_are_killed(monkeypatch):
+    monkeypatch.setattr(execute,'GRACE',0.5)
+    executor = execute.Executor()
+    result = run_with_timeout(lambda: executor.run(['sh','-c','sleep 60 & echo started'],capture=True))
+    assert result.returncode == 0
+    assert result.stdout == ['started']
@@ -0,0 +1,99 @@
+import math
+import datetime
+import xml.etree.ElementTree
+
+import numpy
+
+from photo_workflow import corpus
+from photo_workflow.tiff import make_tiff
+from photo_workflow.geotag import Track, photo_time, write_gps, has_gps, geotag, NS
+
+T0 = datetime.datetime(2026,5,1,10,0,0,tzinfo=datetime.timezone.utc).timestamp()
+
+def gpx(fname,points):
+    with open(fname,'w') as f:
+        f.write('<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>\n')
+        for t,lat,lon,ele in points:
+            f.write('<trkpt lat="{}" lon="{}"><ele>{}</ele><time>{}</time></trkpt>\n'.format(
+                lat,lon,ele,datetime.datetime.fromtimestamp(T0+t,datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')))
+        f.write('</trkseg></trk></gpx>\n')
+    return fname
+
+def track(tmp_path):
+    # two files out of order, a gap of 300s and one of 301s
+    return Track([gpx(tmp_path/'b.gpx',[(400,47.,8.,400.),(701,48.,9.,100.)]),
+                  gpx(tmp_path/'a.gpx',[(0,46.,7.,500.),(100,46.5,7.5,600.)])])
+
+def position(track,t,max_gap=300):
+    lat,lon,ele = track.interpolate([T0+t],max_gap=max_gap)
+    return lat[0],lon[0],ele[0]
+
+def test_interpolate(tmp_path):
+    tr = track(tmp_path)
+    assert len(tr) == 4
+    assert position(tr,50) == (46.25,7.25,550.)
+    assert position(tr,100) == (46.5,7.5,600.)
+    # the gap of exactly max_gap is interpolated over
+    lat,lon,ele = position(tr,250)
+    assert math.isclose(lat,46.75) and math.isclose(lon,7.75) and math.isclose(ele,500.)
+
+def test_interpolate_outside_track_and_gaps(tmp_path):
+    tr = track(tmp_path)
+    for t in (-1,702,500):
+        assert all(math.isnan(v) for v in position(tr,t))
+    # a larger max_gap bridges the gap
+    assert not math.isnan(position(tr,500,max_gap=301)[0])
+
+def test_interpolate_short_tracks(tmp_path):
+    assert all(math.isnan(v) for v in position(Track([gpx(tmp_path/'a.gpx',[(0,46.,7.,0.)])]),0))
+    # two points at the same time
+    tr = Track([gpx(tmp_path/'b.gpx',[(0,46.,7.,0.),(0,46.,7.,0.),(10,47.,8.,0.)])])
+    assert position(tr,0)[:2] == (46.,7.)
+    assert numpy.isnan(tr.interpolate(numpy.array([numpy.nan]))[0][0])
+
+def test_photo_time(tmp_path):
+    fname = tmp_path/'a.ORF'
+    taken = b'2026:05:01 12:00:50\0'
+    offset = b'+02:00\0'
+    fname.write_bytes(make_tiff('<',{0x9003:(2,len(taken),taken),0x9011:(2,len(offset),offset)},[b'\0'*16]))
+    assert photo_time(fname) == T0+50
+    fname.write_bytes(make_tiff('<',{0x9003:(2,len(taken),taken)},[b'\0'*16]))
+    tz = datetime.timezone(datetime.timedelta(hours=2))
+    assert photo_time(fname,tz=tz) == T0+50
+    fname.write_bytes(corpus.tiff_bytes(4,4))
+    assert photo_time(fname) is None
+
+def attributes(xmpfile):
+    desc = xml.etree.ElementTree.parse(xmpfile).getroot().find('rdf:RDF/rdf:Description',NS)
+    exif = '{'+NS['exif']+'}'
+    return dict((k[len(exif):],v) for k,v in desc.attrib.items() if k.startswith(exif)),desc
+
+def test_write_gps_keeps_sidecar(tmp_path):
+    xmpfile = tmp_path/'a.ORF.xmp'
+    xmpfile.write_text(corpus._xmp(subjects=['Places|Alps'],modules=['exposure']))
+    write_gps(xmpfile,-33.5,-70.25,-12.34)
+    gps,desc = attributes(xmpfile)
+    assert gps == {'GPSVersionID':'2.2.0.0','GPSLatitude':'33,30.000000S','GPSLongitude':'70,15.000000W',
+                   'GPSAltitudeRef':'1','GPSAltitude':'1234/100'}
+    # the darktable history and the subjects are kept
+    text = xmpfile.read_text()
+    assert 'darktable:operation="exposure"' in text and 'Places|Alps' in text
+    assert has_gps(xmpfile)
+    assert [f.name for f in tmp_path.iterdir()] == ['a.ORF.xmp']
+
+def test_write_gps_new_sidecar(tmp_path):
+    xmpfile = tmp_path/'a.ORF.xmp'
+    assert not has_gps(xmpfile)
+    write_gps(xmpfile,46.5,7.75,float('nan'))
+    gps,desc = attributes(xmpfile)
+    assert gps == {'GPSVersionID':'2.2.0.0','GPSLatitude':'46,30.000000N','GPSLongitude':'7,45.000000E'}
+
+def test_geotag(tmp_path):
+    photos = [tmp_path/'a.ORF',tmp_path/'b.ORF',tmp_path/'c.ORF']
+    for p in photos:
+        p.write_bytes(b'')
+    times = [T0+50,T0+500,numpy.nan]
+    assert geotag(photos,times,track(tmp_path)) == 1
+    assert has_gps(tmp_path/'a.ORF.xmp')
+    assert not (tmp_path/'b.ORF.xmp').exists()
+    assert not (tmp_path/'c.ORF.xmp').exists()
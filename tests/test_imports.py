@@ -0,0 +1,24 @@
+import sys
+import subprocess
+
+import pytest
+
+# heavy dependencies that must only be imported when they are used
+HEAVY = ('jinja2','yaml','pkg_resources','PIL','numpy','easywebdav','keyring','requests')
+# the heavy dependencies a module needs at import time
+ALLOWED = {'photo_workflow.geotag':{'numpy'},
+           'photo_workflow.panobuild':{'yaml'},
+           'photo_workflow.scale':{'PIL'}}
+
+def imported(module):
+    code = 'import sys, {}; print(" ".join(m for m in {!r} if m in sys.modules))'.format(module,HEAVY)
+    result = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,check=True)
+    return set(result.stdout.split())
+
+@pytest.mark.parametrize('module',['photo_workflow.cli','photo_workflow.xmlpatch','photo_workflow.krpano',
+                                   'photo_workflow.archive','photo_workflow.backup','photo_workflow.create',
+                                   'photo_workflow.geotag','photo_workflow.getgpx','photo_workflow.gpx',
+                                   'photo_workflow.panobuild','photo_workflow.scale',
+                                   'photo_workflow.stackpreview','photo_workflow.watch'])
+def test_lazy_imports(module):
+    assert imported(module) <= ALLOWED.get(module,set())
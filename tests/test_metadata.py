@@ -0,0 +1,46 @@
+import json
+import subprocess
+
+import pytest
+
+from photo_workflow import corpus
+from photo_workflow.execute import Executor
+from photo_workflow.metadata import ExifTool, xmp_packet, xmp_subjects
+
+def test_xmp_packet(tmp_path):
+    fname = corpus.tiff_with_xmp(tmp_path/'a.tif',1024*1024,subjects=['Places|Alps'])
+    assert xmp_subjects(xmp_packet(fname)) == ['Places|Alps']
+
+def test_tiff_without_xmp(tmp_path):
+    # pixel data that looks like a packet is not taken for one
+    data = bytearray(64*64*3)
+    fake = corpus.XMP.encode()
+    data[1000:1000+len(fake)] = fake
+    fname = tmp_path/'b.tif'
+    fname.write_bytes(corpus.tiff_bytes(64,64,data=bytes(data)))
+    assert xmp_packet(fname) is None
+
+def test_exiftool_runs_through_executor(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin',latency=0)
+    executor = Executor(max_procs=1,metrics=tmp_path/'metrics.jsonl')
+    files = [tmp_path/'a.tif',tmp_path/'b.tif']
+    with ExifTool(stubs['exiftool'],executor=executor) as et:
+        # the stay-open process holds the only slot while it lives
+        assert not executor._slots.acquire(blocking=False)
+        for f in files:
+            tags = et.subjects([f])
+            assert list(tags) == [f] and tags[f][0] in ('panorama','focus stack')
+    assert executor._slots.acquire(blocking=False)
+    metrics = [json.loads(l) for l in open(tmp_path/'metrics.jsonl')]
+    assert [m['tool'] for m in metrics] == ['exiftool','exiftool']
+    assert all(m['returncode'] == 0 and not m['timeout'] for m in metrics)
+
+def test_exiftool_timeout(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin',latency=10)
+    executor = Executor(max_procs=1,metrics=tmp_path/'metrics.jsonl')
+    with pytest.raises(subprocess.TimeoutExpired):
+        with ExifTool(stubs['exiftool'],executor=executor,timeout=0.5) as et:
+            et.subjects([tmp_path/'a.tif'])
+    assert executor._slots.acquire(blocking=False)
+    metrics = [json.loads(l) for l in open(tmp_path/'metrics.jsonl')]
+    assert [m['timeout'] for m in metrics] == [True]
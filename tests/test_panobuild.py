@@ -0,0 +1,19 @@
+from photo_workflow.panobuild import Step, schedule
+
+def test_same_pname_in_different_directories():
+    ran = []
+    steps = []
+    for source in ('a/pano.yaml','b/pano.yaml'):
+        steps += [Step('pano','tiles',lambda s=source: ran.append((s,'tiles')),(),True,source),
+                  Step('pano','patch',lambda s=source: ran.append((s,'patch')),('tiles',),False,source)]
+    results = schedule(steps,num_threads=2)
+    assert len(results) == 4
+    assert all(e is None for t,e in results.values())
+    assert sorted(ran) == sorted((s,n) for s in ('a/pano.yaml','b/pano.yaml') for n in ('tiles','patch'))
+
+def test_unresolved_dependency_fails():
+    steps = [Step('pano','tiles',lambda: None,(),True,'a'),
+             Step('pano','patch',lambda: None,('hotspots',),False,'a')]
+    results = schedule(steps,num_threads=2)
+    assert results[('a','tiles')][1] is None
+    assert results[('a','patch')][1] is not None
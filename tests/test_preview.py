@@ -0,0 +1,93 @@
+import io
+import os
+import struct
+
+from PIL import Image
+
+from photo_workflow import preview
+from photo_workflow.tiff import TIFF, open_tiff, make_tiff, SUB_IFDS
+
+def jpeg(size,noise=False):
+    if noise:
+        image = Image.frombytes('RGB',size,os.urandom(size[0]*size[1]*3))
+    else:
+        image = Image.linear_gradient('L').resize(size).convert('RGB')
+    out = io.BytesIO()
+    image.save(out,'JPEG',quality=90)
+    return out.getvalue()
+
+def short(v):
+    return (3,1,struct.pack('<H',v))
+
+def raw_file(fname,magic,tags,strips=(b'\0'*64,),subifd=None):
+    # a little-endian raw file, subifd is a dictionary of LONG tags written
+    # as a sub IFD after the image data
+    tags = dict(tags)
+    if subifd is not None:
+        tags[SUB_IFDS] = (4,1,struct.pack('<I',0))
+        length = len(make_tiff('<',tags,list(strips)))
+        tags[SUB_IFDS] = (4,1,struct.pack('<I',length))
+    data = bytearray(make_tiff('<',tags,list(strips)))
+    data[2:4] = struct.pack('<H',magic)
+    if subifd is not None:
+        data += struct.pack('<H',len(subifd))
+        for t in sorted(subifd):
+            data += struct.pack('<HHII',t,4,1,subifd[t])
+        data += struct.pack('<I',0)
+    fname.write_bytes(bytes(data))
+    return fname
+
+def test_rw2_jpeg_from_raw(tmp_path):
+    small = jpeg((160,120))
+    large = jpeg((640,480),noise=True)
+    fname = raw_file(tmp_path/'a.RW2',0x55,{preview.JPEG_FROM_RAW:(7,len(large),large),
+                                            preview.COMPRESSION:short(6),0x100:short(16),0x101:short(16)},
+                     strips=(small,))
+    with open_tiff(fname) as tiff:
+        previews = preview.embedded_previews(tiff)
+        offset,length = previews[0]
+        assert bytes(tiff.buf[offset:offset+length]) == large
+        assert len(small) in [l for o,l in previews]
+    preview.extract_preview(fname,tmp_path/'a.jpg',size=(320,160))
+    with Image.open(tmp_path/'a.jpg') as image:
+        assert image.size == (213,160)
+    assert os.stat(tmp_path/'a.jpg').st_mtime == 0
+
+def test_orf_preview_in_sub_ifd_rotated(tmp_path):
+    large = jpeg((400,300))
+    # the preview follows the sub IFD written at the end
+    fname = tmp_path/'a.ORF'
+    tags = {0x100:short(16),0x101:short(16),preview.ORIENTATION:short(6)}
+    raw_file(fname,0x4f52,tags,subifd={preview.JPEG_OFFSET:0,preview.JPEG_LENGTH:len(large)})
+    data = bytearray(fname.read_bytes())
+    offset = len(data)
+    # patch the offset of the sub IFD entry
+    tiff = TIFF(data)
+    entries,nxt = tiff.ifd(tiff.first)
+    sub, = tiff.value(entries[SUB_IFDS])
+    subentries,nxt = tiff.ifd(sub)
+    struct.pack_into('<I',data,subentries[preview.JPEG_OFFSET][2],offset)
+    fname.write_bytes(bytes(data)+large)
+    with open_tiff(fname) as tiff:
+        assert preview.embedded_previews(tiff)[0] == (offset,len(large))
+    preview.extract_preview(fname,tmp_path/'a.jpg',size=(200,100))
+    with Image.open(tmp_path/'a.jpg') as image:
+        # rotated by 90 degrees
+        assert image.size == (75,100)
+
+def test_preview_in_maker_notes(tmp_path):
+    # no tag points at the JPEG, it is found by its markers
+    large = jpeg((320,240))
+    notes = b'MAKER\0\0\0'+large+b'\0'*16
+    fname = raw_file(tmp_path/'a.ORF',0x4f52,{0x927c:(7,len(notes),notes),0x100:short(16),0x101:short(16)})
+    with open_tiff(fname) as tiff:
+        offset,length = preview.embedded_previews(tiff)[0]
+        assert bytes(tiff.buf[offset:offset+length]) == large
+
+def test_ifd_loop(tmp_path):
+    data = bytearray(make_tiff('<',{0x100:short(16),0x101:short(16)},[b'\0'*64]))
+    tiff = TIFF(data)
+    n, = tiff.unpack('H',tiff.first)
+    # the next IFD is the first one again
+    struct.pack_into('<I',data,tiff.first+2+12*n,tiff.first)
+    assert len(list(TIFF(data).ifds())) == 1
@@ -0,0 +1,61 @@
+import os
+
+import numpy
+import pytest
+from PIL import Image
+
+from photo_workflow import scale
+from photo_workflow.scale import tiff_bands, load_scaled, scale_sizes
+
+def noise(mode,size):
+    image = Image.linear_gradient('L').resize(size)
+    pixels = numpy.asarray(image,dtype=numpy.uint8)
+    pixels = pixels ^ numpy.frombuffer(os.urandom(pixels.size),dtype=numpy.uint8).reshape(pixels.shape)//8
+    return Image.fromarray(pixels).convert(mode)
+
+@pytest.mark.parametrize('mode,compression',[('RGB',None),('RGB','tiff_lzw'),('L','tiff_deflate'),
+                                             ('RGBA','tiff_lzw')])
+def test_bands_match_full_decode(tmp_path,mode,compression):
+    fname = tmp_path/'a.tif'
+    image = noise(mode,(300,997))
+    image.save(fname,compression=compression)
+    rows = []
+    heights = []
+    for y0,band in tiff_bands(fname,rows=64,multiple=4):
+        assert y0 == sum(heights)
+        heights.append(band.size[1])
+        rows.append(numpy.asarray(band))
+    # all bands but the last are multiples of 4 rows
+    assert all(h%4 == 0 for h in heights[:-1])
+    assert len(heights) > 1
+    assert numpy.array_equal(numpy.concatenate(rows),numpy.asarray(image))
+
+def test_banded_scale_matches_full_decode(tmp_path,monkeypatch):
+    fname = tmp_path/'a.tif'
+    image = noise('RGB',(1200,800))
+    image.save(fname,compression='tiff_lzw')
+    full = numpy.asarray(load_scaled(fname,long_side=300),dtype=float)
+    monkeypatch.setattr(scale,'BAND_LIMIT',0)
+    bands = []
+    monkeypatch.setattr(scale,'tiff_bands',lambda *a,**k: (bands.append(b) or b for b in tiff_bands(*a,**k)))
+    banded = load_scaled(fname,long_side=300)
+    assert len(bands) > 1
+    assert banded.size == (300,200)
+    assert numpy.abs(numpy.asarray(banded,dtype=float)-full).mean() < 2
+
+def test_jpeg_draft(tmp_path):
+    fname = tmp_path/'a.jpg'
+    noise('RGB',(2000,1000)).save(fname,quality=90)
+    assert load_scaled(fname,long_side=300).size == (300,150)
+
+def test_scale_sizes(tmp_path):
+    fname = tmp_path/'a.tif'
+    noise('RGB',(800,600)).save(fname)
+    outputs = [(tmp_path/'small.jpg',200),(tmp_path/'large.jpg',400),(tmp_path/'huge.jpg',2000)]
+    written = scale_sizes(fname,outputs,quality=85)
+    assert written == [tmp_path/'huge.jpg',tmp_path/'large.jpg',tmp_path/'small.jpg']
+    for o,size in [(tmp_path/'small.jpg',(200,150)),(tmp_path/'large.jpg',(400,300)),(tmp_path/'huge.jpg',(800,600))]:
+        with Image.open(o) as i:
+            assert i.size == size
+    # the outputs are up to date
+    assert scale_sizes(fname,outputs) == []
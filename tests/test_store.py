@@ -0,0 +1,82 @@
+import os
+
+from photo_workflow import backup
+from photo_workflow.store import Store
+
+def tree(root,files):
+    for rel,data in files.items():
+        f = root/rel
+        f.parent.mkdir(parents=True,exist_ok=True)
+        f.write_bytes(data)
+    return root
+
+def read(root):
+    return dict((str(f.relative_to(root)),f.read_bytes()) for f in root.glob('**/*') if f.is_file())
+
+def nchunks(store):
+    return len([c for c in store.chunks.glob('*/*')])
+
+FILES = {'pano.jpg':os.urandom(2500),'empty.txt':b'','exact.bin':os.urandom(2048),
+         'tiles/l1/1/l1_1_1.jpg':os.urandom(700)}
+
+def test_round_trip(tmp_path):
+    src = tree(tmp_path/'src',FILES)
+    (src/'pano.tif').write_bytes(b'tif')
+    (src/'.pano.jpg.part').write_bytes(b'part')
+    os.chmod(src/'pano.jpg',0o640)
+    os.utime(src/'pano.jpg',ns=(10**18,10**18))
+    store = Store(tmp_path/'store',chunk_size=1024)
+    store.backup('panoramas/p20260101',src,include_tif=False)
+    assert store.projects() == ['panoramas/p20260101']
+    store.restore('panoramas/p20260101',tmp_path/'dst')
+    assert read(tmp_path/'dst') == FILES
+    st = os.stat(tmp_path/'dst'/'pano.jpg')
+    assert st.st_mode & 0o777 == 0o640
+    assert st.st_mtime_ns == 10**18
+
+def test_duplicates_are_stored_once(tmp_path):
+    store = Store(tmp_path/'store',chunk_size=1024)
+    store.backup('a',tree(tmp_path/'a',FILES))
+    n = nchunks(store)
+    store.backup('b',tree(tmp_path/'b',dict(FILES,extra=FILES['pano.jpg'])))
+    assert nchunks(store) == n
+    store.restore('b',tmp_path/'dst')
+    assert read(tmp_path/'dst') == dict(FILES,extra=FILES['pano.jpg'])
+
+def test_unchanged_files_are_not_read(tmp_path,monkeypatch):
+    src = tree(tmp_path/'src',FILES)
+    store = Store(tmp_path/'store',chunk_size=1024)
+    store.backup('a',src)
+    manifest = store.manifest('a').stat().st_mtime_ns
+    put = store.put
+    stored = []
+    monkeypatch.setattr(store,'put',lambda f: stored.append(f) or put(f))
+    store.backup('a',src)
+    assert stored == []
+    assert store.manifest('a').stat().st_mtime_ns == manifest
+    (src/'pano.jpg').write_bytes(b'changed')
+    store.backup('a',src)
+    assert stored == [src/'pano.jpg']
+    store.restore('a',tmp_path/'dst')
+    assert read(tmp_path/'dst') == dict(FILES,**{'pano.jpg':b'changed'})
+
+def test_restore_hardlinks_single_chunks(tmp_path):
+    store = Store(tmp_path/'store',chunk_size=1024)
+    files = store.backup('a',tree(tmp_path/'src',FILES))
+    store.restore('a',tmp_path/'dst',hardlink=True)
+    assert read(tmp_path/'dst') == FILES
+    small = files['tiles/l1/1/l1_1_1.jpg']['chunks']
+    assert os.stat(tmp_path/'dst'/'tiles/l1/1/l1_1_1.jpg').st_ino == os.stat(store.chunk(small[0])).st_ino
+    # files of several chunks are copied
+    assert os.stat(tmp_path/'dst'/'pano.jpg').st_nlink == 1
+
+def test_dedup_and_restore_commands(tmp_path):
+    tempdir = tree(tmp_path/'temp',dict(('panoramas/p20260101/'+k,v) for k,v in FILES.items()))
+    for d in ('project','backup'):
+        (tmp_path/d).mkdir()
+    cfg = tmp_path/'cfg'
+    cfg.write_text('[directories]\ntempdir = {0}/temp\nproject = {0}/project\nbackedup = {0}/backup\n'.format(tmp_path))
+    backup.main(['-c',str(cfg),'--dedup'])
+    assert Store(tmp_path/'backup'/'store').projects() == ['panoramas/p20260101']
+    backup.main(['-c',str(cfg),'--restore','panoramas/p20260101','-o',str(tmp_path/'restored')])
+    assert read(tmp_path/'restored'/'panoramas'/'p20260101') == read(tempdir/'panoramas'/'p20260101')
@@ -0,0 +1,117 @@
+import math
+import xml.etree.ElementTree
+
+import numpy
+from PIL import Image
+
+from photo_workflow.tiler import Tiler, levels, vfov, sync_tiles, read_manifest, manifest_name
+
+def gradient(fname,size):
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    image.save(fname)
+    return fname
+
+def tile_files(tiles):
+    return sorted(f.relative_to(tiles).as_posix() for f in tiles.glob('**/*.jpg'))
+
+def test_levels():
+    assert levels((1200,400),256) == [(1200,400),(600,200),(300,100),(150,50)]
+    assert levels((256,100),256) == [(256,100)]
+    assert levels((513,257),256) == [(513,257),(257,129),(129,65)]
+
+def test_vfov():
+    assert math.isclose(vfov('flat',90,(1000,1000)),90)
+    assert math.isclose(vfov('cylinder',360,(2000,1000)),math.degrees(2*math.atan(math.pi/2)))
+    assert math.isclose(vfov('sphere',360,(2000,1000)),180)
+
+def test_pyramid(tmp_path):
+    # the banded TIFF decoder and a full PNG decode give the same pyramid
+    for name in ('pano.tif','pano.png'):
+        inname = gradient(tmp_path/name,(2600,300))
+        tiles = tmp_path/(name+'.tiles')
+        tiler = Tiler(tiles,tilesize=256,num_processes=2)
+        sizes = tiler.run(inname,pname='pano')
+        assert sizes == levels((2600,300),256)
+        expected = []
+        for k,size in enumerate(sizes):
+            nh,nv = tiler.ntiles(size)
+            for v in range(nv):
+                for h in range(nh):
+                    rel = tiler.tile_path(sizes,k,v,h)
+                    expected.append(rel.as_posix())
+                    with Image.open(tiles/rel) as tile:
+                        assert tile.size == (min(256,size[0]-256*h),min(256,size[1]-256*v))
+        assert tile_files(tiles) == sorted(expected+['mobile_pano.jpg','preview.jpg','thumb.jpg'])
+        # the largest level has 11 tiles in a row, their index is padded
+        assert (tiles/'l5'/'1'/'l5_1_11.jpg').is_file()
+        assert tiler.url(sizes,0) == 'l%l/%v/l%l_%v_%0h.jpg'
+    with Image.open(tmp_path/'pano.tif.tiles'/'l5'/'2'/'l5_2_05.jpg') as a, \
+         Image.open(tmp_path/'pano.png.tiles'/'l5'/'2'/'l5_2_05.jpg') as b:
+        assert numpy.array_equal(numpy.asarray(a),numpy.asarray(b))
+    # the tiles hold the pixels of the source
+    with Image.open(tmp_path/'pano.png') as source, Image.open(tmp_path/'pano.png.tiles'/'l5'/'2'/'l5_2_05.jpg') as tile:
+        crop = numpy.asarray(source.crop((1024,256,1280,300)),dtype=float)
+        assert numpy.abs(numpy.asarray(tile,dtype=float)-crop).mean() < 2
+
+def test_xml(tmp_path):
+    inname = gradient(tmp_path/'pano.tif',(1200,400))
+    tiler = Tiler(tmp_path/'pano.tiles',tilesize=256,num_processes=1)
+    sizes = tiler.run(inname,pname='pano')
+    pano = {'pname':'pano','panotype':'cylinder','hfov':360,'voffset':'5'}
+    tiler.xml(pano,sizes,tmp_path/'pano.xml')
+    root = xml.etree.ElementTree.parse(tmp_path/'pano.xml').getroot()
+    image = root.find("image[@devices='!mobile']")
+    assert image.get('type') == 'CYLINDER' and image.get('voffset') == '5'
+    assert [(int(l.get('tiledimagewidth')),int(l.get('tiledimageheight'))) for l in image.findall('level')] == sizes
+    assert image.find('level/cylinder').get('url') == 'pano.tiles/l%l/%v/l%l_%v_%h.jpg'
+    assert root.find('preview').get('url') == 'pano.tiles/preview.jpg'
+    mobile = root.find("image[@devices='mobile']/cylinder")
+    assert mobile.get('url') == 'pano.tiles/mobile_pano.jpg'
+
+def test_unchanged_tiles_are_not_rewritten(tmp_path):
+    inname = gradient(tmp_path/'pano.tif',(1200,600))
+    tiles = tmp_path/'pano.tiles'
+    Tiler(tiles,tilesize=256,num_processes=1).run(inname,params={'q':1},pname='pano')
+    # a stale file from a larger pyramid
+    (tiles/'l9'/'1').mkdir(parents=True)
+    (tiles/'l9'/'1'/'l9_1_1.jpg').write_bytes(b'old')
+    tiler = Tiler(tiles,tilesize=256,num_processes=1)
+    tiler.run(inname,params={'q':1},pname='pano')
+    assert tiler.changed == []
+    assert not (tiles/'l9').exists()
+    # change the pixels of the first tile only
+    with Image.open(inname) as image:
+        image.paste((255,0,0),(0,0,100,100))
+        image.save(inname)
+    tiler.run(inname,params={'q':1},pname='pano')
+    # the top left tile of every level and the previews, the thumbnail is
+    # cropped from the centre
+    assert sorted(tiler.changed) == ['l1/1/l1_1_1.jpg','l2/1/l2_1_1.jpg','l3/1/l3_1_1.jpg','l4/1/l4_1_1.jpg',
+                                     'mobile_pano.jpg','preview.jpg']
+    manifest = read_manifest(manifest_name(tiles))
+    assert manifest['params'] == {'q':1}
+    assert sorted(manifest['tiles']) == tile_files(tiles)
+
+def test_sync_tiles(tmp_path):
+    tiles = tmp_path/'pano.tiles'
+    staging = tmp_path/'staging'
+    for rel,data in (('l1/1/a.jpg',b'a'),('l1/1/b.jpg',b'b'),('l2/1/c.jpg',b'c')):
+        (staging/rel).parent.mkdir(parents=True,exist_ok=True)
+        (staging/rel).write_bytes(data)
+    assert sorted(sync_tiles(staging,tiles,params=1)) == ['l1/1/a.jpg','l1/1/b.jpg','l2/1/c.jpg']
+    inode = (tiles/'l1/1/a.jpg').stat().st_ino
+    # the next run renders a again, changes b and no longer has c
+    staging = tmp_path/'staging2'
+    for rel,data in (('l1/1/a.jpg',b'a'),('l1/1/b.jpg',b'B')):
+        (staging/rel).parent.mkdir(parents=True,exist_ok=True)
+        (staging/rel).write_bytes(data)
+    assert sync_tiles(staging,tiles,params=2) == ['l1/1/b.jpg']
+    assert (tiles/'l1/1/a.jpg').stat().st_ino == inode
+    assert (tiles/'l1/1/b.jpg').read_bytes() == b'B'
+    assert not (tiles/'l2').exists()
+    assert read_manifest(manifest_name(tiles))['params'] == 2
+
+def test_broken_manifest(tmp_path):
+    fname = tmp_path/'pano.tiles.json'
+    fname.write_text('{"tiles":')
+    assert read_manifest(fname) == {'params':None,'tiles':{}}
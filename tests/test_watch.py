@@ -0,0 +1,29 @@
+import queue
+from pathlib import Path
+
+from photo_workflow.watch import Changes, Pipeline, collect
+
+def pipeline(tmp_path):
+    dirs = dict((d,str(tmp_path/d)) for d in ('assets','tempdir','project','backedup'))
+    for d in dirs.values():
+        Path(d).mkdir()
+    return Pipeline({'directories':dirs})
+
+def test_failed_stage_is_returned(tmp_path):
+    p = pipeline(tmp_path)
+    def fail(work):
+        raise FileNotFoundError('gone')
+    p.render = fail
+    p.create = lambda work: None
+    work = Changes(p.assets,p.tempdir)
+    work.add(p.assets/'2026'/'day'/'IMG_1.ORF')
+    work.add(p.tempdir/'IMG_2.tif')
+    failed = p(work)
+    assert failed.raw_dirs == {p.assets/'2026'/'day'}
+    assert not failed.tiffs
+    assert failed.attempts == 1
+
+def test_collect_retries_leftover_work(tmp_path):
+    work = Changes(tmp_path/'assets',tmp_path/'temp')
+    work.add(tmp_path/'temp'/'IMG_1.tif')
+    assert collect(queue.Queue(),work,delay=0.01,retry=0.01) is work
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+from pathlib import Path
+
+from photo_workflow import corpus
+from photo_workflow.workqueue import WorkQueue
+
+def worker(cfg,queue,log):
+    env = dict(os.environ,PYTHONPATH=str(Path(__file__).parents[1]))
+    return subprocess.Popen([sys.executable,'-m','photo_workflow.archive','-c',str(cfg),'-p',str(cfg.parent/'assets'),
+                             '--worker','-n','1','--lease','2','--queue',str(queue)],
+                            stdout=log,stderr=subprocess.STDOUT,env=env)
+
+def test_dead_node_is_reclaimed(tmp_path):
+    stubs = corpus.write_stubs(tmp_path/'bin',latency=0.3)
+    corpus.asset_tree(tmp_path/'assets',days=2,per_day=6,raw_size=1024)
+    cfg = tmp_path/'cfg'
+    cfg.write_text('[directories]\nproject = {0}/project\nassets = {0}/assets\n'
+                   '[darktable]\ncli = {1}\n'.format(tmp_path,stubs['darktable-cli']))
+    qname = tmp_path/'queue'
+    with open(tmp_path/'log','w') as log:
+        nodes = [worker(cfg,qname,log) for i in range(3)]
+        queue = WorkQueue(qname)
+        # kill the first node once it holds a task
+        deadline = time.time()+60
+        while time.time() < deadline:
+            rows = queue._query("SELECT COUNT(*) FROM tasks WHERE state='claimed' AND node LIKE ?",
+                                ('%:{}'.format(nodes[0].pid),))
+            if rows[0][0]:
+                break
+            time.sleep(0.05)
+        else:
+            raise AssertionError('the first node never claimed a task')
+        nodes[0].send_signal(signal.SIGKILL)
+        for n in nodes[1:]:
+            assert n.wait(timeout=120) == 0
+    assert queue.counts() == {'pending':0,'claimed':0,'done':12,'failed':0}
+    # every task was finished by exactly one node
+    assert sum(n['processed'] for n in queue.nodes()) == 12
+    outputs = list((tmp_path/'project'/'archive').glob('*/*/*.jpg'))
+    assert len(outputs) == 12
+    assert 'reclaiming' in (tmp_path/'log').read_text()
+
+def test_task_killing_its_nodes_fails(tmp_path):
+    task = (tmp_path/'a.ORF',None,tmp_path/'a.jpg')
+    queues = [WorkQueue(tmp_path/'queue',node='node{}'.format(i),lease=0.1,retries=1) for i in range(3)]
+    queues[0].add([(1.,task)])
+    # every node claiming the task dies before its lease is renewed
+    assert [t for c,t in queues[0].claim()] == [task]
+    time.sleep(0.2)
+    assert [t for c,t in queues[1].claim()] == [task]
+    time.sleep(0.2)
+    assert queues[2].claim() == []
+    assert queues[2].counts()['failed'] == 1
+    assert queues[2].failed() == [(task,'lease of node1 expired')]